@@ -105,6 +105,14 @@ class Gsutil(object):
       return (404, out, err)
     return (code, out, err)
 
+  def stream(self, url):
+    """Starts downloading |url|. Returns the process, whose stdout is the
+    content of the object."""
+    cmd = [sys.executable, self.path, '--force-version', self.version,
+           'cat', url]
+    return subprocess2.Popen(cmd, stdout=subprocess2.PIPE,
+                             env=self.get_sub_env())
+
   def check_call_with_retries(self, *args):
     delay = self.RETRY_BASE_DELAY
     for i in xrange(self.MAX_TRIES):
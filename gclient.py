@@ -16,6 +16,14 @@
 #   .gclient_entries : A cache constructed by 'update' command.  Format is a
 #                   Python script defining 'entries', a list of the names
 #                   of all modules in the client
+#   .gclient_history : JSON file written by 'update' command with the last sync
+#                   duration of each module, used to start the modules on the
+#                   longest chains first. See gclient_history.py.
+#   .gclient_journal : dependencies synced by an unfinished 'update' command,
+#                   used by --resume. See gclient_journal.py.
+#   .gclient_deps_cache : evaluated DEPS files, keyed by their content, so
+#                   unchanged ones are not exec'd again. See
+#                   gclient_deps_cache.py.
 #   <module>/DEPS : Python script defining var 'deps' as a map from each
 #                   requisite submodule name to a URL where it can be found (via
 #                   one SCM)
@@ -46,6 +54,15 @@
 #     "name"     An optional string specifying the group to which a hook belongs
 #                for overriding and organizing.
 #
+#   With --hook-jobs greater than 1, hooks run concurrently. These optional keys
+#   constrain that:
+#     "parallel" If False, the hook runs alone: it starts after all the hooks
+#                listed before it are done and the hooks after it wait for it.
+#     "after"    A list of hook names which must have completed before this
+#                hook starts. Only hooks listed before this one are considered.
+#     "lock"     A string, or list of strings, naming resources. Two hooks
+#                sharing a lock never run at the same time.
+#
 #   Example:
 #     hooks = [
 #       { "pattern": "\\.(gif|jpe?g|pr0n|png)$",
@@ -82,6 +99,7 @@ __version__ = '0.7'
 
 import ast
 import copy
+import fnmatch
 import json
 import logging
 import optparse
@@ -91,12 +109,19 @@ import posixpath
 import pprint
 import re
 import sys
+import tempfile
+import threading
 import time
 import urllib
 import urlparse
 
 import fix_encoding
+import gclient_deps_cache
+import gclient_history
+import gclient_journal
 import gclient_scm
+import gclient_trace
+import gclient_trash
 import gclient_utils
 import git_cache
 from third_party.repo.progress import Progress
@@ -325,6 +350,8 @@ class Dependency(gclient_utils.WorkItem, DependencySettings):
     self._pre_deps_hooks_ran = False
     # This dependency had its hook run
     self._hooks_ran = False
+    # This dependency was synced by an interrupted sync and skipped by --resume.
+    self._resumed = False
     # This is the scm used to checkout self.url. It may be used by dependencies
     # to get the datetime of the revision we checked out.
     self._used_scm = None
@@ -332,6 +359,8 @@ class Dependency(gclient_utils.WorkItem, DependencySettings):
     # The actual revision we ended up getting, or None if that information is
     # unavailable
     self._got_revision = None
+    # The dict reported for this dependency by status or diff --json.
+    self._report = None
 
     # This is a mutable value that overrides the normal recursion limit for this
     # dependency.  It is read from the actual DEPS file so cannot be set on
@@ -389,6 +418,17 @@ class Dependency(gclient_utils.WorkItem, DependencySettings):
     logging.info('Dependency(%s).requirements = %s' % (self.name, requirements))
     return requirements
 
+  @property
+  def priority(self):
+    """Estimated seconds to sync this dependency and its recursed children.
+
+    Based on the durations recorded by the previous sync, if any.
+    """
+    history = self.root.sync_history
+    if not history or not self.name:
+      return 0
+    return history.critical_path(self.name)
+
   @property
   def try_recursedeps(self):
     """Returns False if recursion_override is ever specified."""
@@ -584,7 +624,14 @@ class Dependency(gclient_utils.WorkItem, DependencySettings):
       use_strict = 'use strict' in deps_content.splitlines()[0]
 
     local_scope = {}
-    if deps_content:
+    deps_cache = self.root.deps_cache
+    cache_key = None
+    if deps_content and deps_cache:
+      cache_key = deps_cache.Key(deps_content, self.custom_vars, use_strict)
+      local_scope = deps_cache.Get(cache_key) or {}
+      if local_scope:
+        logging.info('ParseDepsFile(%s): Using cached evaluation', self.name)
+    if deps_content and not local_scope:
       # One thing is unintuitive, vars = {} must happen before Var() use.
       var = self.VarImpl(self.custom_vars, local_scope)
       if use_strict:
@@ -612,6 +659,8 @@ class Dependency(gclient_utils.WorkItem, DependencySettings):
             raise gclient_utils.Error(
               'ParseDepsFile(%s): Strict mode disallows %r -> %r' %
               (self.name, key, val))
+      if cache_key:
+        deps_cache.Put(cache_key, deps_content, local_scope)
 
     deps = local_scope.get('deps', {})
     if 'recursion' in local_scope:
@@ -691,7 +740,10 @@ class Dependency(gclient_utils.WorkItem, DependencySettings):
     # Convert the deps into real Dependency.
     deps_to_add = []
     for name, url in deps.iteritems():
-      should_process = self.recursion_limit and self.should_process
+      should_process = bool(
+          self.recursion_limit and self.should_process and
+          (not self.root.only or
+           self.root.only.Wants(name, self.only_selected)))
       deps_file = self.deps_file
       if self.recursedeps is not None:
         ent = self.recursedeps.get(name)
@@ -715,7 +767,7 @@ class Dependency(gclient_utils.WorkItem, DependencySettings):
         hooks_to_run.append(hook)
 
     if self.recursion_limit:
-      self._pre_deps_hooks = [self.GetHookAction(hook, []) for hook in
+      self._pre_deps_hooks = [(hook, self.GetHookAction(hook, [])) for hook in
                               local_scope.get('pre_deps_hooks', [])]
 
     self.add_dependencies_and_close(deps_to_add, hooks_to_run)
@@ -746,6 +798,49 @@ class Dependency(gclient_utils.WorkItem, DependencySettings):
           bad_deps.append(dep)
     return bad_deps
 
+  @staticmethod
+  def _IterGitUrls(deps):
+    """Yields (dependency, parsed url) of the |deps| to process which are git
+    checkouts, before they run."""
+    for dep in deps:
+      if not dep.should_process:
+        continue
+      try:
+        parsed_url = dep.LateOverride(dep.url)
+      except gclient_utils.Error:
+        # From() may refer to a dependency which is not parsed yet; it's
+        # resolved when it's updated instead.
+        continue
+      if (isinstance(parsed_url, basestring) and
+          gclient_scm.GetScmName(parsed_url) == 'git'):
+        yield dep, parsed_url
+
+  def _PrefetchRemoteRefs(self, deps, revision_overrides):
+    """Starts resolving the branches and refs |deps| are synced to, all at
+    once, before they are updated one by one."""
+    wanted = {}
+    for dep, parsed_url in self._IterGitUrls(deps):
+      remote_ref = gclient_scm.GetRemoteRef(
+          parsed_url, revision_overrides.get(dep.name))
+      if remote_ref:
+        wanted.setdefault(remote_ref[0], []).append(remote_ref[1])
+    self.root.remote_refs.Prefetch(wanted)
+
+  def _CheckOffline(self, deps, revision_overrides):
+    """Raises an error listing the |deps| whose revision is neither in the
+    git cache nor in their checkout, for sync --offline."""
+    missing = []
+    for dep, parsed_url in self._IterGitUrls(deps):
+      checkout_path = os.path.join(self.root.root_dir, dep.name)
+      if not gclient_scm.GetLocalRevision(
+          parsed_url, checkout_path, revision_overrides.get(dep.name)):
+        missing.append('  %s: %s' % (dep.name, parsed_url))
+    if missing:
+      raise gclient_utils.Error(
+          'These dependencies are at revisions which are not available '
+          'locally, they can\'t be synced with --offline:\n%s' %
+          '\n'.join(missing))
+
   # Arguments number differs from overridden method
   # pylint: disable=arguments-differ
   def run(self, revision_overrides, command, args, work_queue, options):
@@ -768,17 +863,41 @@ class Dependency(gclient_utils.WorkItem, DependencySettings):
       self._used_revision = options.revision
       self._used_scm = gclient_scm.CreateSCM(
           parsed_url, self.root.root_dir, self.name, self.outbuf,
-          out_cb=work_queue.out_cb)
-      self._got_revision = self._used_scm.RunCommand(command, options, args,
-                                                     file_list)
+          out_cb=work_queue.out_cb, stages=work_queue.stages,
+          fetches=self.root.fetch_coordinator,
+          remote_refs=self.root.remote_refs)
+      if command == 'update':
+        self._set_resumed(self._ResumedRevision(parsed_url))
+      if self._resumed:
+        print('________ %s already synced to %s; skipping' % (
+            self.name, self._got_revision))
+      elif command in ('status', 'diff') and options.json:
+        start = time.time()
+        with gclient_trace.Span(command, 'scm', dep=self.name):
+          if command == 'status':
+            self._report = self._used_scm.GetStatus()
+          else:
+            self._report = self._used_scm.GetDiff()
+        self._report['seconds'] = round(time.time() - start, 3)
+      else:
+        with gclient_trace.Span(command, 'scm', dep=self.name):
+          self._got_revision = self._used_scm.RunCommand(
+              command, options, args, file_list)
+      # gclient_scm.AllFiles entries are kept unexpanded, only made to yield
+      # paths relative to the root.
       if file_list:
-        file_list = [os.path.join(self.name, f.strip()) for f in file_list]
+        file_list = [
+            os.path.join(self.name, f.strip())
+            if isinstance(f, basestring) else
+            gclient_scm.AllFiles(f.checkout_path, self.name)
+            for f in file_list]
 
       # TODO(phajdan.jr): We should know exactly when the paths are absolute.
       # Convert all absolute paths to relative.
       for i in range(len(file_list or [])):
         # It depends on the command being executed (like runhooks vs sync).
-        if not os.path.isabs(file_list[i]):
+        if (not isinstance(file_list[i], basestring) or
+            not os.path.isabs(file_list[i])):
           continue
         prefix = os.path.commonprefix(
             [self.root.root_dir.lower(), file_list[i].lower()])
@@ -788,12 +907,23 @@ class Dependency(gclient_utils.WorkItem, DependencySettings):
           file_list[i] = file_list[i][1:]
 
     # Always parse the DEPS file.
-    self.ParseDepsFile()
+    with gclient_trace.Span('parse DEPS', 'deps', dep=self.name):
+      self.ParseDepsFile()
     self._run_is_done(file_list or [], parsed_url)
-    if command in ('update', 'revert') and not options.noprehooks:
-      self.RunPreDepsHooks()
+    # A resumed dependency already ran its pre-DEPS hooks.
+    if (command in ('update', 'revert') and not options.noprehooks and
+        not self._resumed):
+      self.RunPreDepsHooks(options.hook_jobs, options.max_task_output)
+    if (command == 'update' and self._used_scm and not self._resumed and
+        self.root.sync_journal):
+      self.root.sync_journal.Record(
+          self.name, self._JournalUrl(parsed_url), self._got_revision)
 
     if self.recursion_limit:
+      if command == 'update' and options.offline:
+        self._CheckOffline(self.dependencies, revision_overrides)
+      if self.root.remote_refs:
+        self._PrefetchRemoteRefs(self.dependencies, revision_overrides)
       # Parse the dependencies of this dependency.
       for s in self.dependencies:
         work_queue.enqueue(s)
@@ -814,28 +944,7 @@ class Dependency(gclient_utils.WorkItem, DependencySettings):
         if options.prepend_dir and scm == 'git':
           print_stdout = False
           def filter_fn(line):
-            """Git-specific path marshaling. It is optimized for git-grep."""
-
-            def mod_path(git_pathspec):
-              match = re.match('^(\\S+?:)?([^\0]+)$', git_pathspec)
-              modified_path = os.path.join(self.name, match.group(2))
-              branch = match.group(1) or ''
-              return '%s%s' % (branch, modified_path)
-
-            match = re.match('^Binary file ([^\0]+) matches$', line)
-            if match:
-              print('Binary file %s matches\n' % mod_path(match.group(1)))
-              return
-
-            items = line.split('\0')
-            if len(items) == 2 and items[1]:
-              print('%s : %s' % (mod_path(items[0]), items[1]))
-            elif len(items) >= 2:
-              # Multiple null bytes or a single trailing null byte indicate
-              # git is likely displaying filenames only (such as with -l)
-              print('\n'.join(mod_path(path) for path in items if path))
-            else:
-              print(line)
+            print(PrependDir(self.name, line))
         else:
           print_stdout = True
           filter_fn = None
@@ -855,6 +964,33 @@ class Dependency(gclient_utils.WorkItem, DependencySettings):
           print('Skipped missing %s' % cwd, file=sys.stderr)
 
 
+  def _JournalUrl(self, parsed_url):
+    """Returns the url the journal keys this dependency on: the one it's
+    synced to, with the --revision override if any."""
+    if self._used_revision:
+      return '%s@%s' % (gclient_utils.SplitUrlRevision(str(parsed_url))[0],
+                        self._used_revision)
+    return str(parsed_url)
+
+  def _ResumedRevision(self, parsed_url):
+    """Returns the journaled revision if this dependency is still at it."""
+    journal = self.root.sync_journal
+    revision = journal and journal.Lookup(
+        self.name, self._JournalUrl(parsed_url))
+    if not revision:
+      return None
+    try:
+      if self._used_scm.revinfo(None, [], None) != revision:
+        return None
+    except (gclient_utils.Error, subprocess2.CalledProcessError, OSError):
+      return None
+    return revision
+
+  @gclient_utils.lockedmethod
+  def _set_resumed(self, revision):
+    self._got_revision = revision
+    self._resumed = bool(revision)
+
   @gclient_utils.lockedmethod
   def _run_is_done(self, file_list, parsed_url):
     # Both these are kept for hooks that are run as a separate tree traversal.
@@ -883,6 +1019,13 @@ class Dependency(gclient_utils.WorkItem, DependencySettings):
 
     RunOnDeps() must have been called before to load the DEPS.
     """
+    return [action for _, action in self.GetHookSpecs(options)]
+
+  def GetHookSpecs(self, options):
+    """Like GetHooks() but returns a list of (hook dict, action) tuples."""
+    return self._GetHookSpecs(options, self._MatchHookPatterns(options))
+
+  def _GetHookSpecs(self, options, matches):
     result = []
     if not self.should_process or not self.recursion_limit:
       # Don't run the hook when it is above recursion_limit.
@@ -890,49 +1033,73 @@ class Dependency(gclient_utils.WorkItem, DependencySettings):
     # If "--force" was specified, run all hooks regardless of what files have
     # changed.
     if self.deps_hooks:
-      # TODO(maruel): If the user is using git, then we don't know
-      # what files have changed so we always run all hooks. It'd be nice to fix
-      # that.
-      if (options.force or
-          gclient_scm.GetScmName(self.parsed_url) in ('git', None) or
-          os.path.isdir(os.path.join(self.root.root_dir, self.name, '.git'))):
+      if not self._UsesHookPatterns(options):
         for hook_dict in self.deps_hooks:
-          result.append(self.GetHookAction(hook_dict, []))
+          if self._IsHookSelected(hook_dict):
+            result.append((hook_dict, self.GetHookAction(hook_dict, [])))
       else:
         # Run hooks on the basis of whether the files from the gclient operation
         # match each hook's pattern.
-        for hook_dict in self.deps_hooks:
-          pattern = re.compile(hook_dict['pattern'])
-          matching_file_list = [
-              f for f in self.file_list_and_children if pattern.search(f)
-          ]
-          if matching_file_list:
-            result.append(self.GetHookAction(hook_dict, matching_file_list))
+        for hook_dict, matching_file_list in zip(
+            self.deps_hooks, matches[self.name]):
+          if matching_file_list and self._IsHookSelected(hook_dict):
+            result.append((hook_dict,
+                           self.GetHookAction(hook_dict, matching_file_list)))
     for s in self.dependencies:
-      result.extend(s.GetHooks(options))
+      result.extend(s._GetHookSpecs(options, matches))
     return result
 
+  def _IsHookSelected(self, hook_dict):
+    """Returns False if --only excludes the hook: it belongs to a dependency
+    only synced to evaluate its DEPS, and its pattern is not restricted to the
+    selected dependencies."""
+    return bool(
+        self.only_selected or
+        self.root.only.CoversPattern(hook_dict.get('pattern', '')))
+
+  def _UsesHookPatterns(self, options):
+    """Returns True if the hooks only run when changed files match their
+    pattern."""
+    # TODO(maruel): If the user is using git, then we don't know
+    # what files have changed so we always run all hooks. It'd be nice to fix
+    # that.
+    return bool(
+        self.deps_hooks and
+        self.should_process and self.recursion_limit and
+        not options.force and
+        gclient_scm.GetScmName(self.parsed_url) not in ('git', None) and
+        not os.path.isdir(os.path.join(self.root.root_dir, self.name, '.git')))
+
+  def _MatchHookPatterns(self, options):
+    """Matches the changed files of this tree against the hook patterns.
+
+    The file list of each dependency is read once and matched against the hooks
+    of all its ancestors at the same time. Returns a dict of dependency name to
+    the list of matching files of each of its hooks.
+    """
+    matches = {}
+    def walk(dep, matchers):
+      if dep._UsesHookPatterns(options):
+        matcher = HookMatcher(dep.deps_hooks)
+        matches[dep.name] = matcher.matches
+        matchers = matchers + [matcher]
+      if matchers:
+        for f in dep._IterFileList():
+          for matcher in matchers:
+            matcher.Add(f)
+      for d in dep.dependencies:
+        walk(d, matchers)
+    walk(self, [])
+    return matches
+
   def RunHooksRecursively(self, options):
     assert self.hooks_ran == False
     self._hooks_ran = True
-    for hook in self.GetHooks(options):
-      try:
-        start_time = time.time()
-        gclient_utils.CheckCallAndFilterAndHeader(
-            hook, cwd=self.root.root_dir, always=True)
-      except (gclient_utils.Error, subprocess2.CalledProcessError) as e:
-        # Use a discrete exit status code of 2 to indicate that a hook action
-        # failed.  Users of this script may wish to treat hook action failures
-        # differently from VC failures.
-        print('Error: %s' % str(e), file=sys.stderr)
-        sys.exit(2)
-      finally:
-        elapsed_time = time.time() - start_time
-        if elapsed_time > 10:
-          print("Hook '%s' took %.2f secs" % (
-              gclient_utils.CommandToStr(hook), elapsed_time))
+    RunHooks(self.GetHookSpecs(options), self.root.root_dir,
+             options.hook_jobs, options.max_task_output)
 
-  def RunPreDepsHooks(self):
+  def RunPreDepsHooks(self, hook_jobs=1,
+                      max_task_output=gclient_utils.DEFAULT_MAX_TASK_OUTPUT):
     assert self.processed
     assert self.deps_parsed
     assert not self.pre_deps_hooks_ran
@@ -940,22 +1107,8 @@ class Dependency(gclient_utils.WorkItem, DependencySettings):
     for s in self.dependencies:
       assert not s.processed
     self._pre_deps_hooks_ran = True
-    for hook in self.pre_deps_hooks:
-      try:
-        start_time = time.time()
-        gclient_utils.CheckCallAndFilterAndHeader(
-            hook, cwd=self.root.root_dir, always=True)
-      except (gclient_utils.Error, subprocess2.CalledProcessError) as e:
-        # Use a discrete exit status code of 2 to indicate that a hook action
-        # failed.  Users of this script may wish to treat hook action failures
-        # differently from VC failures.
-        print('Error: %s' % str(e), file=sys.stderr)
-        sys.exit(2)
-      finally:
-        elapsed_time = time.time() - start_time
-        if elapsed_time > 10:
-          print("Hook '%s' took %.2f secs" % (
-              gclient_utils.CommandToStr(hook), elapsed_time))
+    RunHooks(self.pre_deps_hooks, self.root.root_dir, hook_jobs,
+             max_task_output)
 
 
   def subtree(self, include_all):
@@ -1026,6 +1179,21 @@ class Dependency(gclient_utils.WorkItem, DependencySettings):
   def hooks_ran(self):
     return self._hooks_ran
 
+  @property
+  @gclient_utils.lockedmethod
+  def resumed(self):
+    return self._resumed
+
+  @property
+  def only_selected(self):
+    """Returns True if this dependency is in a subtree selected by --only.
+
+    Without --only, all the dependencies are selected.
+    """
+    only = self.root.only
+    return bool(
+        not only or only.Matches(self.name) or self.parent.only_selected)
+
   @property
   @gclient_utils.lockedmethod
   def allowed_hosts(self):
@@ -1046,12 +1214,31 @@ class Dependency(gclient_utils.WorkItem, DependencySettings):
   def got_revision(self):
     return self._got_revision
 
+  @property
+  def report(self):
+    return self._report
+
   @property
   def file_list_and_children(self):
-    result = list(self.file_list)
+    return tuple(self.IterFileListAndChildren())
+
+  def IterFileListAndChildren(self):
+    """Yields the files of file_list and of the dependencies' file_list."""
+    for f in self._IterFileList():
+      yield f
     for d in self.dependencies:
-      result.extend(d.file_list_and_children)
-    return tuple(result)
+      for f in d.IterFileListAndChildren():
+        yield f
+
+  def _IterFileList(self):
+    """Yields the files of file_list, expanding the gclient_scm.AllFiles
+    entries lazily."""
+    for f in self.file_list:
+      if isinstance(f, basestring):
+        yield f
+      else:
+        for path in f:
+          yield path
 
   def __str__(self):
     out = []
@@ -1085,6 +1272,371 @@ class Dependency(gclient_utils.WorkItem, DependencySettings):
     return out
 
 
+class HookMatcher(object):
+  """Matches files against the patterns of a list of hooks.
+
+  Most files match no hook. A single alternation of all the patterns rejects
+  those with one regexp search instead of one per hook; the files it accepts
+  are then searched with each pattern to know which hooks they trigger.
+  """
+
+  def __init__(self, hook_dicts):
+    self.patterns = [re.compile(h['pattern']) for h in hook_dicts]
+    # For each hook, the files matching its pattern.
+    self.matches = [[] for _ in hook_dicts]
+    # Group numbers and flags of a pattern would apply to the other patterns
+    # of the alternation, so such patterns are always searched individually.
+    combined = [
+        p.pattern for p in self.patterns if not p.groups and not p.flags]
+    self._always = [
+        (p, m) for p, m in zip(self.patterns, self.matches)
+        if p.groups or p.flags]
+    self._any = None
+    if combined:
+      self._any = re.compile('|'.join('(?:%s)' % p for p in combined))
+
+  def Add(self, path):
+    if self._any and self._any.search(path):
+      candidates = zip(self.patterns, self.matches)
+    else:
+      candidates = self._always
+    for pattern, matches in candidates:
+      if pattern.search(path):
+        matches.append(path)
+
+
+class Hook(gclient_utils.WorkItem):
+  """One hook action, as run by RunHooks() on an ExecutionQueue."""
+
+  def __init__(self, name, action, requirements, resources):
+    gclient_utils.WorkItem.__init__(self, name)
+    self.action = action
+    self._requirements = tuple(requirements)
+    self.resources.extend(resources)
+
+  @property
+  def requirements(self):
+    return self._requirements
+
+  # Arguments number differs from overridden method
+  # pylint: disable=arguments-differ
+  def run(self, cwd, work_queue):
+    RunHookAction(self.action, cwd, self.outbuf)
+
+
+def RunHookAction(action, cwd, stdout=None):
+  """Runs one hook action, reporting it when it is slow."""
+  stdout = stdout or sys.stdout
+  start_time = time.time()
+  try:
+    with gclient_trace.Span(gclient_utils.CommandToStr(action), 'hook'):
+      gclient_utils.CheckCallAndFilterAndHeader(
+          action, cwd=cwd, always=True, stdout=stdout)
+  finally:
+    elapsed_time = time.time() - start_time
+    if elapsed_time > 10:
+      print("Hook '%s' took %.2f secs" % (
+          gclient_utils.CommandToStr(action), elapsed_time), file=stdout)
+
+
+def MakeHookItems(hooks):
+  """Converts (hook dict, action) tuples into Hook work items.
+
+  The "parallel", "after" and "lock" keys of each hook dict are turned into
+  requirements and resources. See the comment at the top of this file.
+  """
+  items = []
+  names = {}
+  barrier = None
+  since_barrier = []
+  for index, (hook_dict, action) in enumerate(hooks):
+    hook_name = hook_dict.get('name', '')
+    item_name = '%d: %s' % (
+        index + 1, hook_name or gclient_utils.CommandToStr(action))
+    requirements = []
+    for after in hook_dict.get('after', []):
+      if after not in names:
+        logging.warning(
+            'Hook %s can only run after hooks listed before it, ignoring %s',
+            item_name, after)
+      requirements.extend(names.get(after, []))
+    if hook_dict.get('parallel', True):
+      if barrier:
+        requirements.append(barrier)
+      since_barrier.append(item_name)
+    else:
+      requirements.extend(since_barrier)
+      if barrier:
+        requirements.append(barrier)
+      barrier = item_name
+      since_barrier = []
+    locks = hook_dict.get('lock', [])
+    if isinstance(locks, basestring):
+      locks = [locks]
+    items.append(Hook(item_name, action, requirements, locks))
+    if hook_name:
+      names.setdefault(hook_name, []).append(item_name)
+  return items
+
+
+def RunHooks(hooks, cwd, jobs=1,
+             max_task_output=gclient_utils.DEFAULT_MAX_TASK_OUTPUT):
+  """Runs a list of (hook dict, action) tuples in |cwd|.
+
+  With |jobs| greater than 1, up to |jobs| hooks run concurrently and the output
+  of each is buffered, up to |max_task_output| bytes in memory, and printed once
+  it completes.
+
+  Exits with status 2 if a hook fails.
+  """
+  try:
+    if jobs <= 1:
+      for _, action in hooks:
+        RunHookAction(action, cwd)
+    else:
+      work_queue = gclient_utils.ExecutionQueue(
+          jobs, None, False, verbose=True, max_task_output=max_task_output)
+      for item in MakeHookItems(hooks):
+        work_queue.enqueue(item)
+      work_queue.flush(cwd)
+  except (gclient_utils.Error, subprocess2.CalledProcessError) as e:
+    # Use a discrete exit status code of 2 to indicate that a hook action
+    # failed.  Users of this script may wish to treat hook action failures
+    # differently from VC failures.
+    print('Error: %s' % str(e), file=sys.stderr)
+    sys.exit(2)
+
+
+def PrependDir(name, line):
+  """Makes the paths in a line of 'git <cmd> --null' output, run in the
+  dependency |name|, relative to the gclient root.
+
+  Git-specific path marshaling. It is optimized for git-grep.
+  """
+  def mod_path(git_pathspec):
+    match = re.match('^(\\S+?:)?([^\0]+)$', git_pathspec)
+    modified_path = os.path.join(name, match.group(2))
+    branch = match.group(1) or ''
+    return '%s%s' % (branch, modified_path)
+
+  match = re.match('^Binary file ([^\0]+) matches$', line)
+  if match:
+    return 'Binary file %s matches\n' % mod_path(match.group(1))
+
+  items = line.split('\0')
+  if len(items) == 2 and items[1]:
+    return '%s : %s' % (mod_path(items[0]), items[1])
+  elif len(items) >= 2:
+    # Multiple null bytes or a single trailing null byte indicate
+    # git is likely displaying filenames only (such as with -l)
+    return '\n'.join(mod_path(path) for path in items if path)
+  return line
+
+
+class ParallelGrep(object):
+  """Runs git grep in many checkouts at once.
+
+  The output of each checkout is buffered, and printed in the order of the
+  checkouts as soon as the checkouts before it are done too, so that it never
+  interleaves. Once |max_lines| lines are printed, the remaining git greps are
+  stopped or not started at all.
+  """
+  def __init__(self, root_dir, names, args, jobs, max_lines=None):
+    self._root_dir = root_dir
+    self._names = names
+    self._args = args
+    self._jobs = max(1, min(jobs, len(names)))
+    self._max_lines = max_lines
+    self._cond = threading.Condition()
+    # ('ok', (gclient_utils.TaskOutput, number of lines, stderr)) of each
+    # checkout once done, or ('error', exc_info) of the exception it failed
+    # with.
+    self._results = [None] * len(names)
+    self._next = 0
+    self._stopped = False
+    self._procs = set()
+
+  def Run(self, stream=sys.stdout, err_stream=sys.stderr):
+    """Writes the output to |stream| and returns the number of lines.
+
+    Raises the exception the first checkout which failed failed with.
+    """
+    threads = [
+        threading.Thread(target=self._Worker) for _ in xrange(self._jobs)]
+    for t in threads:
+      t.daemon = True
+      t.start()
+    printed = 0
+    try:
+      for i in xrange(len(self._names)):
+        with self._cond:
+          while self._results[i] is None:
+            # Without a timeout, the wait can't be interrupted with Ctrl-C.
+            self._cond.wait(1)
+        status, result = self._results[i]
+        self._results[i] = None
+        if status == 'error':
+          raise result[0], result[1], result[2]
+        output, lines, errors = result
+        if errors:
+          err_stream.write(errors)
+          err_stream.flush()
+        if self._max_lines:
+          lines = min(lines, self._max_lines - printed)
+          self._WriteLines(output, lines, stream)
+        else:
+          output.write_to(stream)
+        stream.flush()
+        printed += lines
+        if self._max_lines and printed >= self._max_lines:
+          break
+    finally:
+      self._Stop()
+      for t in threads:
+        t.join()
+    return printed
+
+  @staticmethod
+  def _WriteLines(output, count, stream):
+    """Writes the first |count| lines of |output| to |stream|."""
+    for chunk in output.chunks():
+      if not count:
+        return
+      end = -1
+      for _ in xrange(count):
+        end = chunk.find('\n', end + 1)
+        if end == -1:
+          break
+        count -= 1
+      if end == -1:
+        stream.write(chunk)
+      else:
+        stream.write(chunk[:end + 1])
+
+  def _Stop(self):
+    with self._cond:
+      self._stopped = True
+      procs = list(self._procs)
+    for proc in procs:
+      try:
+        proc.kill()
+      except OSError:
+        pass
+
+  def _Worker(self):
+    while True:
+      with self._cond:
+        if self._stopped or self._next == len(self._names):
+          return
+        i = self._next
+        self._next += 1
+      try:
+        result = ('ok', self._Grep(self._names[i]))
+      except Exception:  # pylint: disable=broad-except
+        # Raised again by Run() in the main thread.
+        result = ('error', sys.exc_info())
+      with self._cond:
+        self._results[i] = result
+        self._cond.notify_all()
+
+  def _Grep(self, name):
+    """Returns the output of git grep in |name|, its number of lines and its
+    stderr."""
+    output = gclient_utils.TaskOutput()
+    lines = 0
+    with tempfile.TemporaryFile() as errors:
+      proc = subprocess2.Popen(
+          ['git', 'grep', '--null', '--color=Always'] + self._args,
+          cwd=os.path.join(self._root_dir, name), stdout=subprocess2.PIPE,
+          stderr=errors)
+      with self._cond:
+        if self._stopped:
+          proc.kill()
+        self._procs.add(proc)
+      try:
+        for line in iter(proc.stdout.readline, ''):
+          text = PrependDir(name, line.rstrip('\r\n')) + '\n'
+          output.write(text)
+          lines += text.count('\n')
+          if self._max_lines and lines >= self._max_lines:
+            # No checkout needs more.
+            break
+      finally:
+        with self._cond:
+          self._procs.discard(proc)
+        if proc.poll() is None:
+          try:
+            proc.kill()
+          except OSError:
+            pass
+        proc.stdout.close()
+        proc.wait()
+      errors.seek(0)
+      return output, lines, errors.read()
+
+
+class DepsSelection(object):
+  """The dependencies selected by 'gclient sync --only', as path globs.
+
+  The dependencies matching a glob, or below a directory matching one, are
+  processed with all their own dependencies. The other dependencies are only
+  processed if they may list a matching one in their DEPS.
+  """
+
+  def __init__(self, globs):
+    self.globs = [g.strip().rstrip('/') for g in globs if g.strip()]
+
+  def Matches(self, name):
+    """Returns True if |name|, or a directory containing it, matches a glob."""
+    parts = name.split('/')
+    for n in xrange(1, len(parts) + 1):
+      path = '/'.join(parts[:n])
+      if any(fnmatch.fnmatchcase(path, g) for g in self.globs):
+        return True
+    return False
+
+  def MayContain(self, name):
+    """Returns True if a dependency below |name| can match a glob."""
+    prefix = name.rstrip('/') + '/'
+    for glob in self.globs:
+      literal = re.split(r'[*?[]', glob, 1)[0]
+      if literal.startswith(prefix):
+        return True
+      # A wildcard matches anything after |literal|, including '/'.
+      if literal != glob and prefix.startswith(literal):
+        return True
+    return False
+
+  def Wants(self, name, parent_selected):
+    """Returns True if the dependency |name| has to be processed."""
+    return parent_selected or self.Matches(name) or self.MayContain(name)
+
+  def CoversPattern(self, pattern):
+    """Returns True if the hook |pattern| only matches files of selected
+    dependencies, as far as its anchored literal start tells."""
+    if not pattern.startswith('^') or '|' in pattern:
+      return False
+    literal = ''
+    i = 1
+    while i < len(pattern):
+      c = pattern[i]
+      if c == '\\' and i + 1 < len(pattern) and not pattern[i + 1].isalnum():
+        literal += pattern[i + 1]
+        i += 2
+        continue
+      if c in '*+?{':
+        # The quantifier applies to the last character.
+        literal = literal[:-1]
+        break
+      if c in '.^$[]()':
+        break
+      literal += c
+      i += 1
+    parts = literal.split('/')
+    return any(
+        self.Matches('/'.join(parts[:n])) for n in xrange(1, len(parts)))
+
+
 class GClient(Dependency):
   """Object that represent a gclient checkout. A tree of Dependency(), one per
   solution or DEPS entry."""
@@ -1147,6 +1699,20 @@ solutions = [
     self._enforced_os = tuple(set(enforced_os))
     self._root_dir = root_dir
     self.config_content = None
+    # gclient_history.SyncHistory of the previous sync, only set for 'update'.
+    self.sync_history = None
+    # gclient_deps_cache.DepsCache, set while running on the dependencies.
+    self.deps_cache = None
+    # gclient_scm.FetchCoordinator shared by the dependencies of a run.
+    self.fetch_coordinator = None
+    # gclient_scm.RemoteRefs of the running sync, only set for 'update'.
+    self.remote_refs = None
+    # gclient_journal.SyncJournal of the running sync, only set for 'update'.
+    self.sync_journal = None
+    # DepsSelection of --only, None to process all the dependencies.
+    self.only = None
+    if options.only:
+      self.only = DepsSelection(options.only.split(','))
 
   def _CheckConfig(self):
     """Verify that the config matches the state of the existing checked-out
@@ -1224,7 +1790,7 @@ it or fix the checkout.
             s.get('custom_vars', {}),
             s.get('custom_hooks', []),
             s.get('deps_file', 'DEPS'),
-            True,
+            not self.only or self.only.Wants(s['name'], False),
             None))
       except KeyError:
         raise gclient_utils.Error('Invalid .gclient file. Solution is '
@@ -1278,17 +1844,22 @@ it or fix the checkout.
       'cache_dir': cache_dir,
     })
 
-  def _SaveEntries(self):
+  def _SaveEntries(self, previous_entries=None):
     """Creates a .gclient_entries file to record the list of unique checkouts.
 
-    The .gclient_entries file lives in the same directory as .gclient.
+    The .gclient_entries file lives in the same directory as .gclient. The
+    |previous_entries| which were not processed are kept.
     """
+    entries = [(e.name, e.parsed_url) for e in self.root.subtree(False)]
+    names = set(name for name, _ in entries)
+    entries.extend(sorted(
+        (name, url) for name, url in (previous_entries or {}).iteritems()
+        if name not in names))
     # Sometimes pprint.pformat will use {', sometimes it'll use { ' ... It
     # makes testing a bit too fun.
     result = 'entries = {\n'
-    for entry in self.root.subtree(False):
-      result += '  %s: %s,\n' % (pprint.pformat(entry.name),
-          pprint.pformat(entry.parsed_url))
+    for name, url in entries:
+      result += '  %s: %s,\n' % (pprint.pformat(name), pprint.pformat(url))
     result += '}\n'
     file_path = os.path.join(self.root_dir, self._options.entries_filename)
     logging.debug(result)
@@ -1311,6 +1882,33 @@ it or fix the checkout.
       gclient_utils.SyntaxErrorToError(filename, e)
     return scope['entries']
 
+  def _SaveSyncHistory(self, path):
+    """Records the duration of each dependency processed by this sync."""
+    history = self.sync_history
+    history.solutions = [d.name for d in self.dependencies]
+    for d in self.subtree(False):
+      if not d.start or not d.finish:
+        continue
+      history.Record(
+          d.name, (d.finish - d.start).total_seconds(),
+          [c.name for c in d.dependencies if c.should_process])
+    history.Save(path)
+
+  def _LoadDepsCache(self):
+    self.deps_cache = gclient_deps_cache.DepsCache.Load(
+        os.path.join(self.root_dir, self._options.deps_cache_filename))
+
+  def _SaveDepsCache(self):
+    """Saves the DEPS evaluations used by this run and reports the hit rate."""
+    try:
+      self.deps_cache.Save(
+          os.path.join(self.root_dir, self._options.deps_cache_filename))
+    except (IOError, OSError) as e:
+      logging.warning('Failed to save the DEPS cache: %s', e)
+    if self._options.verbose:
+      print('DEPS cache: %d hits, %d misses' % (
+          self.deps_cache.hits, self.deps_cache.misses))
+
   def _EnforceRevisions(self):
     """Checks for revision overrides."""
     revision_overrides = {}
@@ -1349,6 +1947,16 @@ it or fix the checkout.
     if command not in ('diff', 'recurse', 'runhooks', 'status', 'revert'):
       self._CheckConfig()
       revision_overrides = self._EnforceRevisions()
+    history_path = os.path.join(self.root_dir, self._options.history_filename)
+    if command == 'update':
+      self.sync_history = gclient_history.SyncHistory.Load(history_path)
+      self.sync_journal = gclient_journal.SyncJournal.Open(
+          os.path.join(self.root_dir, self._options.journal_filename),
+          self._options.resume)
+      # Finish deleting what an interrupted sync left in the trash.
+      gclient_trash.EmptyInBackground(self.root_dir)
+    self._LoadDepsCache()
+    self.fetch_coordinator = gclient_scm.FetchCoordinator()
     pm = None
     # Disable progress for non-tty stdout.
     if (setup_color.IS_TTY and not self._options.verbose and progress):
@@ -1358,10 +1966,33 @@ it or fix the checkout.
         pm = Progress(' '.join(args), 1)
     work_queue = gclient_utils.ExecutionQueue(
         self._options.jobs, pm, ignore_requirements=ignore_requirements,
-        verbose=self._options.verbose)
+        verbose=self._options.verbose,
+        stage_limits={
+            'fetch': self._options.fetch_jobs,
+            'checkout': self._options.checkout_jobs,
+        },
+        max_task_output=self._options.max_task_output)
+    if command == 'update' and self._options.offline:
+      self._CheckOffline(self.dependencies, revision_overrides)
+    elif command == 'update':
+      self.remote_refs = gclient_scm.RemoteRefs(
+          self._options.fetch_jobs or self._options.jobs)
+      self._PrefetchRemoteRefs(self.dependencies, revision_overrides)
     for s in self.dependencies:
       work_queue.enqueue(s)
     work_queue.flush(revision_overrides, command, args, options=self._options)
+    self._SaveDepsCache()
+    if self.remote_refs and self._options.verbose:
+      print('Resolved branches and refs with %d git ls-remote calls.' %
+            self.remote_refs.lists)
+    if self.fetch_coordinator.saved:
+      print('Reused %d mirror fetches, %d fetched.' % (
+          self.fetch_coordinator.saved, self.fetch_coordinator.fetches))
+    resumed = sum(1 for d in self.subtree(False) if d.resumed)
+    if resumed:
+      print('Resumed an interrupted sync: skipped %d dependencies.' % resumed)
+    if command == 'update':
+      self._SaveSyncHistory(history_path)
     if revision_overrides:
       print('Please fix your script, having invalid --revision flags will soon '
             'considered an error.', file=sys.stderr)
@@ -1379,7 +2010,11 @@ it or fix the checkout.
       full_entries = [os.path.join(self.root_dir, e.replace('/', os.path.sep))
                       for e in entries]
 
-      for entry, prev_url in self._ReadEntries().iteritems():
+      previous_entries = self._ReadEntries()
+      # A sync with --only did not look at the other dependencies, which are
+      # not orphaned.
+      for entry, prev_url in (
+          {} if self.only else previous_entries).iteritems():
         if not prev_url:
           # entry must have been overridden via .gclient custom_deps
           continue
@@ -1422,7 +2057,7 @@ it or fix the checkout.
                 save_dir = scm.GetGitBackupDirPath()
                 # Remove any eventual stale backup dir for the same project.
                 if os.path.exists(save_dir):
-                  gclient_utils.rmtree(save_dir)
+                  gclient_trash.Move(self.root_dir, save_dir)
                 os.rename(os.path.join(e_dir, '.git'), save_dir)
                 # When switching between the two states (entry/ is a subproject
                 # -> entry/ is part of the outer project), it is very likely
@@ -1460,20 +2095,39 @@ it or fix the checkout.
             # Delete the entry
             print('\n________ deleting \'%s\' in \'%s\'' % (
                 entry_fixed, self.root_dir))
-            gclient_utils.rmtree(e_dir)
+            gclient_trash.Move(self.root_dir, e_dir)
+      # The deleted checkouts, and any left over by an earlier sync, are
+      # removed by a background process so that the sync ends right away.
+      gclient_trash.EmptyInBackground(self.root_dir)
       # record the current list of entries for next time
-      self._SaveEntries()
+      self._SaveEntries(previous_entries if self.only else None)
+      # The sync completed, there is nothing left to resume.
+      self.sync_journal.Delete()
     return 0
 
+  def PrintReports(self):
+    """Prints the reports of status or diff --json as one JSON document."""
+    reports = {}
+    for d in self.subtree(False):
+      if d.report is not None:
+        report = dict(d.report)
+        report['url'] = str(d.parsed_url)
+        reports[d.name.replace('\\', '/')] = report
+    json.dump({'dependencies': reports}, sys.stdout, indent=2, sort_keys=True)
+    print()
+
   def PrintRevInfo(self):
     if not self.dependencies:
       raise gclient_utils.Error('No solution specified')
     # Load all the settings.
+    self._LoadDepsCache()
     work_queue = gclient_utils.ExecutionQueue(
-        self._options.jobs, None, False, verbose=self._options.verbose)
+        self._options.jobs, None, False, verbose=self._options.verbose,
+        max_task_output=self._options.max_task_output)
     for s in self.dependencies:
       work_queue.enqueue(s)
     work_queue.flush({}, None, [], options=self._options)
+    self._SaveDepsCache()
 
     def GetURLAndRev(dep):
       """Returns the revision-qualified SCM url for a Dependency."""
@@ -1559,6 +2213,11 @@ it or fix the checkout.
   def target_os(self):
     return self._enforced_os
 
+  @property
+  def only_selected(self):
+    """Solutions are only selected by matching --only."""
+    return not self.only
+
 
 #### gclient commands.
 
@@ -1625,24 +2284,54 @@ def CMDgrep(parser, args):
   # to git grep and throw an error. :-(
   if not args or re.match('(-h|--help)$', args[0]):
     print(
-        'Usage: gclient grep [-j <N>] git-grep-args...\n\n'
+        'Usage: gclient grep [-j <N>] [--max-lines <N>] git-grep-args...\n\n'
         'Example: "gclient grep -j10 -A2 RefCountedBase" runs\n"git grep '
         '-A2 RefCountedBase" on each of gclient\'s git\nrepos with up to '
-        '10 jobs.\n\nBonus: page output by appending "|& less -FRSX" to the'
-        ' end of your query.',
+        '10 jobs.\n\nThe repos are grepped in parallel, %d at once by '
+        'default, and their\noutput is printed in the order of their paths. '
+        '--max-lines stops after\nprinting that many lines.\n\n'
+        'Bonus: page output by appending "|& less -FRSX" to the'
+        ' end of your query.' % parser.get_default_values().jobs,
         file=sys.stderr)
     return 1
 
-  jobs_arg = ['--jobs=1']
-  if re.match(r'(-j|--jobs=)\d+$', args[0]):
-    jobs_arg, args = args[:1], args[1:]
-  elif re.match(r'(-j|--jobs)$', args[0]):
-    jobs_arg, args = args[:2], args[2:]
+  jobs = parser.get_default_values().jobs
+  max_lines = None
+  while args:
+    match = re.match(r'(-j|--jobs=?|--max-lines=?)(\d*)$', args[0])
+    if not match:
+      break
+    flag, value = match.groups()
+    if not value and len(args) > 1 and args[1].isdigit():
+      value, args = args[1], args[1:]
+    if not value:
+      print('%s needs a number.' % flag.rstrip('='), file=sys.stderr)
+      return 1
+    args = args[1:]
+    if flag.startswith('--max-lines'):
+      max_lines = int(value)
+    else:
+      jobs = int(value)
 
-  return CMDrecurse(
-      parser,
-      jobs_arg + ['--ignore', '--prepend-dir', '--no-progress', '--scm=git',
-                  'git', 'grep', '--null', '--color=Always'] + args)
+  root_and_entries = gclient_utils.GetGClientRootAndEntries()
+  if not root_and_entries:
+    print(
+        'You need to run gclient sync at least once to use \'grep\'.\n'
+        'This is because .gclient_entries needs to exist and be up to date.',
+        file=sys.stderr)
+    return 1
+  root_dir, entries = root_and_entries
+  names = []
+  for name, url in sorted(entries.iteritems()):
+    if gclient_scm.GetScmName(url) != 'git':
+      continue
+    if not os.path.exists(os.path.join(root_dir, name, '.git')):
+      print('Skipped missing %s' % os.path.join(root_dir, name),
+            file=sys.stderr)
+      continue
+    names.append(name)
+  ParallelGrep(root_dir, names, args, jobs, max_lines).Run()
+  return 0
 
 
 def CMDroot(parser, args):
@@ -1749,13 +2438,39 @@ def CMDpack(parser, args):
   return client.RunOnDeps('pack', args)
 
 
+def _RunWithReports(options, command, args):
+  """Runs |command| on the dependencies, then prints their reports as JSON.
+
+  Everything else printed meanwhile goes to stderr, so that stdout is only the
+  JSON document.
+  """
+  stdout = sys.stdout
+  sys.stdout = sys.stderr
+  try:
+    client = GClient.LoadCurrentConfig(options)
+    if not client:
+      raise gclient_utils.Error(
+          'client not configured; see \'gclient config\'')
+    ret = client.RunOnDeps(command, args)
+  finally:
+    sys.stdout = stdout
+  client.PrintReports()
+  return ret
+
+
 def CMDstatus(parser, args):
   """Shows modification status for every dependencies."""
   parser.add_option('--deps', dest='deps_os', metavar='OS_LIST',
                     help='override deps for the specified (comma-separated) '
                          'platform(s); \'all\' will process all deps_os '
                          'references')
+  parser.add_option('--json', action='store_true',
+                    help='Print a JSON document with the dirty files of each '
+                         'dependency, how far HEAD is ahead and behind its '
+                         'upstream, and how long it took, instead of text.')
   (options, args) = parser.parse_args(args)
+  if options.json:
+    return _RunWithReports(options, 'status', args)
   client = GClient.LoadCurrentConfig(options)
   if not client:
     raise gclient_utils.Error('client not configured; see \'gclient config\'')
@@ -1797,6 +2512,10 @@ def CMDsync(parser, args):
                     help='don\'t run hooks after the update is complete')
   parser.add_option('-p', '--noprehooks', action='store_true',
                     help='don\'t run pre-DEPS hooks', default=False)
+  parser.add_option('--hook-jobs', type='int', default=1,
+                    help='Number of hooks allowed to run in parallel. Hooks '
+                         'can opt out or be ordered with the "parallel", '
+                         '"after" and "lock" keys. Default is %default.')
   parser.add_option('-r', '--revision', action='append',
                     dest='revisions', metavar='REV', default=[],
                     help='Enforces revision/hash for the solutions with the '
@@ -1838,6 +2557,34 @@ def CMDsync(parser, args):
   parser.add_option('--output-json',
                     help='Output a json document to this path containing '
                          'summary information about the sync.')
+  parser.add_option('--fetch-jobs', type='int', default=0,
+                    help='Maximum number of git fetches and clones running at '
+                         'once, to spare the git server. Default is --jobs.')
+  parser.add_option('--checkout-jobs', type='int', default=0,
+                    help='Maximum number of git checkouts, merges and rebases '
+                         'running at once. Default is --jobs. When both this '
+                         'and --fetch-jobs are set, --jobs is raised to their '
+                         'sum if lower.')
+  parser.add_option('--only', metavar='GLOBS',
+                    help='Comma separated globs of the dependency paths to '
+                         'sync, e.g. src/third_party/foo*. The dependencies '
+                         'whose DEPS list them are synced too. Other '
+                         'checkouts are left alone, and only the hooks of the '
+                         'selected dependencies, or whose pattern is inside '
+                         'them, run.')
+  parser.add_option('--resume', action='store_true',
+                    help='Resume an interrupted sync: skip the dependencies it '
+                         'already synced if they are still at the revision it '
+                         'got. See .gclient_journal.')
+  parser.add_option('--offline', action='store_true',
+                    help='Sync without network access, from the git cache '
+                         'and the existing checkouts only. Fails before '
+                         'syncing a DEPS file if any of its dependencies is '
+                         'at a revision which isn\'t available locally.')
+  parser.add_option('--trace', metavar='FILE',
+                    help='Write a Chrome trace-event file (for '
+                         'chrome://tracing) of where the time went and print '
+                         'the slowest steps at the end.')
   parser.add_option('--no-history', action='store_true',
                     help='GIT ONLY - Reduces the size/time of the checkout at '
                     'the cost of no history. Requires Git 1.9+')
@@ -1874,7 +2621,13 @@ def CMDsync(parser, args):
 
   if options.verbose:
     client.PrintLocationAndContents()
-  ret = client.RunOnDeps('update', args)
+  if options.trace:
+    gclient_trace.Start()
+  try:
+    ret = client.RunOnDeps('update', args)
+  finally:
+    if options.trace:
+      print(gclient_trace.Stop(options.trace))
   if options.output_json:
     slns = {}
     for d in client.subtree(True):
@@ -1898,7 +2651,12 @@ def CMDdiff(parser, args):
                     help='override deps for the specified (comma-separated) '
                          'platform(s); \'all\' will process all deps_os '
                          'references')
+  parser.add_option('--json', action='store_true',
+                    help='Print a JSON document with the diff of each '
+                         'dependency and how long it took, instead of text.')
   (options, args) = parser.parse_args(args)
+  if options.json:
+    return _RunWithReports(options, 'diff', args)
   client = GClient.LoadCurrentConfig(options)
   if not client:
     raise gclient_utils.Error('client not configured; see \'gclient config\'')
@@ -1920,6 +2678,10 @@ def CMDrevert(parser, args):
                     help='don\'t run hooks after the revert is complete')
   parser.add_option('-p', '--noprehooks', action='store_true',
                     help='don\'t run pre-DEPS hooks', default=False)
+  parser.add_option('--hook-jobs', type='int', default=1,
+                    help='Number of hooks allowed to run in parallel. Hooks '
+                         'can opt out or be ordered with the "parallel", '
+                         '"after" and "lock" keys. Default is %default.')
   parser.add_option('--upstream', action='store_true',
                     help='Make repo state match upstream branch.')
   parser.add_option('--break_repo_locks', action='store_true',
@@ -1947,6 +2709,10 @@ def CMDrunhooks(parser, args):
                          'references')
   parser.add_option('-f', '--force', action='store_true', default=True,
                     help='Deprecated. No effect.')
+  parser.add_option('--hook-jobs', type='int', default=1,
+                    help='Number of hooks allowed to run in parallel. Hooks '
+                         'can opt out or be ordered with the "parallel", '
+                         '"after" and "lock" keys. Default is %default.')
   (options, args) = parser.parse_args(args)
   client = GClient.LoadCurrentConfig(options)
   if not client:
@@ -2049,6 +2815,11 @@ class OptionParser(optparse.OptionParser):
     self.add_option(
         '--no-nag-max', default=False, action='store_true',
         help='Ignored for backwards compatibility.')
+    self.add_option(
+        '--max-task-output', type='int', metavar='BYTES',
+        default=gclient_utils.DEFAULT_MAX_TASK_OUTPUT,
+        help='Bytes of output kept in memory per task; the rest is '
+             'buffered in a temporary file. 0 for no limit.')
 
   def parse_args(self, args=None, values=None):
     """Integrates standard options processing."""
@@ -2065,8 +2836,13 @@ class OptionParser(optparse.OptionParser):
     if not options.config_filename:
       options.config_filename = self.gclientfile_default
     options.entries_filename = options.config_filename + '_entries'
+    options.history_filename = options.config_filename + '_history'
+    options.deps_cache_filename = options.config_filename + '_deps_cache'
+    options.journal_filename = options.config_filename + '_journal'
     if options.jobs < 1:
       self.error('--jobs must be 1 or higher')
+    if options.max_task_output < 0:
+      self.error('--max-task-output must be 0 or higher')
 
     # These hacks need to die.
     if not hasattr(options, 'revisions'):
@@ -2078,6 +2854,24 @@ class OptionParser(optparse.OptionParser):
       options.nohooks = True
     if not hasattr(options, 'noprehooks'):
       options.noprehooks = True
+    if not hasattr(options, 'hook_jobs'):
+      options.hook_jobs = 1
+    if not hasattr(options, 'fetch_jobs'):
+      options.fetch_jobs = 0
+    if not hasattr(options, 'resume'):
+      options.resume = False
+    if not hasattr(options, 'only'):
+      options.only = None
+    if not hasattr(options, 'offline'):
+      options.offline = False
+    if not hasattr(options, 'json'):
+      options.json = False
+    if not hasattr(options, 'checkout_jobs'):
+      options.checkout_jobs = 0
+    if options.fetch_jobs and options.checkout_jobs:
+      # Let both pools be busy at the same time.
+      options.jobs = max(options.jobs,
+                         options.fetch_jobs + options.checkout_jobs)
     if not hasattr(options, 'deps_os'):
       options.deps_os = None
     if not hasattr(options, 'force'):
@@ -0,0 +1,118 @@
+# Copyright 2017 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Cache of evaluated DEPS files, kept next to .gclient between runs.
+
+Evaluating a DEPS file means compiling and exec'ing it, which dominates
+ParseDepsFile() for large checkouts. The cache stores the resulting scope,
+keyed by a hash of the file content, the custom_vars it was evaluated with and
+whether strict mode was used. Everything derived from the Dependency settings
+(target_os, custom_deps, relative paths, recursedeps) is still computed from the
+cached scope by ParseDepsFile(), so it is never stale.
+
+Only declarative files are cached: assignments of literals, Var() calls and
+string operations. A DEPS file which imports modules or calls other functions
+may depend on the environment and is evaluated on every run.
+"""
+
+import ast
+import cPickle
+import hashlib
+import logging
+import os
+import threading
+
+
+# AST nodes allowed in a cacheable DEPS file.
+_SAFE_NODES = (
+    ast.Module, ast.Expr, ast.Assign, ast.AugAssign, ast.Name, ast.Load,
+    ast.Store, ast.Dict, ast.List, ast.Tuple, ast.Str, ast.Num, ast.BinOp,
+    ast.Add, ast.Mod, ast.UnaryOp, ast.USub, ast.Subscript, ast.Index,
+    ast.Call,
+)
+
+
+def IsCacheable(content):
+  """Returns True if evaluating |content| only depends on its text and vars."""
+  try:
+    tree = ast.parse(content)
+  except SyntaxError:
+    return False
+  for node in ast.walk(tree):
+    if not isinstance(node, _SAFE_NODES):
+      return False
+    if isinstance(node, ast.Call) and not (
+        isinstance(node.func, ast.Name) and node.func.id == 'Var' and
+        not node.keywords and not node.starargs and not node.kwargs):
+      return False
+  return True
+
+
+class DepsCache(object):
+  """Maps (DEPS content, custom_vars, strict) to the evaluated local scope."""
+
+  def __init__(self, entries=None):
+    # key -> pickled scope. Entries are unpickled on every hit so callers can
+    # modify the scope they get.
+    self._entries = entries or {}
+    # Entries looked up or added in this run, the ones Save() keeps.
+    self._used = {}
+    self._lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+
+  @classmethod
+  def Load(cls, path):
+    """Reads a cache file. A missing or broken file gives an empty cache."""
+    if not os.path.exists(path):
+      return cls()
+    try:
+      with open(path, 'rb') as f:
+        entries = cPickle.load(f)
+      if not isinstance(entries, dict):
+        raise ValueError('not a dict')
+      return cls(entries)
+    except (IOError, EOFError, ValueError, KeyError, IndexError, ImportError,
+            AttributeError, cPickle.UnpicklingError) as e:
+      logging.warning('Ignoring unreadable DEPS cache %s: %s', path, e)
+      return cls()
+
+  def Save(self, path):
+    """Writes the entries used since Load(), dropping the stale ones."""
+    with self._lock:
+      entries = dict(self._used)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+      cPickle.dump(entries, f, cPickle.HIGHEST_PROTOCOL)
+    if os.path.exists(path):
+      os.remove(path)
+    os.rename(tmp_path, path)
+
+  @staticmethod
+  def Key(content, custom_vars, use_strict):
+    return hashlib.sha1(repr(
+        (content, sorted(custom_vars.iteritems()), use_strict))).hexdigest()
+
+  def Get(self, key):
+    """Returns a fresh copy of the scope stored for |key|, or None."""
+    with self._lock:
+      data = self._entries.get(key)
+      if data is None:
+        self.misses += 1
+        return None
+      self.hits += 1
+      self._used[key] = data
+    return cPickle.loads(data)
+
+  def Put(self, key, content, scope):
+    """Stores |scope|, the result of evaluating |content|, if it is safe."""
+    if not IsCacheable(content):
+      return
+    try:
+      data = cPickle.dumps(scope, cPickle.HIGHEST_PROTOCOL)
+    except (cPickle.PicklingError, TypeError):
+      return
+    with self._lock:
+      self._entries[key] = data
+      self._used[key] = data
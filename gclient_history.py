@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# Copyright 2017 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Timing history of gclient sync, used to start the longest chains first.
+
+gclient sync records how long each Dependency took to run and which
+dependencies it enqueued. The next sync uses it to estimate the critical path
+through each dependency and its recursed children, and ExecutionQueue starts
+the ready dependencies with the longest estimate first.
+
+Running this file directly replays a recorded history with a simulated
+scheduler, to measure the effect of the ordering offline:
+  gclient_history.py --jobs 8 /path/to/.gclient_history
+"""
+
+from __future__ import print_function
+
+import heapq
+import json
+import logging
+import optparse
+import os
+import sys
+
+
+class SyncHistory(object):
+  """Last known sync duration and children of each dependency, by name."""
+
+  def __init__(self, deps=None, solutions=None):
+    # name -> {'duration': seconds, 'children': [names]}
+    self._deps = deps or {}
+    # Names of the top level dependencies, in .gclient order.
+    self.solutions = list(solutions or [])
+    self._critical_paths = {}
+
+  @classmethod
+  def Load(cls, path):
+    """Reads a history file. A missing or broken file gives an empty one."""
+    if not os.path.exists(path):
+      return cls()
+    try:
+      with open(path) as f:
+        content = json.load(f)
+      return cls(content.get('deps', {}), content.get('solutions', []))
+    except (IOError, ValueError, AttributeError) as e:
+      logging.warning('Ignoring unreadable sync history %s: %s', path, e)
+      return cls()
+
+  def Save(self, path):
+    with open(path, 'w') as f:
+      json.dump({'solutions': self.solutions, 'deps': self._deps}, f,
+                indent=2, sort_keys=True)
+
+  def Record(self, name, duration, children):
+    """Stores the last |duration| in seconds and |children| of |name|."""
+    self._deps[name] = {
+        'duration': duration,
+        'children': list(children),
+    }
+    self._critical_paths = {}
+
+  def __contains__(self, name):
+    return name in self._deps
+
+  def duration(self, name):
+    return self._deps.get(name, {}).get('duration', 0)
+
+  def children(self, name):
+    return self._deps.get(name, {}).get('children', [])
+
+  def critical_path(self, name):
+    """Estimated seconds from starting |name| until its subtree is synced."""
+    if name in self._critical_paths:
+      return self._critical_paths[name]
+    # Guard against cycles in a hand edited file.
+    self._critical_paths[name] = 0
+    longest_child = max(
+        [self.critical_path(c) for c in self.children(name)] or [0])
+    self._critical_paths[name] = self.duration(name) + longest_child
+    return self._critical_paths[name]
+
+
+def Simulate(history, jobs, prioritize=True):
+  """Replays |history| with |jobs| parallel slots and returns the wall time.
+
+  Solutions are enqueued first, and the children of each dependency are
+  enqueued, sorted by name, once it finishes, like gclient does. When
+  |prioritize| is False, ready dependencies start in enqueue order; otherwise
+  the ones with the longest critical path start first, ties broken by enqueue
+  order.
+  """
+  ready = []
+  counter = [0]
+
+  def enqueue(name):
+    key = -history.critical_path(name) if prioritize else 0
+    heapq.heappush(ready, (key, counter[0], name))
+    counter[0] += 1
+
+  for name in history.solutions:
+    enqueue(name)
+  now = 0.0
+  running = []
+  while ready or running:
+    while ready and len(running) < jobs:
+      _, _, name = heapq.heappop(ready)
+      heapq.heappush(running, (now + history.duration(name), name))
+    now, name = heapq.heappop(running)
+    for child in sorted(history.children(name)):
+      enqueue(child)
+  return now
+
+
+def main(argv):
+  parser = optparse.OptionParser(usage='%prog [options] <history file>')
+  parser.add_option('-j', '--jobs', type='int', default=8,
+                    help='Number of parallel jobs to simulate.')
+  options, args = parser.parse_args(argv)
+  if len(args) != 1:
+    parser.error('Specify one history file.')
+  history = SyncHistory.Load(args[0])
+  if not history.solutions:
+    parser.error('%s has no recorded sync.' % args[0])
+  in_order = Simulate(history, options.jobs, prioritize=False)
+  critical = Simulate(history, options.jobs, prioritize=True)
+  print('jobs: %d' % options.jobs)
+  print('enqueue order:       %.1fs' % in_order)
+  print('critical path first: %.1fs' % critical)
+  if critical:
+    print('speedup:             %.2fx' % (in_order / critical))
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,65 @@
+# Copyright 2017 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Journal of the dependencies synced by an unfinished gclient sync.
+
+gclient sync appends one JSON line per dependency once it is updated, with the
+url it was synced to and the resulting revision, and deletes the journal when
+the whole sync, hooks included, succeeds. If the sync is interrupted,
+'gclient sync --resume' skips the dependencies whose checkout is still at the
+journaled revision and carries on with the rest.
+"""
+
+import json
+import logging
+import os
+import threading
+
+
+class SyncJournal(object):
+  """Append-only record of name -> {'url': ..., 'revision': ...}."""
+
+  def __init__(self, path, entries=None):
+    self.path = path
+    self._entries = entries or {}
+    self._lock = threading.Lock()
+
+  @classmethod
+  def Open(cls, path, resume):
+    """Starts a journal at |path|, keeping its entries if |resume|."""
+    entries = {}
+    if resume and os.path.exists(path):
+      with open(path) as f:
+        for line in f:
+          try:
+            entry = json.loads(line)
+            entries[entry['name']] = entry
+          except (ValueError, KeyError, TypeError):
+            # The last line can be truncated if gclient was killed.
+            logging.warning('Ignoring broken line in %s: %r', path, line)
+    else:
+      with open(path, 'w'):
+        pass
+    return cls(path, entries)
+
+  def Lookup(self, name, url):
+    """Returns the journaled revision of |name| if it was synced to |url|."""
+    entry = self._entries.get(name)
+    if entry and entry.get('url') == url:
+      return entry.get('revision')
+    return None
+
+  def Record(self, name, url, revision):
+    """Appends |name| and flushes it to disk right away."""
+    line = json.dumps({'name': name, 'url': url, 'revision': revision})
+    with self._lock:
+      self._entries[name] = {'name': name, 'url': url, 'revision': revision}
+      with open(self.path, 'a') as f:
+        f.write(line + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+  def Delete(self):
+    if os.path.exists(self.path):
+      os.remove(self.path)
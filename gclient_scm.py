@@ -13,10 +13,12 @@ import posixpath
 import re
 import sys
 import tempfile
+import threading
 import traceback
 import urlparse
 
 import download_from_google_storage
+import gclient_trace
 import gclient_utils
 import git_cache
 import scm
@@ -83,6 +85,240 @@ class GitDiffFilterer(DiffFiltererWrapper):
 
 ### SCM abstraction layer
 
+# ConcurrencyLimits stage of the git subcommands which are network or disk
+# bound.
+_GIT_STAGES = {
+  'clone': 'fetch',
+  'fetch': 'fetch',
+  'ls-remote': 'fetch',
+  'pull': 'fetch',
+  'checkout': 'checkout',
+  'clean': 'checkout',
+  'merge': 'checkout',
+  'rebase': 'checkout',
+  'reset': 'checkout',
+}
+
+
+def _GitSubcommand(args):
+  """Returns the git subcommand in |args|, skipping the global options."""
+  for arg in args:
+    if not arg.startswith('-') and '=' not in arg:
+      return arg
+  return ''
+
+
+class FetchCoordinator(object):
+  """Runs each fetch at most once per key during a gclient run.
+
+  The key is what identifies the fetched data, like the cache directory of a
+  git mirror. A dependency whose fetch is already running waits for it and then
+  reuses the result instead of fetching again. A failed fetch is not
+  remembered, so the next dependency tries it again.
+  """
+  def __init__(self):
+    self._lock = threading.Lock()
+    # Key -> threading.Event set when the running fetch is done.
+    self._running = {}
+    self._done = set()
+    self.fetches = 0
+    self.saved = 0
+
+  def Run(self, key, fetch):
+    """Calls fetch() unless it already succeeded for |key|.
+
+    Returns True if fetch() was called by this thread.
+    """
+    while True:
+      with self._lock:
+        if key in self._done:
+          self.saved += 1
+          return False
+        event = self._running.get(key)
+        if not event:
+          event = self._running[key] = threading.Event()
+          break
+      event.wait()
+    try:
+      fetch()
+      with self._lock:
+        self._done.add(key)
+        self.fetches += 1
+    finally:
+      with self._lock:
+        del self._running[key]
+      event.set()
+    return True
+
+
+class RemoteRefs(object):
+  """Resolves symbolic revisions to the sha they point to on their remote.
+
+  Each remote is asked with a single 'git ls-remote' listing all the refs
+  wanted from it, so that a dependency doesn't have to fetch only to learn
+  where a branch is. Prefetch() lists the remotes of many dependencies
+  concurrently ahead of their update; the results are kept for the rest of the
+  gclient run. A remote which can't be listed resolves nothing, and the
+  dependency falls back to fetching.
+  """
+  def __init__(self, jobs=8):
+    self._lock = threading.Lock()
+    self._coordinator = FetchCoordinator()
+    self._semaphore = threading.Semaphore(max(jobs, 1))
+    # url -> {remote ref: sha}.
+    self._refs = {}
+    # (url, ref) -> (url, refs) key of the listing which includes ref.
+    self._keys = {}
+    self.lists = 0
+
+  @staticmethod
+  def RemoteRefName(revision, remote):
+    """Returns the name on the remote of the ref |revision|, None if it isn't
+    a ref of |remote|.
+
+    |revision| is as rewritten by GitWrapper.update(), e.g.
+    'refs/remotes/origin/master' stands for 'refs/heads/master'.
+    """
+    for local, remote_prefix in (
+        ('refs/remotes/%s/' % remote, 'refs/heads/'),
+        ('refs/remotes/branch-heads/', 'refs/branch-heads/')):
+      if revision.startswith(local):
+        return remote_prefix + revision[len(local):]
+    if revision.startswith('refs/remotes/') or not revision.startswith('refs/'):
+      return None
+    return revision
+
+  def _List(self, url, refs):
+    """Runs git ls-remote for |refs| of |url| and stores the result."""
+    patterns = []
+    for ref in refs:
+      patterns.extend([ref, ref + '^{}'])
+    try:
+      with self._semaphore:
+        with gclient_trace.Span('ls-remote', 'scm', dep=url):
+          output = subprocess2.check_output(
+              ['git', 'ls-remote', url] + patterns, stderr=subprocess2.PIPE)
+    except (OSError, subprocess2.CalledProcessError) as e:
+      logging.warning('Failed to list the refs of %s: %s', url, e)
+      return
+    with self._lock:
+      self.lists += 1
+      found = self._refs.setdefault(url, {})
+      for line in output.splitlines():
+        sha, _, ref = line.partition('\t')
+        found[ref] = sha
+
+  def Prefetch(self, wanted):
+    """Starts listing the remotes of |wanted|, a dict of url -> refs, in the
+    background. Resolve() waits for a listing in progress."""
+    for url, refs in wanted.iteritems():
+      with self._lock:
+        refs = set(r for r in refs if (url, r) not in self._keys)
+        if not refs:
+          continue
+        key = (url, tuple(sorted(refs)))
+        for ref in refs:
+          self._keys[(url, ref)] = key
+      thread = threading.Thread(
+          target=self._coordinator.Run,
+          args=(key, lambda key=key: self._List(*key)))
+      thread.daemon = True
+      thread.start()
+
+  def Resolve(self, url, revision, remote):
+    """Returns the sha of |revision| on |url|, or None if it's not a ref or it
+    couldn't be resolved."""
+    ref = self.RemoteRefName(revision, remote)
+    if not ref:
+      return None
+    with self._lock:
+      key = self._keys.setdefault((url, ref), (url, (ref,)))
+    self._coordinator.Run(key, lambda: self._List(*key))
+    with self._lock:
+      found = self._refs.get(url, {})
+      # Annotated tags resolve to the commit they point to.
+      return found.get(ref + '^{}') or found.get(ref)
+
+
+class AllFiles(object):
+  """Stands for all the files tracked in a git checkout in a file_list.
+
+  A fresh checkout changes every file; listing them eagerly holds hundreds of
+  thousands of strings for large repositories until the hooks run. Iterating
+  an AllFiles streams the paths from git ls-files instead, joined to |prefix|,
+  which defaults to |checkout_path|.
+  """
+  def __init__(self, checkout_path, prefix=None):
+    self.checkout_path = checkout_path
+    self.prefix = checkout_path if prefix is None else prefix
+
+  def __iter__(self):
+    proc = subprocess2.Popen(
+        ['git', 'ls-files', '-z'], cwd=self.checkout_path,
+        stdout=subprocess2.PIPE)
+    try:
+      pending = ''
+      while True:
+        data = proc.stdout.read(gclient_utils.READ_CHUNK_SIZE)
+        if not data:
+          break
+        paths = (pending + data).split('\0')
+        pending = paths.pop()
+        for path in paths:
+          yield os.path.join(self.prefix, path)
+    finally:
+      if proc.poll() is None:
+        # The caller stopped iterating early.
+        proc.stdout.close()
+        proc.wait()
+    if proc.returncode:
+      raise subprocess2.CalledProcessError(
+          proc.returncode, ['git', 'ls-files', '-z'], self.checkout_path,
+          None, None)
+
+  def __repr__(self):
+    return 'AllFiles(%r)' % self.prefix
+
+
+def ParseGitStatus(output):
+  """Parses the output of 'git status --porcelain=v2 --branch -z'.
+
+  Returns a dict with the 'revision', 'branch', 'upstream', 'ahead' and 'behind'
+  of HEAD, None when they don't apply, and the 'files' which are not clean as
+  a list of {'status': ..., 'path': ...}. 'status' is the XY code of git status
+  --short, e.g. ' M' or '??', and renames also have an 'orig_path'.
+  """
+  result = {
+      'revision': None, 'branch': None, 'upstream': None, 'ahead': None,
+      'behind': None, 'files': [],
+  }
+  # Number of space separated fields before the path of each type of entry.
+  fields = {'1': 8, '2': 9, 'u': 10, '?': 1, '!': 1}
+  records = iter(output.split('\0'))
+  for record in records:
+    if record.startswith('# '):
+      key, _, value = record[2:].partition(' ')
+      if key == 'branch.oid' and value != '(initial)':
+        result['revision'] = value
+      elif key == 'branch.head' and value != '(detached)':
+        result['branch'] = value
+      elif key == 'branch.upstream':
+        result['upstream'] = value
+      elif key == 'branch.ab':
+        ahead, behind = value.split()
+        result['ahead'], result['behind'] = int(ahead), -int(behind)
+    elif record[:1] in fields:
+      parts = record.split(' ', fields[record[0]])
+      entry = {'status': parts[1].replace('.', ' '), 'path': parts[-1]}
+      if record[0] in '?!':
+        entry['status'] = record[0] * 2
+      elif record[0] == '2':
+        # The original path of a rename is the next record.
+        entry['orig_path'] = next(records)
+      result['files'].append(entry)
+  return result
+
+
 # Factory Method for SCM wrapper creation
 
 def GetScmName(url):
@@ -98,7 +334,8 @@ def GetScmName(url):
   return None
 
 
-def CreateSCM(url, root_dir=None, relpath=None, out_fh=None, out_cb=None):
+def CreateSCM(url, root_dir=None, relpath=None, out_fh=None, out_cb=None,
+              stages=None, fetches=None, remote_refs=None):
   SCM_MAP = {
     'git' : GitWrapper,
   }
@@ -109,7 +346,70 @@ def CreateSCM(url, root_dir=None, relpath=None, out_fh=None, out_cb=None):
   scm_class = SCM_MAP[scm_name]
   if not scm_class.BinaryExists():
     raise gclient_utils.Error('%s command not found' % scm_name)
-  return scm_class(url, root_dir, relpath, out_fh, out_cb)
+  return scm_class(url, root_dir, relpath, out_fh, out_cb, stages, fetches,
+                   remote_refs)
+
+
+def GetRemoteRef(url, revision=None):
+  """Returns the (remote url, remote ref) GitWrapper.update() resolves to
+  sync |url| to |revision|, or None if it's synced to a sha or unmanaged.
+
+  |revision| overrides the revision in |url|, like --revision does.
+  """
+  if GetScmName(url) != 'git':
+    return None
+  if url.startswith('git+http://') or url.startswith('git+https://'):
+    url = url[4:]
+  url, deps_revision = gclient_utils.SplitUrlRevision(url)
+  revision = revision or deps_revision
+  if revision == 'unmanaged':
+    return None
+  remote = GitWrapper.remote
+  revision = revision or 'refs/remotes/%s/master' % remote
+  remote_ref = scm.GIT.RefToRemoteRef(revision, remote)
+  if remote_ref:
+    revision = ''.join(remote_ref)
+  ref = RemoteRefs.RemoteRefName(revision, remote)
+  if not ref:
+    return None
+  return url, ref
+
+
+def GetLocalRevision(url, checkout_path, revision=None):
+  """Returns the sha GitWrapper.update() can sync |url| to at |revision|
+  without network access, or None if neither the git cache mirror of |url|
+  nor the existing checkout at |checkout_path| has it.
+
+  |revision| overrides the revision in |url|, like --revision does.
+  """
+  if url.startswith('git+http://') or url.startswith('git+https://'):
+    url = url[4:]
+  url, deps_revision = gclient_utils.SplitUrlRevision(url)
+  if not revision or revision == 'unmanaged':
+    revision = deps_revision
+  remote = GitWrapper.remote
+  revision = revision or 'refs/remotes/%s/master' % remote
+  remote_ref = scm.GIT.RefToRemoteRef(revision, remote)
+  if remote_ref:
+    revision = ''.join(remote_ref)
+  # The mirror has the remote's refs as they are named on the remote, the
+  # checkout has them as remote-tracking refs.
+  candidates = []
+  if git_cache.Mirror.GetCachePath():
+    mirror = git_cache.Mirror(url)
+    if mirror.exists():
+      candidates.append((
+          mirror.mirror_path,
+          RemoteRefs.RemoteRefName(revision, remote) or revision))
+  if os.path.isdir(os.path.join(checkout_path, '.git')):
+    candidates.append((checkout_path, revision))
+  for path, rev in candidates:
+    try:
+      return scm.GIT.Capture(
+          ['rev-parse', '--verify', '--quiet', rev + '^{commit}'], cwd=path)
+    except subprocess2.CalledProcessError:
+      pass
+  return None
 
 
 # SCMWrapper base class
@@ -121,7 +421,7 @@ class SCMWrapper(object):
   """
 
   def __init__(self, url=None, root_dir=None, relpath=None, out_fh=None,
-               out_cb=None):
+               out_cb=None, stages=None, fetches=None, remote_refs=None):
     self.url = url
     self._root_dir = root_dir
     if self._root_dir:
@@ -135,6 +435,13 @@ class SCMWrapper(object):
       out_fh = sys.stdout
     self.out_fh = out_fh
     self.out_cb = out_cb
+    # gclient_utils.ConcurrencyLimits of the 'fetch' and 'checkout' stages.
+    self.stages = stages or gclient_utils.ConcurrencyLimits()
+    # FetchCoordinator shared by the dependencies of a gclient run.
+    self.fetches = fetches or FetchCoordinator()
+    # RemoteRefs shared by the dependencies of a gclient run, None to always
+    # learn where branches are by fetching.
+    self.remote_refs = remote_refs
 
   def Print(self, *args, **kwargs):
     kwargs.setdefault('file', self.out_fh)
@@ -324,8 +631,7 @@ class GitWrapper(SCMWrapper):
     self._Fetch(options, prune=True, quiet=options.verbose)
     self._Scrub(revision, options)
     if file_list is not None:
-      files = self._Capture(['ls-files']).splitlines()
-      file_list.extend([os.path.join(self.checkout_path, f) for f in files])
+      file_list.append(AllFiles(self.checkout_path))
 
   def _DisableHooks(self):
     hook_dir = os.path.join(self.checkout_path, '.git', 'hooks')
@@ -338,6 +644,38 @@ class GitWrapper(SCMWrapper):
           os.remove(disabled_hook_path)
         os.rename(os.path.join(hook_dir, f), disabled_hook_path)
 
+  def _IsUpToDate(self, revision, url, options):
+    """Returns True if the checkout is already clean at the pinned |revision|.
+
+    This lets a no-op sync skip the mirror update, fetch and checkout of
+    dependencies pinned to a full sha, or following a branch whose sha was
+    resolved by RemoteRefs. Only a few local git commands are run,
+    cheapest first.
+    """
+    if not re.match(r'^[0-9a-f]{40}$', revision):
+      return False
+    # These options ask for more than reaching |revision|.
+    if (options.break_repo_locks or
+        getattr(options, 'with_branch_heads', False) or
+        getattr(options, 'with_tags', False)):
+      return False
+    try:
+      current_url = self._Capture(['config', 'remote.%s.url' % self.remote])
+      if current_url.rstrip('/') != url.rstrip('/'):
+        return False
+      if self._Capture(['rev-parse', '--verify', 'HEAD']) != revision:
+        return False
+      return not self._Capture(['status', '--porcelain'])
+    except subprocess2.CalledProcessError:
+      return False
+
+  def _TracksBranch(self, revision):
+    """Returns False if HEAD is a local branch which update() would rebase
+    or switch to the remote branch |revision|."""
+    if not self._GetCurrentBranch():
+      return True
+    return scm.GIT.GetUpstreamBranch(self.checkout_path) == revision
+
   def _maybe_break_locks(self, options):
     """This removes all .lock files from this repo's .git directory, if the
     user passed the --break_repo_locks command line flag.
@@ -411,6 +749,11 @@ class GitWrapper(SCMWrapper):
       # hash is also a tag, only make a distinction at checkout
       rev_type = "hash"
 
+    # Where |revision| is on the remote, if it's a branch or a ref.
+    resolved = None
+    if rev_type == 'branch' and self.remote_refs:
+      resolved = self.remote_refs.Resolve(url, revision, self.remote)
+
     mirror = self._GetMirror(url, options)
     if mirror:
       url = mirror.mirror_path
@@ -433,15 +776,19 @@ class GitWrapper(SCMWrapper):
         (os.path.isdir(self.checkout_path) and
          not os.path.exists(os.path.join(self.checkout_path, '.git')))):
       if mirror:
-        self._UpdateMirror(mirror, options)
-      try:
-        self._Clone(revision, url, options)
-      except subprocess2.CalledProcessError:
-        self._DeleteOrMove(options.force)
-        self._Clone(revision, url, options)
+        self._UpdateMirrorOnce(mirror, options)
+      elif getattr(options, 'offline', False):
+        raise gclient_utils.Error(
+            '%s is not checked out and not in the git cache, it can\'t be '
+            'synced with --offline.' % self.relpath)
+      with gclient_trace.Span('clone', 'scm', dep=self.relpath):
+        try:
+          self._Clone(revision, url, options)
+        except subprocess2.CalledProcessError:
+          self._DeleteOrMove(options.force)
+          self._Clone(revision, url, options)
       if file_list is not None:
-        files = self._Capture(['ls-files']).splitlines()
-        file_list.extend([os.path.join(self.checkout_path, f) for f in files])
+        file_list.append(AllFiles(self.checkout_path))
       if not verbose:
         # Make the output a little prettier. It's nice to have some whitespace
         # between projects when cloning.
@@ -453,10 +800,19 @@ class GitWrapper(SCMWrapper):
       self.Print('________ unmanaged solution; skipping %s' % self.relpath)
       return self._Capture(['rev-parse', '--verify', 'HEAD'])
 
+    if (self._IsUpToDate(resolved or revision, url, options) and
+        (not resolved or self._TracksBranch(revision))):
+      self.Print('Up-to-date; skipping checkout.')
+      if not printed_path:
+        self.Print('_____ %s at %s' % (self.relpath, revision), timestamp=False)
+      if verbose:
+        self.Print('Checked out revision %s' % revision, timestamp=False)
+      return resolved or revision
+
     self._maybe_break_locks(options)
 
     if mirror:
-      self._UpdateMirror(mirror, options)
+      self._UpdateMirrorOnce(mirror, options)
 
     # See if the url has changed (the unittests use git://foo for the url, let
     # that through).
@@ -534,10 +890,20 @@ class GitWrapper(SCMWrapper):
       else:
         raise gclient_utils.Error('Invalid Upstream: %s' % upstream_branch)
 
-    if not scm.GIT.IsValidRevision(self.checkout_path, revision, sha_only=True):
+    have_resolved = (
+        resolved and revision.startswith('refs/remotes/') and
+        scm.GIT.IsValidRevision(self.checkout_path, resolved))
+    if have_resolved:
+      # The commit the remote branch is at is already here, e.g. from the
+      # mirror; moving the remote-tracking ref is all the remote update would
+      # do for it.
+      self._Capture(['update-ref', revision, resolved])
+    elif (self._CanFetch(options) and not scm.GIT.IsValidRevision(
+        self.checkout_path, revision, sha_only=True)):
       # Update the remotes first so we have all the refs.
-      remote_output = scm.GIT.Capture(['remote'] + verbose + ['update'],
-              cwd=self.checkout_path)
+      with self.stages.stage('fetch'):
+        remote_output = scm.GIT.Capture(['remote'] + verbose + ['update'],
+                cwd=self.checkout_path)
       if verbose:
         self.Print(remote_output)
 
@@ -792,6 +1158,47 @@ class GitWrapper(SCMWrapper):
         files = self._Capture(['diff', '--name-only'] + merge_base).split()
         file_list.extend([os.path.join(self.checkout_path, f) for f in files])
 
+  def GetStatus(self):
+    """Returns the state of the checkout as a dict, for status --json.
+
+    A single 'git status' gives the dirty files and, for a branch with an
+    upstream, the ahead and behind counts. A detached HEAD, as left by sync, is
+    compared with the remote instead, with one more git command.
+    """
+    if not os.path.isdir(self.checkout_path):
+      return {'exists': False}
+    # For --porcelain=v2.
+    self._CheckMinVersion('2.11')
+    result = ParseGitStatus(self._Capture(
+        ['status', '--porcelain=v2', '--branch', '-z'], strip=False))
+    result['exists'] = True
+    if result['upstream'] is None and result['revision']:
+      try:
+        counts = self._Capture(
+            ['rev-list', '--left-right', '--count', 'HEAD...' + self.remote])
+      except subprocess2.CalledProcessError:
+        # The remote has no HEAD.
+        return result
+      result['upstream'] = self.remote
+      result['ahead'], result['behind'] = [int(c) for c in counts.split()]
+    return result
+
+  def GetDiff(self):
+    """Returns the diff shown by diff as a dict, for diff --json."""
+    if not os.path.isdir(self.checkout_path):
+      return {'exists': False}
+    try:
+      merge_base = [self._Capture(['merge-base', 'HEAD', self.remote])]
+    except subprocess2.CalledProcessError:
+      merge_base = []
+    return {
+        'exists': True,
+        'base': merge_base[0] if merge_base else None,
+        # Binary diffs are not valid JSON strings.
+        'diff': self._Capture(['diff'] + merge_base, strip=False).decode(
+            'utf-8', 'replace'),
+    }
+
   def GetUsableRev(self, rev, options):
     """Finds a useful revision for this repository."""
     sha1 = None
@@ -840,6 +1247,17 @@ class GitWrapper(SCMWrapper):
       mirror_kwargs['refs'].append('refs/tags/*')
     return git_cache.Mirror(url, **mirror_kwargs)
 
+  def _UpdateMirrorOnce(self, mirror, options):
+    """Updates |mirror| unless another dependency did it during this run."""
+    if getattr(options, 'offline', False):
+      return
+    def update():
+      with self.stages.stage('fetch'):
+        self._UpdateMirror(mirror, options)
+    if not self.fetches.Run(mirror.mirror_path, update) and options.verbose:
+      self.Print('_____ %s: mirror already updated' % self.relpath,
+                 timestamp=False)
+
   @staticmethod
   def _UpdateMirror(mirror, options):
     """Update a git mirror by fetching the latest commits from the remote."""
@@ -851,11 +1269,12 @@ class GitWrapper(SCMWrapper):
         depth = 10000
     else:
       depth = None
-    mirror.populate(verbose=options.verbose,
-                    bootstrap=not getattr(options, 'no_bootstrap', False),
-                    depth=depth,
-                    ignore_lock=getattr(options, 'ignore_locks', False),
-                    lock_timeout=getattr(options, 'lock_timeout', 0))
+    with gclient_trace.Span('mirror populate', 'scm', dep=mirror.url):
+      mirror.populate(verbose=options.verbose,
+                      bootstrap=not getattr(options, 'no_bootstrap', False),
+                      depth=depth,
+                      ignore_lock=getattr(options, 'ignore_locks', False),
+                      lock_timeout=getattr(options, 'lock_timeout', 0))
     mirror.unlock()
 
   def _Clone(self, revision, url, options):
@@ -1123,7 +1542,10 @@ class GitWrapper(SCMWrapper):
     kwargs.setdefault('stderr', subprocess2.PIPE)
     strip = kwargs.pop('strip', True)
     env = scm.GIT.ApplyEnvVars(kwargs)
-    ret = subprocess2.check_output(['git'] + args, env=env, **kwargs)
+    subcommand = _GitSubcommand(args)
+    with self.stages.stage(_GIT_STAGES.get(subcommand)):
+      with gclient_trace.Span('git ' + subcommand, 'git', dep=self.relpath):
+        ret = subprocess2.check_output(['git'] + args, env=env, **kwargs)
     if strip:
       ret = ret.strip()
     return ret
@@ -1148,7 +1570,19 @@ class GitWrapper(SCMWrapper):
     checkout_args.append(ref)
     return self._Capture(checkout_args)
 
+  def _CanFetch(self, options, remote=None):
+    """Returns False if --offline forbids fetching from |remote|, which is
+    only allowed from a local directory like a git cache mirror."""
+    if not getattr(options, 'offline', False):
+      return True
+    url = self._Capture(['config', 'remote.%s.url' % (remote or self.remote)])
+    return os.path.isdir(url)
+
   def _Fetch(self, options, remote=None, prune=False, quiet=False):
+    if not self._CanFetch(options, remote):
+      self.Print('_____ %s: offline, not fetching' % self.relpath,
+                 timestamp=False)
+      return None
     cfg = gclient_utils.DefaultIndexPackConfig(self.url)
     fetch_cmd =  cfg + [
         'fetch',
@@ -1193,7 +1627,10 @@ class GitWrapper(SCMWrapper):
     kwargs.setdefault('print_stdout', False)
     env = scm.GIT.ApplyEnvVars(kwargs)
     cmd = ['git'] + args
-    if show_header:
-      gclient_utils.CheckCallAndFilterAndHeader(cmd, env=env, **kwargs)
-    else:
-      gclient_utils.CheckCallAndFilter(cmd, env=env, **kwargs)
+    subcommand = _GitSubcommand(args)
+    with self.stages.stage(_GIT_STAGES.get(subcommand)):
+      with gclient_trace.Span('git ' + subcommand, 'git', dep=self.relpath):
+        if show_header:
+          gclient_utils.CheckCallAndFilterAndHeader(cmd, env=env, **kwargs)
+        else:
+          gclient_utils.CheckCallAndFilter(cmd, env=env, **kwargs)
@@ -0,0 +1,160 @@
+# Copyright 2017 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Timing trace of a gclient run, in the Chrome trace-event format.
+
+When enabled with Start(), spans are recorded for each WorkItem run by an
+ExecutionQueue, the phases of Dependency.run(), each git command run by
+GitWrapper and each hook. Each ExecutionQueue worker slot gets its own track;
+the time items waited in the queue is shown as async spans. Stop() writes the
+trace, which can be loaded in chrome://tracing, and returns a summary of the
+slowest spans.
+
+Everything is a no-op when tracing is not enabled.
+"""
+
+import contextlib
+import json
+import threading
+import time
+
+
+_tracer = None
+
+
+class Tracer(object):
+  """Thread safe collection of trace events."""
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._events = []
+    # (queue id, slot) or None for unmanaged threads -> tid.
+    self._tids = {}
+    self._queues = {}
+
+  def _tid(self, track):
+    """Returns the tid of |track|, naming it on first use. Requires _lock."""
+    if track in self._tids:
+      return self._tids[track]
+    tid = len(self._tids)
+    self._tids[track] = tid
+    if track is None:
+      name = 'main'
+    else:
+      queue_id, slot = track
+      queue = self._queues.setdefault(queue_id, len(self._queues) + 1)
+      if queue == 1:
+        name = 'worker %d' % slot
+      else:
+        name = 'queue %d worker %d' % (queue, slot)
+    self._events.append({
+        'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid,
+        'args': {'name': name},
+    })
+    self._events.append({
+        'name': 'thread_sort_index', 'ph': 'M', 'pid': 1, 'tid': tid,
+        'args': {'sort_index': tid},
+    })
+    return tid
+
+  def AddSpan(self, name, category, start, end, args=None):
+    """Records a span of the current thread. Times are in seconds."""
+    track = getattr(threading.currentThread(), 'trace_track', None)
+    with self._lock:
+      self._events.append({
+          'name': name, 'cat': category, 'ph': 'X', 'pid': 1,
+          'tid': self._tid(track), 'ts': start * 1e6,
+          'dur': (end - start) * 1e6, 'args': args or {},
+      })
+
+  def AddAsyncSpan(self, name, category, start, end, args=None):
+    """Records a span which is not bound to a thread."""
+    with self._lock:
+      span_id = len(self._events)
+      for phase, ts in (('b', start), ('e', end)):
+        self._events.append({
+            'name': name, 'cat': category, 'ph': phase, 'pid': 1, 'tid': 0,
+            'id': span_id, 'ts': ts * 1e6, 'args': args or {},
+        })
+
+  def Save(self, path):
+    with self._lock:
+      events = list(self._events)
+    with open(path, 'w') as f:
+      json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+  def Slowest(self, count):
+    """Returns the |count| longest spans as (seconds, category, name, args)."""
+    with self._lock:
+      spans = [
+          (e['dur'] / 1e6, e['cat'], e['name'], e['args'])
+          for e in self._events if e['ph'] == 'X']
+      begins = dict(
+          (e['id'], e) for e in self._events if e['ph'] == 'b')
+      for e in self._events:
+        if e['ph'] == 'e':
+          begin = begins[e['id']]
+          spans.append(((e['ts'] - begin['ts']) / 1e6, e['cat'], e['name'],
+                        e['args']))
+    spans.sort(key=lambda s: s[0], reverse=True)
+    return spans[:count]
+
+
+def Start():
+  """Enables tracing."""
+  global _tracer
+  _tracer = Tracer()
+
+
+def IsEnabled():
+  return _tracer is not None
+
+
+def Stop(path, top=20):
+  """Writes the trace to |path|, disables tracing and returns a text table of
+  the |top| slowest spans."""
+  global _tracer
+  tracer = _tracer
+  _tracer = None
+  tracer.Save(path)
+  lines = ['Slowest %d spans (trace written to %s):' % (top, path)]
+  for seconds, category, name, args in tracer.Slowest(top):
+    dep = args.get('dep')
+    lines.append('  %8.2fs  %-10s %s%s' % (
+        seconds, category, name, ' (%s)' % dep if dep else ''))
+  return '\n'.join(lines)
+
+
+@contextlib.contextmanager
+def Span(name, category, **args):
+  """Records the time spent in the with block as a span of the current
+  thread."""
+  tracer = _tracer
+  if not tracer:
+    yield
+    return
+  start = time.time()
+  try:
+    yield
+  finally:
+    tracer.AddSpan(name, category, start, time.time(), args)
+
+
+def AddWorkItem(item):
+  """Records the queue wait and the run of an ExecutionQueue WorkItem."""
+  tracer = _tracer
+  if not tracer or not item.start:
+    return
+  start = _Seconds(item.start)
+  if item.enqueued:
+    tracer.AddAsyncSpan(
+        item.name, 'queue', _Seconds(item.enqueued), start, {'dep': item.name})
+  if item.finish:
+    tracer.AddSpan(
+        item.name, 'task', start, _Seconds(item.finish), {'dep': item.name})
+
+
+def _Seconds(dt):
+  """Converts a local datetime.datetime to seconds since the epoch."""
+  return time.mktime(dt.timetuple()) + dt.microsecond / 1e6
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# Copyright 2017 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Deferred deletion of the directories gclient doesn't need anymore.
+
+Deleting a large checkout file by file takes minutes. Move() renames it into
+the .gclient_trash directory of the gclient root instead, which is instant on
+the same filesystem, and EmptyInBackground() starts a detached process which
+deletes the content of the trash while, or after, gclient finishes.
+
+Whatever is left in the trash, e.g. because that process was killed, is
+deleted again by the next EmptyInBackground(). Several processes emptying the
+same trash at once are harmless: each skips what another one already deleted.
+"""
+
+import errno
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+
+import gclient_utils
+
+
+TRASH_DIR = '.gclient_trash'
+
+
+def GetTrashDir(root_dir):
+  return os.path.join(root_dir, TRASH_DIR)
+
+
+def Move(root_dir, path):
+  """Moves the directory |path| to the trash of |root_dir|.
+
+  Falls back to deleting it right away if it can't be renamed, e.g. because
+  it's on another filesystem.
+  """
+  trash_dir = GetTrashDir(root_dir)
+  slot = None
+  for attempt in xrange(3):
+    try:
+      gclient_utils.safe_makedirs(trash_dir)
+      # Each trashed directory gets a unique parent so that names never
+      # collide.
+      slot = tempfile.mkdtemp(dir=trash_dir)
+      os.rename(path, os.path.join(slot, os.path.basename(path)))
+      return
+    except OSError as e:
+      # A background Empty() may have deleted the trash, or the new empty
+      # slot, in the meantime.
+      if e.errno != errno.ENOENT or not os.path.exists(path) or attempt == 2:
+        error = e
+        break
+  logging.warning('Could not move %s to %s, deleting it now: %s',
+                  path, trash_dir, error)
+  if slot:
+    try:
+      os.rmdir(slot)
+    except OSError as e:
+      if e.errno != errno.ENOENT:
+        raise
+  gclient_utils.rmtree(path)
+
+
+def IsEmpty(root_dir):
+  trash_dir = GetTrashDir(root_dir)
+  return not os.path.isdir(trash_dir) or not os.listdir(trash_dir)
+
+
+def EmptyInBackground(root_dir):
+  """Starts a process, which outlives gclient, deleting the trash of
+  |root_dir|. Does nothing if the trash is empty."""
+  if IsEmpty(root_dir):
+    return
+  kwargs = {}
+  if sys.platform == 'win32':
+    kwargs['creationflags'] = 0x00000008  # DETACHED_PROCESS
+  else:
+    # Don't die with gclient's session or get its Ctrl-C.
+    kwargs['preexec_fn'] = os.setsid
+    kwargs['close_fds'] = True
+  script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'gclient_trash.py')
+  with open(os.devnull, 'r+') as devnull:
+    subprocess.Popen(
+        [sys.executable, script, GetTrashDir(root_dir)],
+        stdin=devnull, stdout=devnull, stderr=devnull, **kwargs)
+
+
+def Empty(trash_dir):
+  """Deletes the content of |trash_dir|, then |trash_dir| if it's empty."""
+  try:
+    slots = os.listdir(trash_dir)
+  except OSError as e:
+    if e.errno != errno.ENOENT:
+      raise
+    return
+  for slot in slots:
+    try:
+      gclient_utils.rmtree(os.path.join(trash_dir, slot))
+    except (OSError, gclient_utils.Error) as e:
+      # Most likely another process is deleting it too. Whatever is left is
+      # deleted next time.
+      logging.warning('Failed to delete %s: %s', slot, e)
+  try:
+    os.rmdir(trash_dir)
+  except OSError:
+    # Something was trashed meanwhile.
+    pass
+
+
+def main(argv):
+  if len(argv) != 1:
+    print >> sys.stderr, 'Usage: gclient_trash.py <trash dir>'
+    return 1
+  Empty(argv[0])
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
@@ -4,10 +4,14 @@
 
 """Generic utils."""
 
+import bisect
 import codecs
+import collections
 import contextlib
 import cStringIO
 import datetime
+import heapq
+import itertools
 import logging
 import os
 import pipes
@@ -22,11 +26,27 @@ import threading
 import time
 import urlparse
 
+import gclient_trace
 import subprocess2
 
+# os.scandir() is new in Python 3.5; the scandir package backports it.
+try:
+  from os import scandir as _scandir  # pylint: disable=no-name-in-module
+except ImportError:
+  try:
+    from scandir import scandir as _scandir  # pylint: disable=import-error
+  except ImportError:
+    _scandir = None
+
 
 RETRY_MAX = 3
 RETRY_INITIAL_SLEEP = 0.5
+# Maximum number of bytes CheckCallAndFilter reads from a child at once.
+READ_CHUNK_SIZE = 64 * 1024
+# Number of threads rmtree() deletes subdirectories with.
+RMTREE_JOBS = 8
+# Each of these ends a line passed to a CheckCallAndFilter filter_fn.
+LINE_END_RE = re.compile('[\r\n]')
 START = datetime.datetime.now()
 
 
@@ -184,7 +204,7 @@ def rm_file_or_tree(path):
     rmtree(path)
 
 
-def rmtree(path):
+def rmtree(path, jobs=None):
   """shutil.rmtree() on steroids.
 
   Recursively removes a directory, even if it's marked read-only.
@@ -208,6 +228,10 @@ def rmtree(path):
   Doing so would be hazardous, as it's not a directory slated for removal.
   In the ordinary case, this is not a problem: for our purposes, the user
   will never lack write permission on *path's parent.
+
+  On POSIX, the subdirectories are deleted by |jobs| threads, RMTREE_JOBS by
+  default, and the type of each entry is taken from its directory listing
+  when possible rather than with a stat.
   """
   if not os.path.exists(path):
     return
@@ -227,27 +251,106 @@ def rmtree(path):
       time.sleep(3)
     raise Exception('Failed to remove path %s' % path)
 
-  # On POSIX systems, we need the x-bit set on the directory to access it,
-  # the r-bit to see its contents, and the w-bit to remove files from it.
-  # The actual modes of the files within the directory is irrelevant.
-  os.chmod(path, stat.S_IRUSR | stat.S_IWUSR | stat.S_IXUSR)
-
-  def remove(func, subpath):
-    func(subpath)
-
-  for fn in os.listdir(path):
-    # If fullpath is a symbolic link that points to a directory, isdir will
-    # be True, but we don't want to descend into that as a directory, we just
-    # want to remove the link.  Check islink and treat links as ordinary files
-    # would be treated regardless of what they reference.
-    fullpath = os.path.join(path, fn)
-    if os.path.islink(fullpath) or not os.path.isdir(fullpath):
-      remove(os.remove, fullpath)
+  _TreeRemover(jobs or RMTREE_JOBS).Remove(path)
+
+
+def _ListDir(path):
+  """Returns (name, is a directory) of the entries of |path|. Symbolic links
+  are not directories, whatever they point to."""
+  if _scandir:
+    return [(e.name, e.is_dir(follow_symlinks=False)) for e in _scandir(path)]
+  return [
+      (name, stat.S_ISDIR(os.lstat(os.path.join(path, name)).st_mode))
+      for name in os.listdir(path)]
+
+
+class _TreeRemover(object):
+  """Deletes a directory tree on POSIX with a pool of threads.
+
+  Each directory is listed by a thread, which deletes its files and queues its
+  subdirectories; the directory itself is removed by whichever thread removes
+  its last subdirectory.
+  """
+
+  class _Dir(object):
+    def __init__(self, path, parent):
+      self.path = path
+      self.parent = parent
+      # The listing of the directory and its subdirectories left to remove.
+      self.pending = 1
+
+  def __init__(self, jobs):
+    self._jobs = max(jobs, 1)
+    self._queue = Queue.Queue()
+    self._lock = threading.Lock()
+    self._done = threading.Event()
+    self._error = None
+
+  def Remove(self, path):
+    self._queue.put(self._Dir(path, None))
+    if self._jobs == 1:
+      # Same as the threads, without the threads.
+      while not self._done.is_set():
+        self._Process(self._queue.get())
     else:
-      # Recurse.
-      rmtree(fullpath)
+      threads = [
+          threading.Thread(target=self._Worker) for _ in xrange(self._jobs)]
+      for t in threads:
+        t.daemon = True
+        t.start()
+      # Event.wait() without a timeout can't be interrupted in Python 2.
+      while not self._done.wait(60):
+        pass
+      for _ in threads:
+        self._queue.put(None)
+      for t in threads:
+        t.join()
+    if self._error:
+      raise self._error[0], self._error[1], self._error[2]
 
-  remove(os.rmdir, path)
+  def _Worker(self):
+    while True:
+      d = self._queue.get()
+      if d is None:
+        return
+      self._Process(d)
+
+  def _Process(self, d):
+    if self._error:
+      return
+    try:
+      self._List(d)
+    except Exception:
+      with self._lock:
+        self._error = self._error or sys.exc_info()
+      self._done.set()
+
+  def _List(self, d):
+    # On POSIX systems, we need the x-bit set on the directory to access it,
+    # the r-bit to see its contents, and the w-bit to remove files from it.
+    # The actual modes of the files within the directory is irrelevant.
+    os.chmod(d.path, stat.S_IRUSR | stat.S_IWUSR | stat.S_IXUSR)
+    subdirs = []
+    for name, is_dir in _ListDir(d.path):
+      fullpath = os.path.join(d.path, name)
+      if is_dir:
+        subdirs.append(self._Dir(fullpath, d))
+      else:
+        os.remove(fullpath)
+    with self._lock:
+      d.pending += len(subdirs)
+    for subdir in subdirs:
+      self._queue.put(subdir)
+    # Release the listing, then each directory whose last subdirectory is gone.
+    while d:
+      with self._lock:
+        d.pending -= 1
+        if d.pending:
+          return
+      os.rmdir(d.path)
+      if not d.parent:
+        self._done.set()
+      d = d.parent
 
 
 def safe_makedirs(tree):
@@ -376,11 +479,12 @@ class Annotated(Wrapper):
 
     # Continue lockless.
     obj[0] += out
-    while '\n' in obj[0]:
-      line, remaining = obj[0].split('\n', 1)
-      if line:
-        self._wrapped.write('%d>%s\n' % (index, line))
-      obj[0] = remaining
+    if '\n' in out:
+      lines = obj[0].split('\n')
+      obj[0] = lines.pop()
+      for line in lines:
+        if line:
+          self._wrapped.write('%d>%s\n' % (index, line))
 
   def flush(self):
     """Flush buffered output."""
@@ -503,28 +607,34 @@ def CheckCallAndFilter(args, stdout=None, filter_fn=None,
     stdout.flush()
 
     # Also, we need to forward stdout to prevent weird re-ordering of output.
-    # This has to be done on a per byte basis to make sure it is not buffered:
-    # normally buffering is done for each line, but if the process requests
-    # input, no end-of-line character is output after the prompt and it would
-    # not show up.
+    # os.read() returns as soon as any output is available, so that partial
+    # lines are not held back: if the process requests input, no end-of-line
+    # character is output after the prompt and it would not show up.
     try:
-      in_byte = kid.stdout.read(1)
-      if in_byte:
+      fd = kid.stdout.fileno()
+      in_chunk = os.read(fd, READ_CHUNK_SIZE)
+      if in_chunk:
         if call_filter_on_first_line:
           filter_fn(None)
-        in_line = ''
-        while in_byte:
-          output.write(in_byte)
+        # Pieces of the current line, joined once its end is found.
+        in_line = []
+        while in_chunk:
+          output.write(in_chunk)
           if print_stdout:
-            stdout.write(in_byte)
-          if in_byte not in ['\r', '\n']:
-            in_line += in_byte
+            stdout.write(in_chunk)
+          lines = LINE_END_RE.split(in_chunk)
+          if len(lines) > 1:
+            in_line.append(lines[0])
+            filter_fn(''.join(in_line))
+            for line in itertools.islice(lines, 1, len(lines) - 1):
+              filter_fn(line)
+            in_line = [lines[-1]]
           else:
-            filter_fn(in_line)
-            in_line = ''
-          in_byte = kid.stdout.read(1)
+            in_line.append(in_chunk)
+          in_chunk = os.read(fd, READ_CHUNK_SIZE)
         # Flush the rest of buffered output. This is only an issue with
         # stdout/stderr not ending with a \n.
+        in_line = ''.join(in_line)
         if len(in_line):
           filter_fn(in_line)
       rv = kid.wait()
@@ -785,6 +895,122 @@ def lockedmethod(method):
   return inner
 
 
+# Bytes of output kept in memory by each TaskOutput; 0 keeps everything in
+# memory.
+DEFAULT_MAX_TASK_OUTPUT = 1024 * 1024
+
+
+class TaskOutput(object):
+  """File-like buffer for the output of a WorkItem, with bounded memory use.
+
+  The first and the last max_memory / 2 bytes written are kept in memory. The
+  output in between is spilled to a temporary file, so nothing is lost:
+  write_to() streams it all back in order.
+  """
+  def __init__(self, max_memory=DEFAULT_MAX_TASK_OUTPUT):
+    self._head_limit = max_memory - max_memory / 2
+    self._tail_limit = max_memory / 2
+    self._head = []
+    self._head_size = 0
+    # Chunks written after the head was full, oldest first.
+    self._tail = collections.deque()
+    self._tail_size = 0
+    self._spill = None
+    self._lock = threading.Lock()
+    self.softspace = 0
+
+  def write(self, data):
+    if not data:
+      return
+    with self._lock:
+      if not self._head_limit:
+        self._head.append(data)
+        return
+      if self._head_size < self._head_limit:
+        head = data[:self._head_limit - self._head_size]
+        self._head.append(head)
+        self._head_size += len(head)
+        data = data[len(head):]
+        if not data:
+          return
+      self._tail.append(data)
+      self._tail_size += len(data)
+      while self._tail_size > self._tail_limit:
+        self._spill_oldest(self._tail_size - self._tail_limit)
+
+  def _spill_oldest(self, size):
+    """Moves up to |size| bytes from the start of the tail to the temporary
+    file. Requires _lock."""
+    if not self._spill:
+      self._spill = tempfile.TemporaryFile(prefix='gclient_output')
+    chunk = self._tail.popleft()
+    if len(chunk) > size:
+      self._tail.appendleft(chunk[size:])
+      chunk = chunk[:size]
+    self._spill.write(chunk)
+    self._tail_size -= len(chunk)
+
+  def flush(self):
+    pass
+
+  @property
+  def spilled(self):
+    """Returns True if part of the output is in the temporary file."""
+    return self._spill is not None
+
+  def chunks(self):
+    """Yields the whole output in order, in chunks of bounded size."""
+    with self._lock:
+      for chunk in self._head:
+        yield chunk
+      if self._spill:
+        self._spill.seek(0)
+        while True:
+          chunk = self._spill.read(READ_CHUNK_SIZE)
+          if not chunk:
+            break
+          yield chunk
+        self._spill.seek(0, os.SEEK_END)
+      for chunk in self._tail:
+        yield chunk
+
+  def getvalue(self):
+    return ''.join(self.chunks())
+
+  def write_to(self, stream, strip=False):
+    """Streams the output to |stream|, without the leading and trailing
+    whitespace if |strip|."""
+    pending = ''
+    started = not strip
+    for chunk in self.chunks():
+      if not strip:
+        stream.write(chunk)
+        continue
+      if not started:
+        chunk = chunk.lstrip()
+        if not chunk:
+          continue
+        started = True
+      # Trailing whitespace is only written once more output follows it.
+      stripped = chunk.rstrip()
+      if stripped:
+        stream.write(pending + stripped)
+        pending = chunk[len(stripped):]
+      else:
+        pending += chunk
+
+  def clear(self):
+    """Drops the output written so far, and the temporary file."""
+    with self._lock:
+      self._head = []
+      self._head_size = 0
+      self._tail.clear()
+      self._tail_size = 0
+      if self._spill:
+        self._spill.close()
+        self._spill = None
+
+
 class WorkItem(object):
   """One work item."""
   # On cygwin, creating a lock throwing randomly when nearing ~100 locks.
@@ -795,8 +1021,8 @@ class WorkItem(object):
   def __init__(self, name):
     # A unique string representing this work item.
     self._name = name
-    self.outbuf = cStringIO.StringIO()
-    self.start = self.finish = None
+    self.outbuf = TaskOutput()
+    self.enqueued = self.start = self.finish = None
     self.resources = []  # List of resources this work item requires.
 
   def run(self, work_queue):
@@ -808,6 +1034,40 @@ class WorkItem(object):
   def name(self):
     return self._name
 
+  @property
+  def priority(self):
+    """Ready items with a higher priority are started first."""
+    return 0
+
+
+class ConcurrencyLimits(object):
+  """Counted limits on how many threads can be in a stage of their work item.
+
+  A WorkItem can do both network bound and disk bound work. stage() lets each
+  kind of work have its own limit, independently of the number of items an
+  ExecutionQueue runs at once. Stages without a limit are not restricted.
+  """
+  def __init__(self, limits=None):
+    self.limits = dict(
+        (name, count) for name, count in (limits or {}).iteritems() if count)
+    self._semaphores = dict(
+        (name, threading.Semaphore(count))
+        for name, count in self.limits.iteritems())
+
+  @contextlib.contextmanager
+  def stage(self, name):
+    """Runs the with block once fewer than limits[name] threads are in it."""
+    semaphore = self._semaphores.get(name)
+    if not semaphore:
+      yield
+      return
+    with gclient_trace.Span('wait for %s' % name, 'stage'):
+      semaphore.acquire()
+    try:
+      yield
+    finally:
+      semaphore.release()
+
 
 class ExecutionQueue(object):
   """Runs a set of WorkItem that have interdependencies and were WorkItem are
@@ -817,17 +1077,31 @@ class ExecutionQueue(object):
   From() keyword. This class manages that all the required dependencies are run
   before running each one.
 
+  Scheduling is indexed: each queued item keeps the number of its unmet
+  requirements and each requirement name maps back to the items waiting on it,
+  so enqueuing, starting or finishing an item only costs O(its requirements).
+  Among the items ready to run, the one with the highest WorkItem.priority
+  starts first, then the one enqueued first.
+
+  Items can further limit concurrent stages of their run with
+  self.stages, see ConcurrencyLimits.
+
   Methods of this class are thread safe.
   """
-  def __init__(self, jobs, progress, ignore_requirements, verbose=False):
+  def __init__(self, jobs, progress, ignore_requirements, verbose=False,
+               stage_limits=None, max_task_output=DEFAULT_MAX_TASK_OUTPUT):
     """jobs specifies the number of concurrent tasks to allow. progress is a
-    Progress instance."""
+    Progress instance. stage_limits maps stage names to the number of
+    threads allowed in each. max_task_output is the number of bytes of output
+    of each task kept in memory, see TaskOutput."""
     # Set when a thread is done or a new item is enqueued.
     self.ready_cond = threading.Condition()
     # Maximum number of concurrent tasks.
     self.jobs = jobs
-    # List of WorkItem, for gclient, these are Dependency instances.
-    self.queued = []
+    self.stages = ConcurrencyLimits(stage_limits)
+    # WorkItem not started yet, mapped to their number of unmet requirements.
+    # For gclient, these are Dependency instances.
+    self.queued = {}
     # List of strings representing each Dependency.name that was run.
     self.ran = []
     # List of items currently running.
@@ -841,17 +1115,53 @@ class ExecutionQueue(object):
 
     self.ignore_requirements = ignore_requirements
     self.verbose = verbose
+    self.max_task_output = max_task_output
     self.last_join = None
     self.last_subproc_output = None
 
+    # Same content as self.ran, for constant time lookups.
+    self._ran_set = set()
+    # Requirement name -> list of queued WorkItem waiting for it to run.
+    self._waiters = {}
+    # Heap of (-priority, order, WorkItem) with all requirements met. Entries
+    # can be stale if the item started or was given a new requirement since it
+    # was pushed.
+    self._ready = []
+    # Priority of each queued WorkItem, read once when it is enqueued.
+    self._priority = {}
+    # Enqueue order of each queued WorkItem, and the reverse mapping.
+    self._order = {}
+    self._by_order = {}
+    self._counter = itertools.count()
+    # Sorted list of (name, order) of queued items, to find path descendants.
+    self._queued_names = []
+    # Resource -> number of running items using it.
+    self._running_resources = {}
+    # Heap of the worker slots not used by a running thread. Each thread is
+    # given the lowest free one, which gclient_trace uses as its track.
+    self._free_slots = range(1, jobs + 1)
+
   def enqueue(self, d):
     """Enqueue one Dependency to be executed later once its requirements are
     satisfied.
     """
     assert isinstance(d, WorkItem)
+    d.enqueued = datetime.datetime.now()
+    d.outbuf = TaskOutput(self.max_task_output)
     self.ready_cond.acquire()
     try:
-      self.queued.append(d)
+      order = next(self._counter)
+      self._order[d] = order
+      self._by_order[order] = d
+      self._priority[d] = d.priority
+      self.queued[d] = 0
+      if not self.ignore_requirements:
+        for requirement in set(d.requirements):
+          self._add_requirement(d, requirement)
+        self._block_descendants(d)
+      bisect.insort(self._queued_names, (d.name, order))
+      if not self.queued[d]:
+        self._push_ready(d)
       total = len(self.queued) + len(self.ran) + len(self.running)
       if self.jobs == 1:
         total += 1
@@ -863,12 +1173,98 @@ class ExecutionQueue(object):
     finally:
       self.ready_cond.release()
 
+  def _add_requirement(self, item, requirement):
+    """Makes the queued |item| wait on |requirement| unless it already ran."""
+    if requirement in self._ran_set:
+      return
+    self._waiters.setdefault(requirement, []).append(item)
+    self.queued[item] += 1
+
+  def _block_descendants(self, d):
+    """Adds |d| as a requirement of the queued items it is now required by.
+
+    Dependency.requirements is computed from the current tree, so a dependency
+    enqueued late can be a parent directory of items queued before it. Only
+    the items whose name is below d.name can be affected.
+    """
+    if not d.name:
+      return
+    prefix = d.name.rstrip('/') + '/'
+    index = bisect.bisect_left(self._queued_names, (prefix,))
+    while index < len(self._queued_names):
+      name, order = self._queued_names[index]
+      if not name.startswith(prefix):
+        break
+      index += 1
+      item = self._by_order[order]
+      if d.name in item.requirements:
+        self._add_requirement(item, d.name)
+
+  def _push_ready(self, item):
+    heapq.heappush(
+        self._ready, (-self._priority[item], self._order[item], item))
+
+  def _remove_queued(self, item):
+    """Removes |item| from the queue before it starts."""
+    del self.queued[item]
+    del self._priority[item]
+    order = self._order.pop(item)
+    del self._by_order[order]
+    index = bisect.bisect_left(self._queued_names, (item.name, order))
+    del self._queued_names[index]
+
+  def _pop_ready(self):
+    """Removes and returns the first queued item that can start now, or None.
+
+    An item can start once all its requirements ran and no running item uses
+    one of its resources.
+    """
+    conflicting = []
+    task_item = None
+    while self._ready:
+      entry = heapq.heappop(self._ready)
+      item = entry[2]
+      if self.queued.get(item) != 0 or self._order.get(item) != entry[1]:
+        # Stale entry.
+        continue
+      if self._is_conflict(item):
+        conflicting.append(entry)
+        continue
+      task_item = item
+      break
+    for entry in conflicting:
+      heapq.heappush(self._ready, entry)
+    if task_item:
+      self._remove_queued(task_item)
+    return task_item
+
+  def _mark_as_ran(self, name):
+    """Records that |name| ran and releases the items that waited on it."""
+    self.ran.append(name)
+    self._ran_set.add(name)
+    for item in self._waiters.pop(name, []):
+      if item not in self.queued:
+        continue
+      self.queued[item] -= 1
+      if not self.queued[item]:
+        self._push_ready(item)
+
+  def _clear_queue(self):
+    self.queued = {}
+    self._waiters = {}
+    self._ready = []
+    self._priority = {}
+    self._order = {}
+    self._by_order = {}
+    self._queued_names = []
+
   def out_cb(self, _):
     self.last_subproc_output = datetime.datetime.now()
     return True
 
   @staticmethod
-  def format_task_output(task, comment=''):
+  def print_task_output(stream, task, comment=''):
+    """Prints the buffered output of |task| to |stream|, with a header."""
     if comment:
       comment = ' (%s)' % comment
     if task.start and task.finish:
@@ -876,22 +1272,30 @@ class ExecutionQueue(object):
           str(task.finish - task.start).partition('.')[0])
     else:
       elapsed = ''
-    return """
-%s%s%s
-----------------------------------------
-%s
-----------------------------------------""" % (
-    task.name, comment, elapsed, task.outbuf.getvalue().strip())
+    separator = '-' * 40
+    stream.write('\n%s%s%s\n%s\n' % (task.name, comment, elapsed, separator))
+    task.outbuf.write_to(stream, strip=True)
+    stream.write('\n%s\n' % separator)
 
   def _is_conflict(self, job):
     """Checks to see if a job will conflict with another running job."""
-    for running_job in self.running:
-      for used_resource in running_job.item.resources:
-        logging.debug('Checking resource %s' % used_resource)
-        if used_resource in job.resources:
-          return True
+    for resource in job.resources:
+      logging.debug('Checking resource %s' % resource)
+      if self._running_resources.get(resource):
+        return True
     return False
 
+  def _acquire_resources(self, job):
+    for resource in job.resources:
+      self._running_resources[resource] = (
+          self._running_resources.get(resource, 0) + 1)
+
+  def _release_resources(self, job):
+    for resource in job.resources:
+      self._running_resources[resource] -= 1
+      if not self._running_resources[resource]:
+        del self._running_resources[resource]
+
   def flush(self, *args, **kwargs):
     """Runs all enqueued items until all are executed."""
     kwargs['work_queue'] = self
@@ -903,7 +1307,7 @@ class ExecutionQueue(object):
         while True:
           if not self.exceptions.empty():
             # Systematically flush the queue when an exception logged.
-            self.queued = []
+            self._clear_queue()
           self._flush_terminated_threads()
           if (not self.queued and not self.running or
               self.jobs == len(self.running)):
@@ -911,17 +1315,12 @@ class ExecutionQueue(object):
             break
 
           # Check for new tasks to start.
-          for i in xrange(len(self.queued)):
-            # Verify its requirements.
-            if (self.ignore_requirements or
-                not (set(self.queued[i].requirements) - set(self.ran))):
-              if not self._is_conflict(self.queued[i]):
-                # Start one work item: all its requirements are satisfied.
-                self._run_one_task(self.queued.pop(i), args, kwargs)
-                break
-          else:
+          task_item = self._pop_ready()
+          if not task_item:
             # Couldn't find an item that could run. Break out the outher loop.
             break
+          # Start one work item: all its requirements are satisfied.
+          self._run_one_task(task_item, args, kwargs)
 
         if not self.queued and not self.running:
           # We're done.
@@ -952,11 +1351,11 @@ class ExecutionQueue(object):
               len(self.queued),
               ', '.join(self.ran),
               len(self.running)))
-          for i in self.queued:
+          for i in sorted(self.queued, key=self._order.get):
             print >> sys.stderr, '%s (not started): %s' % (
                 i.name, ', '.join(i.requirements))
           for i in self.running:
-            print >> sys.stderr, self.format_task_output(i.item, 'interrupted')
+            self.print_task_output(sys.stderr, i.item, 'interrupted')
           raise
         # Something happened: self.enqueue() or a thread terminated. Loop again.
     finally:
@@ -969,7 +1368,7 @@ class ExecutionQueue(object):
       # To get back the stack location correctly, the raise a, b, c form must be
       # used, passing a tuple as the first argument doesn't work.
       e, task = self.exceptions.get()
-      print >> sys.stderr, self.format_task_output(task.item, 'ERROR')
+      self.print_task_output(sys.stderr, task.item, 'ERROR')
       raise e[0], e[1], e[2]
     elif self.progress:
       self.progress.end()
@@ -983,24 +1382,31 @@ class ExecutionQueue(object):
         self.running.append(t)
       else:
         t.join()
+        self._release_resources(t.item)
+        heapq.heappush(self._free_slots, t.slot)
         self.last_join = datetime.datetime.now()
         sys.stdout.flush()
         if self.verbose:
-          print >> sys.stdout, self.format_task_output(t.item)
+          self.print_task_output(sys.stdout, t.item)
+        if t.item.finish:
+          # The output of a task which succeeded is not needed anymore; the
+          # output of a failed one is printed by flush().
+          t.item.outbuf.clear()
         if self.progress:
           self.progress.update(1, t.item.name)
-        if t.item.name in self.ran:
+        if t.item.name in self._ran_set:
           raise Error(
               'gclient is confused, "%s" is already in "%s"' % (
                 t.item.name, ', '.join(self.ran)))
-        if not t.item.name in self.ran:
-          self.ran.append(t.item.name)
+        self._mark_as_ran(t.item.name)
 
   def _run_one_task(self, task_item, args, kwargs):
     if self.jobs > 1:
       # Start the thread.
       index = len(self.ran) + len(self.running) + 1
-      new_thread = self._Worker(task_item, index, args, kwargs)
+      slot = heapq.heappop(self._free_slots)
+      new_thread = self._Worker(task_item, index, slot, args, kwargs)
+      self._acquire_resources(task_item)
       self.running.append(new_thread)
       new_thread.start()
     else:
@@ -1012,28 +1418,32 @@ class ExecutionQueue(object):
         task_item.run(*args, **kwargs)
         task_item.finish = datetime.datetime.now()
         print >> task_item.outbuf, '[%s] Finished.' % Elapsed(task_item.finish)
-        self.ran.append(task_item.name)
+        gclient_trace.AddWorkItem(task_item)
+        self._mark_as_ran(task_item.name)
         if self.verbose:
           if self.progress:
             print >> sys.stdout, ''
-          print >> sys.stdout, self.format_task_output(task_item)
+          self.print_task_output(sys.stdout, task_item)
+        task_item.outbuf.clear()
         if self.progress:
           self.progress.update(1, ', '.join(t.item.name for t in self.running))
       except KeyboardInterrupt:
-        print >> sys.stderr, self.format_task_output(task_item, 'interrupted')
+        self.print_task_output(sys.stderr, task_item, 'interrupted')
         raise
       except Exception:
-        print >> sys.stderr, self.format_task_output(task_item, 'ERROR')
+        self.print_task_output(sys.stderr, task_item, 'ERROR')
         raise
 
 
   class _Worker(threading.Thread):
     """One thread to execute one WorkItem."""
-    def __init__(self, item, index, args, kwargs):
+    def __init__(self, item, index, slot, args, kwargs):
       threading.Thread.__init__(self, name=item.name or 'Worker')
       logging.info('_Worker(%s) reqs:%s' % (item.name, item.requirements))
       self.item = item
       self.index = index
+      self.slot = slot
+      self.trace_track = (id(kwargs['work_queue']), slot)
       self.args = args
       self.kwargs = kwargs
       self.daemon = True
@@ -1048,6 +1458,7 @@ class ExecutionQueue(object):
         self.item.run(*self.args, **self.kwargs)
         self.item.finish = datetime.datetime.now()
         print >> self.item.outbuf, '[%s] Finished.' % Elapsed(self.item.finish)
+        gclient_trace.AddWorkItem(self.item)
       except KeyboardInterrupt:
         logging.info('Caught KeyboardInterrupt in thread %s', self.item.name)
         logging.info(str(sys.exc_info()))
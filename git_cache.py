@@ -6,7 +6,10 @@
 """A git command for managing a local cache of git repositories."""
 
 from __future__ import print_function
+import base64
 import errno
+import hashlib
+import json
 import logging
 import optparse
 import os
@@ -16,6 +19,7 @@ import threading
 import time
 import subprocess
 import sys
+import tarfile
 import urlparse
 import zipfile
 
@@ -41,6 +45,21 @@ class LockError(Exception):
 class ClobberNeeded(Exception):
   pass
 
+class BootstrapError(Exception):
+  pass
+
+
+class HashingReader(object):
+  """File-like reader which hashes what is read from |f| with |digest|."""
+  def __init__(self, f, digest):
+    self._f = f
+    self.digest = digest
+
+  def read(self, size=-1):
+    data = self._f.read(size)
+    self.digest.update(data)
+    return data
+
 
 def exponential_backoff_retry(fn, excs=(Exception,), name=None, count=10,
                               sleep_time=0.25, printerr=None):
@@ -323,8 +342,86 @@ class Mirror(object):
     """Bootstrap the repo from Google Stroage if possible.
 
     More apt-ly named bootstrap_repo_from_cloud_if_possible_else_do_nothing().
+
+    The newest full bootstrap, a zipfile or a tarball, is extracted first, then
+    the chain of bundles from its generation on, if any, is fetched into it.
+    """
+    gsutil = self.GetGsutil()
+    snapshots, bundles = self._list_bootstrap_files(gsutil)
+    if not snapshots:
+      # This repo is not on Google Storage.
+      return False
+    latest_checkout = snapshots[-1]
+    if latest_checkout.endswith('.tar'):
+      bootstrapped = self._stream_bootstrap(gsutil, latest_checkout, directory)
+    else:
+      bootstrapped = self._unzip_bootstrap(gsutil, latest_checkout, directory)
+    if bootstrapped:
+      self._fetch_bundles(
+          gsutil, self._bundle_chain(latest_checkout, bundles), directory)
+    return bootstrapped
+
+  @staticmethod
+  def _bootstrap_generation(url):
+    """Returns the generation of the mirror in a bootstrap file: N for N.zip,
+    N.tar, N.heads and M-N.bundle."""
+    name = os.path.splitext(url.rsplit('/', 1)[-1])[0]
+    return name.rsplit('-', 1)[-1]
+
+  def _list_bootstrap_files(self, gsutil):
+    """Returns the urls of the full bootstraps of the mirror, oldest first, and
+    a dict of the urls of the bundles by the generation they apply to.
+
+    A tarball sorts after the zipfile of the same generation.
     """
+    gs_folder = 'gs://%s/%s' % (self.bootstrap_bucket, self.basedir)
+    _, ls_out, _ = gsutil.check_call('ls', gs_folder)
+    snapshots = sorted(
+        (url for url in ls_out.splitlines()
+         if url.endswith('.zip') or url.endswith('.tar')),
+        key=lambda url: (os.path.splitext(url)[0], url.endswith('.tar')))
+    bundles = {}
+    for url in sorted(ls_out.splitlines()):
+      match = re.match(r'(.+)-(.+)\.bundle$', url.rsplit('/', 1)[-1])
+      if match and match.group(1) != match.group(2):
+        bundles[match.group(1)] = url
+    return snapshots, bundles
+
+  def _bundle_chain(self, snapshot, bundles):
+    """Returns the urls of the bundles which bring the full bootstrap
+    |snapshot| up to date, in the order they apply."""
+    chain = []
+    generation = self._bootstrap_generation(snapshot)
+    while generation in bundles and len(chain) < len(bundles):
+      chain.append(bundles[generation])
+      generation = self._bootstrap_generation(chain[-1])
+    return chain
+
+  def _fetch_bundles(self, gsutil, chain, directory):
+    """Fetches the bundles |chain| into the mirror in |directory|, stopping at
+    the first one which fails. The normal fetch gets the rest after."""
+    if not chain:
+      return
+    tempdir = tempfile.mkdtemp(prefix='_cache_tmp', dir=self.GetCachePath())
+    try:
+      for url in chain:
+        self.print('Downloading %s' % url)
+        filename = os.path.join(tempdir, url.rsplit('/', 1)[-1])
+        if gsutil.call('cp', url, filename):
+          self.print('Downloading bundle %s failed.' % url)
+          return
+        try:
+          self.RunGit(['fetch', filename, '+refs/*:refs/*'], cwd=directory)
+        except subprocess.CalledProcessError:
+          self.print('Fetching bundle %s failed.' % url)
+          return
+        os.remove(filename)
+    finally:
+      gclient_utils.rm_file_or_tree(tempdir)
 
+  def _unzip_bootstrap(self, gsutil, latest_checkout, directory):
+    """Downloads the bootstrap zipfile |latest_checkout|, then extracts it to
+    |directory|."""
     python_fallback = False
     if (sys.platform.startswith('win') and
         not gclient_utils.FindExecutable('7z')):
@@ -335,16 +432,6 @@ class Mirror(object):
     elif not gclient_utils.FindExecutable('unzip'):
       python_fallback = True
 
-    gs_folder = 'gs://%s/%s' % (self.bootstrap_bucket, self.basedir)
-    gsutil = Gsutil(self.gsutil_exe, boto_path=None)
-    # Get the most recent version of the zipfile.
-    _, ls_out, _ = gsutil.check_call('ls', gs_folder)
-    ls_out_sorted = sorted(ls_out.splitlines())
-    if not ls_out_sorted:
-      # This repo is not on Google Storage.
-      return False
-    latest_checkout = ls_out_sorted[-1]
-
     # Download zip file to a temporary directory.
     try:
       tempdir = tempfile.mkdtemp(prefix='_cache_tmp', dir=self.GetCachePath())
@@ -390,6 +477,56 @@ class Mirror(object):
       return False
     return True
 
+  def _stream_bootstrap(self, gsutil, url, directory):
+    """Extracts the bootstrap tarball |url| to |directory| while it's
+    downloaded, so that it's never on disk twice.
+
+    The tarball is checked against the md5 of the Google Storage object as it
+    is read. Without an md5, nothing is downloaded. On failure, |directory| is
+    emptied and False is returned.
+    """
+    _, stat_out, _ = gsutil.check_call('stat', url)
+    match = re.search(r'Hash \(md5\):\s*(\S+)', stat_out)
+    if not match:
+      self.print('No md5 for bootstrap tarball %s, skipping it.\n'
+                 'Resuming normal operations.' % url)
+      return False
+    self.print('Downloading and extracting %s' % url)
+    proc = gsutil.stream(url)
+    reader = HashingReader(proc.stdout, hashlib.md5())
+    try:
+      try:
+        with tarfile.open(fileobj=reader, mode='r|') as tar:
+          for member in tar:
+            parts = os.path.normpath(member.name).split(os.sep)
+            if (os.path.isabs(member.name) or '..' in parts or
+                not (member.isfile() or member.isdir())):
+              raise BootstrapError('Unexpected member %s' % member.name)
+            tar.extract(member, directory)
+        # Hash the end-of-archive padding too.
+        while reader.read(gclient_utils.READ_CHUNK_SIZE):
+          pass
+      except Exception:
+        proc.kill()
+        raise
+      finally:
+        proc.stdout.close()
+        code = proc.wait()
+      if code:
+        raise BootstrapError('Downloading %s failed' % url)
+      if base64.b64encode(reader.digest.digest()) != match.group(1):
+        raise BootstrapError('%s is corrupt' % url)
+    except (BootstrapError, tarfile.TarError, EnvironmentError) as e:
+      self.print('Extracting bootstrap tarball %s failed: %s\n'
+                 'Resuming normal operations.' % (url, e))
+      for name in os.listdir(directory):
+        gclient_utils.rm_file_or_tree(os.path.join(directory, name))
+      return False
+    return True
+
+  def GetGsutil(self):
+    return Gsutil(self.gsutil_exe, boto_path=None)
+
   def exists(self):
     return os.path.isfile(os.path.join(self.mirror_path, 'config'))
 
@@ -412,17 +549,28 @@ class Mirror(object):
                    '%s and "git cache fetch" again.'
                    % os.path.join(self.mirror_path, 'config'))
 
+  @staticmethod
+  def CountPackFiles(path):
+    pack_dir = os.path.join(path, 'objects', 'pack')
+    if not os.path.isdir(pack_dir):
+      return 0
+    return len([f for f in os.listdir(pack_dir) if f.endswith('.pack')])
+
   def _ensure_bootstrapped(self, depth, bootstrap, force=False):
     tempdir = None
-    pack_dir = os.path.join(self.mirror_path, 'objects', 'pack')
-    pack_files = []
+    pack_count = self.CountPackFiles(self.mirror_path)
 
-    if os.path.isdir(pack_dir):
-      pack_files = [f for f in os.listdir(pack_dir) if f.endswith('.pack')]
+    if not force and self.exists() and pack_count > GC_AUTOPACKLIMIT:
+      try:
+        self._maintain()
+      except subprocess.CalledProcessError as e:
+        logging.warn('Maintenance of %s failed, re-bootstrapping it: %s'
+                     % (self.mirror_path, e))
+      pack_count = self.CountPackFiles(self.mirror_path)
 
     should_bootstrap = (force or
                         not self.exists() or
-                        len(pack_files) > GC_AUTOPACKLIMIT)
+                        pack_count > GC_AUTOPACKLIMIT)
     if should_bootstrap:
       if self.exists():
         # Re-bootstrapping an existing mirror; preserve existing fetch spec.
@@ -441,7 +589,7 @@ class Mirror(object):
         logging.warn(
             'Git cache has a lot of pack files (%d).  Tried to re-bootstrap '
             'but failed.  Continuing with non-optimized repository.'
-            % len(pack_files))
+            % pack_count)
         gclient_utils.rmtree(tempdir)
         tempdir = None
     else:
@@ -462,6 +610,17 @@ class Mirror(object):
     fetch_specs = subprocess.check_output(
         [self.git_exe, 'config', '--get-all', 'remote.origin.fetch'],
         cwd=rundir).strip().splitlines()
+    if len(fetch_specs) > 1:
+      # Fetching all the specs at once negotiates with the server once and
+      # writes a single pack. Without retries: if it fails, fetch them one by
+      # one below to find out which failed.
+      try:
+        self.print('Fetching %s' % ' '.join(fetch_specs))
+        self.RunGit(fetch_cmd + fetch_specs, cwd=rundir)
+        return
+      except subprocess.CalledProcessError:
+        logging.warn('Fetch of all the fetch specs at once failed, fetching '
+                     'them one by one.')
     for spec in fetch_specs:
       try:
         self.print('Fetching %s' % spec)
@@ -483,6 +642,8 @@ class Mirror(object):
       lockfile.lock()
 
     tempdir = None
+    start = time.time()
+    pack_count = self.CountPackFiles(self.mirror_path)
     try:
       tempdir = self._ensure_bootstrapped(depth, bootstrap)
       rundir = tempdir or self.mirror_path
@@ -501,38 +662,118 @@ class Mirror(object):
         self.Rename(tempdir, self.mirror_path)
       if not ignore_lock:
         lockfile.unlock()
-
-  def update_bootstrap(self, prune=False):
-    # The files are named <git number>.zip
+    self.print('Populated %s in %.1fs, pack files: %d -> %d' % (
+        self.mirror_path, time.time() - start, pack_count,
+        self.CountPackFiles(self.mirror_path)))
+
+  def update_bootstrap(self, prune=False, tar=False, max_bundles=0):
+    """Uploads a full bootstrap of the mirror, or a bundle of what changed
+    since the last bootstrap if the chain of bundles after the last full
+    bootstrap is shorter than |max_bundles|.
+
+    The files are named <git number>.zip, or <git number>.tar if |tar|, with
+    the refs of the mirror in <git number>.heads. Bundles are named
+    <git number of the previous bootstrap>-<git number>.bundle.
+    """
+    ext = '.tar' if tar else '.zip'
     gen_number = subprocess.check_output(
         [self.git_exe, 'number', 'master'], cwd=self.mirror_path).strip()
+    gsutil = self.GetGsutil()
+    gs_folder = 'gs://%s/%s' % (self.bootstrap_bucket, self.basedir)
+    if max_bundles and self._upload_bundle(
+        gsutil, gs_folder, gen_number, max_bundles):
+      return
     # Run Garbage Collect to compress packfile.
     self.RunGit(['gc', '--prune=all'])
     # Creating a temp file and then deleting it ensures we can use this name.
-    _, tmp_zipfile = tempfile.mkstemp(suffix='.zip')
+    _, tmp_zipfile = tempfile.mkstemp(suffix=ext)
     os.remove(tmp_zipfile)
-    subprocess.call(['zip', '-r', tmp_zipfile, '.'], cwd=self.mirror_path)
-    gsutil = Gsutil(path=self.gsutil_exe, boto_path=None)
-    gs_folder = 'gs://%s/%s' % (self.bootstrap_bucket, self.basedir)
-    dest_name = '%s/%s.zip' % (gs_folder, gen_number)
+    if tar:
+      subprocess.call(['tar', '-cf', tmp_zipfile, '.'], cwd=self.mirror_path)
+    else:
+      subprocess.call(['zip', '-r', tmp_zipfile, '.'], cwd=self.mirror_path)
+    dest_name = '%s/%s%s' % (gs_folder, gen_number, ext)
     gsutil.call('cp', tmp_zipfile, dest_name)
     os.remove(tmp_zipfile)
+    # The next bundle only contains the objects the refs of this bootstrap
+    # don't have.
+    heads_name = '%s/%s.heads' % (gs_folder, gen_number)
+    _, tmp_heads = tempfile.mkstemp(suffix='.heads')
+    with open(tmp_heads, 'w') as f:
+      subprocess.check_call(
+          [self.git_exe, 'show-ref'], cwd=self.mirror_path, stdout=f)
+    gsutil.call('cp', tmp_heads, heads_name)
+    os.remove(tmp_heads)
 
     # Remove all other files in the same directory.
     if prune:
       _, ls_out, _ = gsutil.check_call('ls', gs_folder)
       for filename in ls_out.splitlines():
-        if filename == dest_name:
+        if filename in (dest_name, heads_name):
           continue
         gsutil.call('rm', filename)
 
+  def _upload_bundle(self, gsutil, gs_folder, gen_number, max_bundles):
+    """Uploads a bundle of what changed since the last bootstrap.
+
+    Returns False if a full bootstrap is needed instead: there is none, the
+    chain of bundles after it is |max_bundles| long, or the objects of the
+    last bootstrap are not all in the mirror anymore.
+    """
+    snapshots, bundles = self._list_bootstrap_files(gsutil)
+    if not snapshots:
+      return False
+    chain = self._bundle_chain(snapshots[-1], bundles)
+    if len(chain) >= max_bundles:
+      return False
+    last = chain[-1] if chain else snapshots[-1]
+    base = self._bootstrap_generation(last)
+    if base == gen_number:
+      self.print('The last bootstrap %s is up to date.' % last)
+      return True
+    tempdir = tempfile.mkdtemp(prefix='_cache_tmp', dir=self.GetCachePath())
+    try:
+      # The refs of the last bootstrap are the prerequisites of the bundle.
+      if chain:
+        filename = os.path.join(tempdir, 'last.bundle')
+        if gsutil.call('cp', last, filename):
+          return False
+        heads = subprocess.check_output(
+            [self.git_exe, 'bundle', 'list-heads', filename],
+            cwd=self.mirror_path)
+      else:
+        filename = os.path.join(tempdir, 'last.heads')
+        if gsutil.call('cp', '%s/%s.heads' % (gs_folder, base), filename):
+          return False
+        with open(filename) as f:
+          heads = f.read()
+      bundle = os.path.join(tempdir, '%s-%s.bundle' % (base, gen_number))
+      try:
+        self.RunGit(
+            ['bundle', 'create', bundle, '--all'] +
+            sorted(set('^' + line.split()[0] for line in heads.splitlines())))
+      except subprocess.CalledProcessError:
+        self.print('Creating a bundle since %s failed, uploading a full '
+                   'bootstrap instead.' % last)
+        return False
+      gsutil.call('cp', bundle, '%s/%s' % (gs_folder, os.path.basename(bundle)))
+      return True
+    finally:
+      gclient_utils.rm_file_or_tree(tempdir)
+
   @staticmethod
   def DeleteTmpPackFiles(path):
+    """Deletes the temporary files of interrupted git processes in the pack
+    directory, and the indexes of packs which don't exist anymore."""
     pack_dir = os.path.join(path, 'objects', 'pack')
     if not os.path.isdir(pack_dir):
       return
-    pack_files = [f for f in os.listdir(pack_dir) if
-                  f.startswith('.tmp-') or f.startswith('tmp_pack_')]
+    names = os.listdir(pack_dir)
+    packs = set(os.path.splitext(f)[0] for f in names if f.endswith('.pack'))
+    pack_files = [f for f in names if
+                  f.startswith(('.tmp-', 'tmp_pack_', 'tmp_idx_')) or
+                  (f.endswith(('.idx', '.bitmap', '.rev')) and
+                   os.path.splitext(f)[0] not in packs)]
     for f in pack_files:
       f = os.path.join(pack_dir, f)
       try:
@@ -541,6 +782,55 @@ class Mirror(object):
       except OSError:
         logging.warn('Unable to delete temporary pack file %s' % f)
 
+  @classmethod
+  def GitVersion(cls):
+    """Returns the version of git as a tuple of ints."""
+    if not hasattr(cls, 'git_version'):
+      out = subprocess.check_output([cls.git_exe, '--version'])
+      match = re.search(r'(\d+)\.(\d+)(?:\.(\d+))?', out)
+      cls.git_version = tuple(int(v or 0) for v in match.groups())
+    return cls.git_version
+
+  def maintain(self, ignore_lock=False, lock_timeout=0):
+    """Repacks the mirror incrementally, under its lock."""
+    assert self.exists()
+    lockfile = Lockfile(self.mirror_path, lock_timeout)
+    if not ignore_lock:
+      lockfile.lock()
+    try:
+      self._maintain()
+    finally:
+      if not ignore_lock:
+        lockfile.unlock()
+
+  def _maintain(self):
+    """Merges the small packs of the mirror and writes the indexes which keep
+    it fast with many packs, so that it never has to be re-bootstrapped
+    because of its pack count.
+
+    The packs are repacked geometrically: only the smallest packs are merged,
+    until each pack is at least twice as big as the next smaller one, so that
+    the big packs of the bootstrap are never rewritten. Requires the mirror
+    lock.
+    """
+    start = time.time()
+    pack_count = self.CountPackFiles(self.mirror_path)
+    self.DeleteTmpPackFiles(self.mirror_path)
+    version = self.GitVersion()
+    if version >= (2, 33):
+      self.RunGit(['repack', '-d', '-q', '--geometric=2'])
+    else:
+      # Merges all the packs, which is still much cheaper than downloading
+      # them all again.
+      self.RunGit(['repack', '-a', '-d', '-q'])
+    if version >= (2, 21):
+      self.RunGit(['multi-pack-index', 'write'])
+    if version >= (2, 22):
+      self.RunGit(['commit-graph', 'write', '--reachable', '--split'])
+    self.print('Maintained %s in %.1fs, pack files: %d -> %d' % (
+        self.mirror_path, time.time() - start, pack_count,
+        self.CountPackFiles(self.mirror_path)))
+
   @classmethod
   def BreakLocks(cls, path):
     did_unlock = False
@@ -581,6 +871,84 @@ class Mirror(object):
 
     return unlocked_repos
 
+def read_gclient(path=None):
+  """Returns the urls of the solutions of the .gclient file in |path| or
+  above and, if it was synced, of all their dependencies, and the cache_dir
+  of the .gclient file, made absolute like gclient does, or None."""
+  root = gclient_utils.FindFileUpwards('.gclient', path)
+  if not root:
+    raise RuntimeError('Can\'t find .gclient')
+  env = {}
+  execfile(os.path.join(root, '.gclient'), env)
+  urls = [solution.get('url') for solution in env.get('solutions', [])]
+  cache_dir = env.get('cache_dir')
+  if cache_dir:
+    cache_dir = os.path.abspath(os.path.join(root, cache_dir))
+  entries_path = os.path.join(root, '.gclient_entries')
+  if os.path.exists(entries_path):
+    env = {}
+    execfile(entries_path, env)
+    urls.extend(env.get('entries', {}).itervalues())
+  return ([gclient_utils.SplitUrlRevision(url)[0] for url in urls if url],
+          cache_dir)
+
+
+def populate_mirrors(urls, jobs, refs=None, **kwargs):
+  """Populates the mirrors of |urls|, up to |jobs| at once.
+
+  The output of each mirror is prefixed with its cache directory. Each one is
+  locked on its own, like with Mirror.populate(). Returns a list of dicts
+  with the url, the mirror path, the duration and the error, if any, of each
+  mirror.
+  """
+  # Urls with the same mirror would wait for each other's lock.
+  mirrors = {}
+  for url in urls:
+    mirrors.setdefault(Mirror.UrlToCacheDir(url), url)
+  pending = sorted(mirrors.itervalues(), reverse=True)
+  results = []
+  lock = threading.Lock()
+
+  def worker():
+    while True:
+      with lock:
+        if not pending:
+          return
+        url = pending.pop()
+      basedir = Mirror.UrlToCacheDir(url)
+      def print_func(message, basedir=basedir):
+        with lock:
+          for line in str(message).splitlines():
+            print('%s> %s' % (basedir, line))
+      start = time.time()
+      mirror = None
+      error = None
+      try:
+        mirror = Mirror(url, refs=refs, print_func=print_func)
+        mirror.populate(**kwargs)
+      except Exception as e:  # pylint: disable=broad-except
+        error = str(e) or e.__class__.__name__
+        print_func('Failed: %s' % error)
+      with lock:
+        results.append({
+            'url': url,
+            'mirror_path': mirror and mirror.mirror_path,
+            'seconds': time.time() - start,
+            'error': error,
+        })
+
+  threads = [threading.Thread(target=worker)
+             for _ in xrange(max(1, min(jobs, len(pending))))]
+  for t in threads:
+    t.daemon = True
+    t.start()
+  for t in threads:
+    # Without a timeout, the join can't be interrupted with Ctrl-C.
+    while t.is_alive():
+      t.join(1)
+  return sorted(results, key=lambda result: result['url'])
+
+
 @subcommand.usage('[url of repo to check for caching]')
 def CMDexists(parser, args):
   """Check to see if there already is a cache of the given repo."""
@@ -605,6 +973,14 @@ def CMDupdate_bootstrap(parser, args):
 
   parser.add_option('--prune', action='store_true',
                     help='Prune all other cached zipballs of the same repo.')
+  parser.add_option('--tar', action='store_true',
+                    help='Upload a tarball, which is extracted while it is '
+                         'downloaded, instead of a zipfile.')
+  parser.add_option('--max-bundles', type='int', default=0,
+                    help='Upload a bundle of what changed since the last '
+                         'bootstrap instead of a full bootstrap, unless there '
+                         'are already that many bundles since the last full '
+                         'one.')
 
   # First, we need to ensure the cache is populated.
   populate_args = args[:]
@@ -615,11 +991,11 @@ def CMDupdate_bootstrap(parser, args):
   options, args = parser.parse_args(args)
   url = args[0]
   mirror = Mirror(url)
-  mirror.update_bootstrap(options.prune)
+  mirror.update_bootstrap(options.prune, options.tar, options.max_bundles)
   return 0
 
 
-@subcommand.usage('[url of repo to add to or update in cache]')
+@subcommand.usage('[urls of repos to add to or update in cache]')
 def CMDpopulate(parser, args):
   """Ensure that the cache has all up-to-date objects for the given repo."""
   parser.add_option('--depth', type='int',
@@ -634,13 +1010,39 @@ def CMDpopulate(parser, args):
   parser.add_option('--ignore_locks', '--ignore-locks',
                     action='store_true',
                     help='Don\'t try to lock repository')
+  parser.add_option('--batch', metavar='FILE',
+                    help='Also populate the repos of the urls in FILE, one per '
+                         'line, or in stdin if FILE is -')
+  parser.add_option('--from-gclient', action='store_true',
+                    help='Also populate the repos of the solutions of the '
+                         '.gclient file in the current directory or above, '
+                         'and of their dependencies if it was synced')
+  parser.add_option('-j', '--jobs', type='int', default=4,
+                    help='Number of repos populated at once with several '
+                         'repos, default: %default')
+  parser.add_option('--json', metavar='FILE',
+                    help='With several repos, write the duration and the '
+                         'error of each one to FILE as JSON')
 
   options, args = parser.parse_args(args)
-  if not len(args) == 1:
-    parser.error('git cache populate only takes exactly one repo url.')
-  url = args[0]
+  urls = list(args)
+  if options.batch:
+    if options.batch == '-':
+      urls.extend(sys.stdin.read().split())
+    else:
+      with open(options.batch) as f:
+        urls.extend(f.read().split())
+  if options.from_gclient:
+    gclient_urls, cache_dir = read_gclient()
+    urls.extend(gclient_urls)
+    # Populate the cache gclient sync uses.
+    if cache_dir and not options.cache_dir:
+      Mirror.SetCachePath(cache_dir)
+  batch = options.batch or options.from_gclient
+  if not batch and not len(urls) == 1:
+    parser.error('git cache populate only takes exactly one repo url, '
+                 'without --batch or --from-gclient.')
 
-  mirror = Mirror(url, refs=options.ref)
   kwargs = {
       'verbose': options.verbose,
       'shallow': options.shallow,
@@ -650,7 +1052,24 @@ def CMDpopulate(parser, args):
   }
   if options.depth:
     kwargs['depth'] = options.depth
-  mirror.populate(**kwargs)
+  if not batch:
+    mirror = Mirror(urls[0], refs=options.ref)
+    mirror.populate(**kwargs)
+    return 0
+
+  results = populate_mirrors(urls, options.jobs, refs=options.ref, **kwargs)
+  print('%d repos populated:' % len(results))
+  for result in results:
+    print('  %6.1fs %s%s' % (
+        result['seconds'], result['url'],
+        ' FAILED' if result['error'] else ''))
+  if options.json:
+    with open(options.json, 'w') as f:
+      json.dump({'mirrors': results}, f, indent=2, sort_keys=True)
+  if (any(result['error'] for result in results) or
+      len(results) != len(set(Mirror.UrlToCacheDir(url) for url in urls))):
+    return 1
+  return 0
 
 
 @subcommand.usage('Fetch new commits into cache and current checkout')
@@ -739,6 +1158,55 @@ def CMDunlock(parser, args):
         unlocked_repos))
 
 
+@subcommand.usage('[url of repo to maintain]')
+def CMDmaintain(parser, args):
+  """Repack one or all repos incrementally, instead of re-bootstrapping them
+  once they have too many packs."""
+  parser.add_option('--all', '-a', action='store_true',
+                    help='Maintain all repository caches')
+  parser.add_option('--ignore_locks', '--ignore-locks',
+                    action='store_true',
+                    help='Don\'t try to lock repository')
+  options, args = parser.parse_args(args)
+  if len(args) > 1 or (len(args) == 0 and not options.all):
+    parser.error('git cache maintain takes exactly one repo url, or --all')
+
+  if options.all:
+    cachepath = Mirror.GetCachePath()
+    mirrors = []
+    for path in sorted(os.listdir(cachepath)):
+      path = os.path.join(cachepath, path)
+      if (os.path.basename(path).startswith('_cache_tmp') or
+          not os.path.isfile(os.path.join(path, 'config'))):
+        continue
+      try:
+        url = subprocess.check_output(
+            [Mirror.git_exe, 'config', 'remote.origin.url'], cwd=path).strip()
+      except subprocess.CalledProcessError:
+        logging.warn('Skipping %s, which has no remote.origin.url.' % path)
+        continue
+      mirror = Mirror(url)
+      # The directory name can't always be converted back to and from the
+      # url; use the directory which exists.
+      mirror.basedir = os.path.basename(path)
+      mirror.mirror_path = path
+      mirrors.append(mirror)
+  else:
+    mirrors = [Mirror(args[0])]
+    if not mirrors[0].exists():
+      print('%s is not cached.' % args[0], file=sys.stderr)
+      return 1
+  ret = 0
+  for mirror in mirrors:
+    try:
+      mirror.maintain(options.ignore_locks, options.timeout)
+    except subprocess.CalledProcessError as e:
+      print('Maintenance of %s failed: %s' % (mirror.mirror_path, e),
+            file=sys.stderr)
+      ret = 1
+  return ret
+
+
 class OptionParser(optparse.OptionParser):
   """Wrapper class for OptionParser to handle global options."""
 
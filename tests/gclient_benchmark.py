@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+# Copyright 2017 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""End to end benchmarks for gclient, run against local fake repositories.
+
+Not a unit test; run it manually, e.g.:
+  tests/gclient_benchmark.py noop_sync --deps 50 --jobs 8
+  tests/gclient_benchmark.py fresh_sync_memory --files 200000
+  tests/gclient_benchmark.py hook_matching --files 100000 --hooks 200
+  tests/gclient_benchmark.py rmtree --files 500000
+"""
+
+import optparse
+import os
+import re
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import gclient
+from testing_support import fake_repos
+
+
+class FakeReposManyDeps(fake_repos.FakeReposBase):
+  """repo_1 is a solution pinning all the other repos to a full sha."""
+
+  def populateGit(self):
+    deps = []
+    for i in xrange(2, self.NB_GIT_REPOS + 1):
+      repo = 'repo_%d' % i
+      self._commit_git(repo, {'origin': 'git/%s@1\n' % repo})
+      deps.append('  "src/dep%d": "%s%s@%s",' % (
+          i, self.git_base, repo, self.git_hashes[repo][1][0]))
+    self._commit_git('repo_1', {
+        'DEPS': 'deps = {\n%s\n}\n' % '\n'.join(deps),
+        'origin': 'git/repo_1@1\n',
+    })
+
+
+class FakeReposManyFiles(fake_repos.FakeReposBase):
+  """repo_1 is a solution with a hook, depending on repo_2 with many files."""
+  NB_GIT_REPOS = 2
+  NB_FILES = 1000
+
+  def populateGit(self):
+    self._commit_git('repo_2', dict(
+        ('dir%d/file%d.txt' % (i / 1000, i), '%d\n' % i)
+        for i in xrange(self.NB_FILES)))
+    self._commit_git('repo_1', {
+        'DEPS': (
+            'deps = {"src/dep": "%srepo_2"}\n'
+            'hooks = [{"pattern": ".", "action": ["true"]}]\n' %
+            self.git_base),
+        'origin': 'git/repo_1@1\n',
+    })
+
+
+# Runs gclient with the up-to-date check of GitWrapper.update() disabled, to
+# compare with the behavior before it existed.
+_NO_FAST_PATH = """
+import gclient_scm
+gclient_scm.GitWrapper._IsUpToDate = lambda *_: False
+"""
+
+# Runs gclient with the files of fresh checkouts listed eagerly, like before
+# gclient_scm.AllFiles existed.
+_EAGER_FILE_LIST = """
+import gclient_scm
+class EagerAllFiles(gclient_scm.AllFiles):
+  def __init__(self, *args):
+    super(EagerAllFiles, self).__init__(*args)
+    self.files = list(super(EagerAllFiles, self).__iter__())
+  def __iter__(self):
+    return iter(self.files)
+gclient_scm.AllFiles = EagerAllFiles
+"""
+
+# Runs gclient in process after |patch| and writes its peak RSS to a file.
+_GCLIENT_WRAPPER = """
+import resource, sys
+sys.path.insert(0, %r)
+%s
+import gclient
+ret = gclient.main(sys.argv[2:])
+with open(sys.argv[1], 'w') as f:
+  f.write(str(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+sys.exit(ret)
+"""
+
+
+def run_gclient(args, cwd, patch=None):
+  """Runs gclient, with the python statements |patch| run first.
+
+  Returns the peak RSS of the gclient process in kB.
+  """
+  rss_path = os.path.join(cwd, '.benchmark_rss')
+  cmd = [sys.executable, '-c', _GCLIENT_WRAPPER % (ROOT_DIR, patch or 'pass'),
+         rss_path]
+  env = os.environ.copy()
+  env['DEPOT_TOOLS_UPDATE'] = '0'
+  with open(os.devnull, 'w') as devnull:
+    subprocess.check_call(cmd + args, cwd=cwd, env=env, stdout=devnull)
+  with open(rss_path) as f:
+    rss = int(f.read())
+  os.remove(rss_path)
+  return rss
+
+
+def bench_noop_sync(options):
+  repos = type('FakeRepos', (FakeReposManyDeps,),
+               {'NB_GIT_REPOS': options.deps + 1})()
+  if not repos.set_up_git():
+    print 'git is not available'
+    return
+  checkout = os.path.join(repos.root_dir, 'checkout')
+  os.mkdir(checkout)
+  run_gclient(['config', repos.git_base + 'repo_1', '--name', 'src'], checkout)
+  run_gclient(['sync', '--jobs', str(options.jobs)], checkout)
+  print 'deps: %d, jobs: %d' % (options.deps, options.jobs)
+  for label, patch in (('before', _NO_FAST_PATH), ('after', None)):
+    times = []
+    for _ in xrange(options.iterations):
+      start = time.time()
+      run_gclient(['sync', '--jobs', str(options.jobs)], checkout, patch)
+      times.append(time.time() - start)
+    print '%-6s no-op sync: best %.2fs, mean %.2fs' % (
+        label, min(times), sum(times) / len(times))
+
+
+def bench_fresh_sync_memory(options):
+  repos = type('FakeRepos', (FakeReposManyFiles,),
+               {'NB_FILES': options.files})()
+  if not repos.set_up_git():
+    print 'git is not available'
+    return
+  print 'files: %d' % options.files
+  for label, patch in (('before', _EAGER_FILE_LIST), ('after', None)):
+    rss = []
+    for i in xrange(options.iterations):
+      checkout = os.path.join(repos.root_dir, 'checkout_%s_%d' % (label, i))
+      os.mkdir(checkout)
+      run_gclient(
+          ['config', repos.git_base + 'repo_1', '--name', 'src'], checkout)
+      rss.append(run_gclient(['sync'], checkout, patch))
+    print '%-6s fresh sync: peak RSS %.1f MB' % (label, min(rss) / 1024.)
+
+
+def _match_per_hook(dep):
+  """Matches the hook patterns like Dependency.GetHookSpecs() used to: the
+  whole file_list_and_children is scanned for each hook of each dependency."""
+  result = []
+  for hook_dict in dep.deps_hooks:
+    pattern = re.compile(hook_dict['pattern'])
+    result.append([f for f in dep.file_list_and_children if pattern.search(f)])
+  for d in dep.dependencies:
+    result.extend(_match_per_hook(d))
+  return result
+
+
+def bench_hook_matching(options):
+  root = tempfile.mkdtemp()
+  old_cwd = os.getcwd()
+  old_getscmname = gclient.gclient_scm.GetScmName
+  try:
+    os.chdir(root)
+    with open('.gclient', 'w') as f:
+      f.write('solutions = [{"name": "src", "url": "svn://example.com/src"}]')
+    os.mkdir('src')
+    hooks = [
+        {'pattern': r'^src/dep%d/.*/file%d\d*\.gyp$' % (i % options.deps, i),
+         'action': ['hook%d' % i]} for i in xrange(options.hooks)]
+    dep_urls = dict(
+        ('src/dep%d' % i, 'svn://example.com/dep%d' % i)
+        for i in xrange(options.deps))
+    with open(os.path.join('src', 'DEPS'), 'w') as f:
+      f.write('deps = %r\nhooks = %r\n' % (dep_urls, hooks))
+    gclient_options, _ = gclient.OptionParser().parse_args([])
+    client = gclient.GClient.LoadCurrentConfig(gclient_options)
+    work_queue = gclient.gclient_utils.ExecutionQueue(1, None, False)
+    work_queue.enqueue(client.dependencies[0])
+    work_queue.flush({}, None, [], options=gclient_options)
+    deps = list(client.dependencies[0].dependencies)
+    # pylint: disable=protected-access
+    for i in xrange(options.files):
+      dep = deps[i % len(deps)]
+      ext = ('.gyp', '.cc', '.h')[i % 3]
+      dep._file_list.append('%s/dir%d/file%d%s' % (dep.name, i / 1000, i, ext))
+    # Pattern matching is only used for checkouts which are not git ones.
+    gclient.gclient_scm.GetScmName = lambda _: 'svn'
+    print 'files: %d, hooks: %d, deps: %d' % (
+        options.files, options.hooks, options.deps)
+    for label, match in (
+        ('before', lambda: _match_per_hook(client)),
+        ('after', lambda: client.GetHookSpecs(gclient_options))):
+      times = []
+      for _ in xrange(options.iterations):
+        start = time.time()
+        match()
+        times.append(time.time() - start)
+      print '%-6s hook matching: best %.2fs, mean %.2fs' % (
+          label, min(times), sum(times) / len(times))
+  finally:
+    gclient.gclient_scm.GetScmName = old_getscmname
+    os.chdir(old_cwd)
+    shutil.rmtree(root)
+
+
+def _rmtree_serial(path):
+  """Deletes a tree like gclient_utils.rmtree() used to on POSIX: one
+  thread, with an islink and an isdir stat per entry."""
+  os.chmod(path, stat.S_IRUSR | stat.S_IWUSR | stat.S_IXUSR)
+  for fn in os.listdir(path):
+    fullpath = os.path.join(path, fn)
+    if os.path.islink(fullpath) or not os.path.isdir(fullpath):
+      os.remove(fullpath)
+    else:
+      _rmtree_serial(fullpath)
+  os.rmdir(path)
+
+
+def _make_tree(root, files):
+  """Creates |files| files under |root|, 100 per directory, 100 directories
+  per parent directory."""
+  for i in xrange(files):
+    d = os.path.join(root, 'dir%d' % (i / 10000), 'dir%d' % (i / 100 % 100))
+    if not i % 100:
+      os.makedirs(d)
+    with open(os.path.join(d, 'file%d.txt' % i), 'w') as f:
+      f.write('%d\n' % i)
+
+
+def bench_rmtree(options):
+  root = tempfile.mkdtemp()
+  try:
+    print 'files: %d, threads: %d, scandir: %s' % (
+        options.files, gclient.gclient_utils.RMTREE_JOBS,
+        bool(gclient.gclient_utils._scandir))  # pylint: disable=protected-access
+    for label, rmtree in (
+        ('before', _rmtree_serial),
+        ('after', gclient.gclient_utils.rmtree)):
+      times = []
+      for i in xrange(options.iterations):
+        tree = os.path.join(root, '%s_%d' % (label, i))
+        _make_tree(tree, options.files)
+        # Don't measure writing back what creating the tree left dirty.
+        subprocess.check_call(['sync'])
+        start = time.time()
+        rmtree(tree)
+        times.append(time.time() - start)
+      print '%-6s rmtree: best %.2fs, mean %.2fs' % (
+          label, min(times), sum(times) / len(times))
+  finally:
+    shutil.rmtree(root)
+
+
+BENCHMARKS = {
+  'fresh_sync_memory': bench_fresh_sync_memory,
+  'hook_matching': bench_hook_matching,
+  'noop_sync': bench_noop_sync,
+  'rmtree': bench_rmtree,
+}
+
+
+def main(argv):
+  parser = optparse.OptionParser(
+      usage='%%prog [options] <%s>' % '|'.join(sorted(BENCHMARKS)))
+  parser.add_option('--deps', type='int', default=30,
+                    help='Number of pinned dependencies.')
+  parser.add_option('--files', type='int', default=200000,
+                    help='Number of files of the freshly synced dependency, '
+                         'or of the deleted tree.')
+  parser.add_option('--hooks', type='int', default=200,
+                    help='Number of hooks with a pattern.')
+  parser.add_option('--iterations', type='int', default=3)
+  parser.add_option('-j', '--jobs', type='int', default=8)
+  options, args = parser.parse_args(argv)
+  if len(args) != 1 or args[0] not in BENCHMARKS:
+    parser.error('Specify one benchmark.')
+  BENCHMARKS[args[0]](options)
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# Copyright 2017 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Unit tests for gclient_deps_cache.py."""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from testing_support import trial_dir
+
+import gclient_deps_cache
+
+
+DEPS = (
+    'vars = {"host": "https://example.com"}\n'
+    'deps = {"src/a": Var("host") + "/a.git@%s" % "deadbeef"}\n'
+    'hooks = [{"action": ["python", "-c", "pass"], "pattern": "."}]\n')
+
+
+class DepsCacheTest(trial_dir.TestCase):
+  def testIsCacheable(self):
+    self.assertTrue(gclient_deps_cache.IsCacheable(DEPS))
+    self.assertTrue(gclient_deps_cache.IsCacheable(
+        '"use strict"\nrecursion = -1\nrecursedeps = [("src/a", "DEPS")]\n'))
+    for content in (
+        'import os\ndeps = {"a": os.environ["URL"]}\n',
+        'deps = {"a": From("src")}\n',
+        'deps = {"a": open("url").read()}\n',
+        'deps = {"a": Var(name="host")}\n',
+        'deps = {x: x for x in ("a",)}\n',
+        'deps = {',
+    ):
+      self.assertFalse(gclient_deps_cache.IsCacheable(content), content)
+
+  def testKey(self):
+    key = gclient_deps_cache.DepsCache.Key(DEPS, {'a': 'b'}, False)
+    self.assertEquals(
+        key, gclient_deps_cache.DepsCache.Key(DEPS, {'a': 'b'}, False))
+    self.assertNotEquals(
+        key, gclient_deps_cache.DepsCache.Key(DEPS, {'a': 'c'}, False))
+    self.assertNotEquals(
+        key, gclient_deps_cache.DepsCache.Key(DEPS, {'a': 'b'}, True))
+    self.assertNotEquals(
+        key, gclient_deps_cache.DepsCache.Key(DEPS + '\n', {'a': 'b'}, False))
+
+  def testGetPut(self):
+    cache = gclient_deps_cache.DepsCache()
+    self.assertEquals(None, cache.Get('key'))
+    scope = {'deps': {'src/a': 'url'}}
+    cache.Put('key', DEPS, scope)
+    cache.Put('uncacheable', 'import os', {'deps': {}})
+    cached = cache.Get('key')
+    self.assertEquals(scope, cached)
+    # Callers get their own copy.
+    cached['deps']['src/b'] = 'other'
+    self.assertEquals(scope, cache.Get('key'))
+    self.assertEquals(None, cache.Get('uncacheable'))
+    self.assertEquals(2, cache.hits)
+    self.assertEquals(2, cache.misses)
+
+  def testSaveLoad(self):
+    path = os.path.join(self.root_dir, '.gclient_deps_cache')
+    cache = gclient_deps_cache.DepsCache()
+    cache.Put('old', DEPS, {'deps': {}})
+    cache.Save(path)
+    cache = gclient_deps_cache.DepsCache.Load(path)
+    cache.Put('new', DEPS, {'deps': {'a': 'b'}})
+    cache.Save(path)
+    cache = gclient_deps_cache.DepsCache.Load(path)
+    self.assertEquals({'deps': {'a': 'b'}}, cache.Get('new'))
+    # Entries unused by the last run are dropped.
+    self.assertEquals(None, cache.Get('old'))
+
+  def testLoadBroken(self):
+    path = os.path.join(self.root_dir, '.gclient_deps_cache')
+    with open(path, 'w') as f:
+      f.write('garbage')
+    self.assertEquals(None, gclient_deps_cache.DepsCache.Load(path).Get('a'))
+    self.assertEquals(
+        None,
+        gclient_deps_cache.DepsCache.Load(path + '.missing').Get('a'))
+
+
+if __name__ == '__main__':
+  unittest.main()
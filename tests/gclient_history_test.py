@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# Copyright 2017 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Unit tests for gclient_history.py."""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from testing_support import trial_dir
+
+import gclient_history
+
+
+def make_history():
+  # 'src/z' is a long clone that sorts last among its siblings.
+  history = gclient_history.SyncHistory(solutions=['src'])
+  history.Record('src', 10, ['src/a', 'src/b', 'src/z'])
+  history.Record('src/a', 5, [])
+  history.Record('src/b', 20, ['src/b/c'])
+  history.Record('src/b/c', 30, [])
+  history.Record('src/z', 100, [])
+  return history
+
+
+class SyncHistoryTest(trial_dir.TestCase):
+  def testCriticalPath(self):
+    history = make_history()
+    self.assertEquals(110, history.critical_path('src'))
+    self.assertEquals(50, history.critical_path('src/b'))
+    self.assertEquals(100, history.critical_path('src/z'))
+    self.assertEquals(0, history.critical_path('unknown'))
+
+  def testCriticalPathCycle(self):
+    history = gclient_history.SyncHistory()
+    history.Record('a', 1, ['b'])
+    history.Record('b', 2, ['a'])
+    self.assertEquals(3, history.critical_path('a'))
+
+  def testSaveLoad(self):
+    path = os.path.join(self.root_dir, '.gclient_history')
+    make_history().Save(path)
+    history = gclient_history.SyncHistory.Load(path)
+    self.assertEquals(['src'], history.solutions)
+    self.assertEquals(110, history.critical_path('src'))
+
+  def testLoadBroken(self):
+    path = os.path.join(self.root_dir, '.gclient_history')
+    with open(path, 'w') as f:
+      f.write('not json')
+    history = gclient_history.SyncHistory.Load(path)
+    self.assertEquals([], history.solutions)
+    self.assertFalse('src' in history)
+
+  def testSimulate(self):
+    history = make_history()
+    # In enqueue order 'src/z' only starts once 'src/a' is done.
+    self.assertEquals(
+        115, gclient_history.Simulate(history, 2, prioritize=False))
+    self.assertEquals(110, gclient_history.Simulate(history, 2))
+    self.assertEquals(
+        165, gclient_history.Simulate(history, 1, prioritize=False))
+
+
+if __name__ == '__main__':
+  unittest.main()
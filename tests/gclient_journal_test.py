@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# Copyright 2017 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Unit tests for gclient_journal.py."""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from testing_support import trial_dir
+
+import gclient_journal
+
+
+class SyncJournalTest(trial_dir.TestCase):
+  def setUp(self):
+    super(SyncJournalTest, self).setUp()
+    self.path = os.path.join(self.root_dir, '.gclient_journal')
+
+  def testRecordResume(self):
+    journal = gclient_journal.SyncJournal.Open(self.path, False)
+    journal.Record('src', 'https://a/src', 'abc')
+    journal.Record('src/b', 'https://a/b@123', '123')
+    journal = gclient_journal.SyncJournal.Open(self.path, True)
+    self.assertEquals('abc', journal.Lookup('src', 'https://a/src'))
+    self.assertEquals('123', journal.Lookup('src/b', 'https://a/b@123'))
+    # The url changed since, src/b must be synced again.
+    self.assertEquals(None, journal.Lookup('src/b', 'https://a/b@456'))
+    self.assertEquals(None, journal.Lookup('src/c', 'https://a/c'))
+
+  def testOpenTruncates(self):
+    journal = gclient_journal.SyncJournal.Open(self.path, False)
+    journal.Record('src', 'https://a/src', 'abc')
+    journal = gclient_journal.SyncJournal.Open(self.path, False)
+    self.assertEquals(None, journal.Lookup('src', 'https://a/src'))
+    journal = gclient_journal.SyncJournal.Open(self.path, True)
+    self.assertEquals(None, journal.Lookup('src', 'https://a/src'))
+
+  def testResumeBrokenLine(self):
+    journal = gclient_journal.SyncJournal.Open(self.path, False)
+    journal.Record('src', 'https://a/src', 'abc')
+    with open(self.path, 'a') as f:
+      f.write('{"name": "src/b", "ur')
+    journal = gclient_journal.SyncJournal.Open(self.path, True)
+    self.assertEquals('abc', journal.Lookup('src', 'https://a/src'))
+
+  def testDelete(self):
+    journal = gclient_journal.SyncJournal.Open(self.path, False)
+    journal.Delete()
+    self.assertFalse(os.path.exists(self.path))
+    journal.Delete()
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -16,6 +16,7 @@ import os
 import re
 import sys
 import tempfile
+import threading
 import unittest
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -99,6 +100,15 @@ class BasicTests(SuperMoxTestBase):
       self.assertEquals(gclient_scm.SCMWrapper._get_first_remote_url(FAKE_PATH),
                         answer)
 
+  def testGitStages(self):
+    self.assertEquals(
+        'fetch', gclient_scm._GitSubcommand(
+            ['-c', 'core.deltaBaseCacheLimit=2g', 'fetch', 'origin']))
+    self.assertEquals('', gclient_scm._GitSubcommand(['--version']))
+    self.assertEquals('fetch', gclient_scm._GIT_STAGES['clone'])
+    self.assertEquals('checkout', gclient_scm._GIT_STAGES['rebase'])
+    self.assertNotIn('rev-parse', gclient_scm._GIT_STAGES)
+
   def tearDown(self):
     SuperMoxTestBase.tearDown(self)
 
@@ -249,6 +259,167 @@ from :3
       gclient_scm.GitWrapper.BinaryExists = self._original_GitBinaryExists
 
 
+class ParseGitStatusTestCase(unittest.TestCase):
+  def testBranch(self):
+    sha = 'a' * 40
+    output = '\0'.join([
+        '# branch.oid ' + sha,
+        '# branch.head master',
+        '# branch.upstream origin/master',
+        '# branch.ab +2 -3',
+        '1 .M N... 100644 100644 100644 %s %s a file' % (sha, sha),
+        '2 R. N... 100644 100644 100644 %s %s R100 new' % (sha, sha),
+        'old',
+        'u UU N... 100644 100644 100644 100644 %s %s %s c' % (sha, sha, sha),
+        '? d/',
+        '',
+    ])
+    self.assertEquals({
+        'revision': sha, 'branch': 'master', 'upstream': 'origin/master',
+        'ahead': 2, 'behind': 3,
+        'files': [
+            {'status': ' M', 'path': 'a file'},
+            {'status': 'R ', 'path': 'new', 'orig_path': 'old'},
+            {'status': 'UU', 'path': 'c'},
+            {'status': '??', 'path': 'd/'},
+        ],
+    }, gclient_scm.ParseGitStatus(output))
+
+  def testDetached(self):
+    self.assertEquals({
+        'revision': None, 'branch': None, 'upstream': None, 'ahead': None,
+        'behind': None, 'files': [],
+    }, gclient_scm.ParseGitStatus(
+        '# branch.oid (initial)\0# branch.head (detached)\0'))
+
+
+class FetchCoordinatorTestCase(unittest.TestCase):
+  def testRunOnce(self):
+    fetches = gclient_scm.FetchCoordinator()
+    calls = []
+    self.assertTrue(fetches.Run('a', lambda: calls.append('a')))
+    self.assertFalse(fetches.Run('a', lambda: calls.append('a')))
+    self.assertTrue(fetches.Run('b', lambda: calls.append('b')))
+    self.assertEquals(['a', 'b'], calls)
+    self.assertEquals((2, 1), (fetches.fetches, fetches.saved))
+
+  def testConcurrent(self):
+    fetches = gclient_scm.FetchCoordinator()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+    def fetch():
+      calls.append('fetch')
+      started.set()
+      release.wait()
+    first = threading.Thread(target=fetches.Run, args=('a', fetch))
+    first.start()
+    started.wait()
+    results = []
+    second = threading.Thread(
+        target=lambda: results.append(fetches.Run('a', fetch)))
+    second.start()
+    release.set()
+    first.join()
+    second.join()
+    self.assertEquals(['fetch'], calls)
+    self.assertEquals([False], results)
+
+  def testFailureIsRetried(self):
+    fetches = gclient_scm.FetchCoordinator()
+    def fail():
+      raise subprocess2.CalledProcessError(1, ['git', 'fetch'], None, '', '')
+    with self.assertRaises(subprocess2.CalledProcessError):
+      fetches.Run('a', fail)
+    calls = []
+    self.assertTrue(fetches.Run('a', lambda: calls.append('a')))
+    self.assertEquals(['a'], calls)
+
+  def testUpdateMirrorOnce(self):
+    class FakeMirror(object):
+      mirror_path = '/cache/example.com-repo'
+    class Options(object):
+      verbose = False
+    fetches = gclient_scm.FetchCoordinator()
+    updated = []
+    wrappers = [
+        gclient_scm.GitWrapper(
+            'https://example.com/repo.git', '/root', path, None, None, None,
+            fetches)
+        for path in ('src/a', 'src/b')]
+    for wrapper in wrappers:
+      wrapper._UpdateMirror = lambda mirror, _: updated.append(mirror)
+      wrapper._UpdateMirrorOnce(FakeMirror, Options)
+    self.assertEquals([FakeMirror], updated)
+    self.assertEquals(1, fetches.saved)
+
+
+class RemoteRefsTestCase(unittest.TestCase):
+  def setUp(self):
+    self.repo = tempfile.mkdtemp('.git')
+    def git(*args):
+      return subprocess2.check_output(
+          ['git', '-c', 'user.name=Some User',
+           '-c', 'user.email=someuser@chromium.org'] + list(args),
+          cwd=self.repo).strip()
+    git('init', '-q')
+    git('symbolic-ref', 'HEAD', 'refs/heads/master')
+    git('commit', '-q', '--allow-empty', '-m', 'first')
+    git('tag', '-a', '-m', 'tag', 'v1')
+    git('update-ref', 'refs/branch-heads/1', 'HEAD')
+    self.sha = git('rev-parse', 'HEAD')
+
+  def tearDown(self):
+    rmtree(self.repo)
+
+  def testRemoteRefName(self):
+    name = gclient_scm.RemoteRefs.RemoteRefName
+    self.assertEquals('refs/heads/master',
+                      name('refs/remotes/origin/master', 'origin'))
+    self.assertEquals('refs/branch-heads/1',
+                      name('refs/remotes/branch-heads/1', 'origin'))
+    self.assertEquals('refs/tags/v1', name('refs/tags/v1', 'origin'))
+    self.assertEquals(None, name('refs/remotes/other/master', 'origin'))
+    self.assertEquals(None, name('a' * 40, 'origin'))
+
+  def testGetRemoteRef(self):
+    url = 'https://example.com/repo.git'
+    self.assertEquals((url, 'refs/heads/master'),
+                      gclient_scm.GetRemoteRef(url))
+    self.assertEquals((url, 'refs/heads/foo'),
+                      gclient_scm.GetRemoteRef(url + '@refs/heads/foo'))
+    self.assertEquals((url, 'refs/branch-heads/1'),
+                      gclient_scm.GetRemoteRef(url, 'branch-heads/1'))
+    self.assertEquals(None, gclient_scm.GetRemoteRef(url + '@' + 'a' * 40))
+    self.assertEquals(None, gclient_scm.GetRemoteRef(url, 'unmanaged'))
+    self.assertEquals(None, gclient_scm.GetRemoteRef('svn://example.com/a'))
+
+  def testResolve(self):
+    refs = gclient_scm.RemoteRefs()
+    refs.Prefetch({self.repo: ['refs/heads/master', 'refs/tags/v1']})
+    self.assertEquals(self.sha, refs.Resolve(
+        self.repo, 'refs/remotes/origin/master', 'origin'))
+    # Annotated tags are peeled.
+    self.assertEquals(
+        self.sha, refs.Resolve(self.repo, 'refs/tags/v1', 'origin'))
+    self.assertEquals(1, refs.lists)
+    # A ref which wasn't prefetched is listed on its own, once.
+    for _ in xrange(2):
+      self.assertEquals(self.sha, refs.Resolve(
+          self.repo, 'refs/remotes/branch-heads/1', 'origin'))
+    self.assertEquals(2, refs.lists)
+    self.assertEquals(None, refs.Resolve(self.repo, 'refs/tags/v2', 'origin'))
+    self.assertEquals(None, refs.Resolve(self.repo, self.sha, 'origin'))
+    self.assertEquals(3, refs.lists)
+
+  def testResolveFailure(self):
+    refs = gclient_scm.RemoteRefs()
+    missing = os.path.join(self.repo, 'missing')
+    self.assertEquals(
+        None, refs.Resolve(missing, 'refs/remotes/origin/master', 'origin'))
+    self.assertEquals(0, refs.lists)
+
+
 class ManagedGitWrapperTestCase(BaseGitWrapperTestCase):
 
   def testRevertMissing(self):
@@ -378,6 +549,58 @@ class ManagedGitWrapperTestCase(BaseGitWrapperTestCase):
                       'a7142dc9f0009350b96a11f372b6ea658592aa95')
     sys.stdout.close()
 
+  def testUpdateUpToDate(self):
+    if not self.enabled:
+      return
+    options = self.Options()
+    scm = gclient_scm.CreateSCM(url=self.url, root_dir=self.root_dir,
+                                relpath=self.relpath)
+    scm._Run(['config', 'remote.origin.url', self.url], options)
+    rev = scm._Capture(['rev-parse', 'HEAD'])
+    scm = gclient_scm.CreateSCM(url='%s@%s' % (self.url, rev),
+                                root_dir=self.root_dir, relpath=self.relpath)
+    def fail(*_args, **_kwargs):
+      self.fail('An up-to-date checkout should not be fetched')
+    scm._UpdateBranchHeads = fail
+    file_list = []
+    self.assertEquals(rev, scm.update(options, (), file_list))
+    self.assertEquals([], file_list)
+    self.assertIn('Up-to-date; skipping checkout.', sys.stdout.getvalue())
+
+    self.assertTrue(scm._IsUpToDate(rev, self.url, options))
+    self.assertFalse(scm._IsUpToDate(rev, 'git://bar', options))
+    self.assertFalse(scm._IsUpToDate(rev[:7], self.url, options))
+    self.assertFalse(scm._IsUpToDate('0' * 40, self.url, options))
+    with open(join(self.base_path, 'a'), 'a') as f:
+      f.write('dirty\n')
+    self.assertFalse(scm._IsUpToDate(rev, self.url, options))
+    sys.stdout.close()
+
+  def testUpdateUpToDateBranch(self):
+    if not self.enabled:
+      return
+    options = self.Options()
+    scm = gclient_scm.CreateSCM(url=self.url, root_dir=self.root_dir,
+                                relpath=self.relpath)
+    scm._Run(['config', 'remote.origin.url', self.url], options)
+    scm._Run(['checkout', '-q', '--detach'], options)
+    rev = scm._Capture(['rev-parse', 'HEAD'])
+    remote_refs = gclient_scm.RemoteRefs()
+    listed = []
+    def ls_remote(url, refs):
+      listed.append((url, refs))
+      remote_refs._refs[url] = {'refs/heads/master': rev}
+    remote_refs._List = ls_remote
+    scm = gclient_scm.CreateSCM(url=self.url, root_dir=self.root_dir,
+                                relpath=self.relpath, remote_refs=remote_refs)
+    def fail(*_args, **_kwargs):
+      self.fail('A checkout at the tip of its branch should not be fetched')
+    scm._UpdateBranchHeads = fail
+    self.assertEquals(rev, scm.update(options, (), []))
+    self.assertEquals([(self.url, ('refs/heads/master',))], listed)
+    self.assertIn('Up-to-date; skipping checkout.', sys.stdout.getvalue())
+    sys.stdout.close()
+
   def testUpdateMerge(self):
     if not self.enabled:
       return
@@ -547,6 +770,17 @@ class ManagedGitWrapperTestCase(BaseGitWrapperTestCase):
     rev_info = scm.revinfo(options, (), None)
     self.assertEquals(rev_info, '069c602044c5388d2d15c3f875b057c852003458')
 
+  def testAllFiles(self):
+    if not self.enabled:
+      return
+    files = gclient_scm.AllFiles(self.base_path, 'dep')
+    self.assertEquals([join('dep', 'a'), join('dep', 'b')], list(files))
+    # Files can be listed again, and the listing stopped early.
+    self.assertEquals(join('dep', 'a'), next(iter(files)))
+    self.assertEquals(
+        [join(self.base_path, 'a'), join(self.base_path, 'b')],
+        list(gclient_scm.AllFiles(self.base_path)))
+
 
 class ManagedGitWrapperTestCaseMox(BaseTestCase):
   class OptionsObject(object):
@@ -630,9 +864,6 @@ class ManagedGitWrapperTestCaseMox(BaseTestCase):
     gclient_scm.GitWrapper._Clone('refs/remotes/origin/master', self.url,
                                   options)
     self.mox.StubOutWithMock(gclient_scm.subprocess2, 'check_output', True)
-    gclient_scm.subprocess2.check_output(
-        ['git', 'ls-files'], cwd=self.base_path,
-        env=gclient_scm.scm.GIT.ApplyEnvVars({}), stderr=-1,).AndReturn('')
     gclient_scm.subprocess2.check_output(
         ['git', 'rev-parse', '--verify', 'HEAD'],
         cwd=self.base_path,
@@ -667,9 +898,6 @@ class ManagedGitWrapperTestCaseMox(BaseTestCase):
     gclient_scm.GitWrapper._Clone('refs/remotes/origin/master', self.url,
                                   options)
     self.mox.StubOutWithMock(gclient_scm.subprocess2, 'check_output', True)
-    gclient_scm.subprocess2.check_output(
-        ['git', 'ls-files'], cwd=self.base_path,
-        env=gclient_scm.scm.GIT.ApplyEnvVars({}), stderr=-1,).AndReturn('')
     gclient_scm.subprocess2.check_output(
         ['git', 'rev-parse', '--verify', 'HEAD'],
         cwd=self.base_path,
@@ -725,7 +953,7 @@ class UnmanagedGitWrapperTestCase(BaseGitWrapperTestCase):
     options.revision = 'unmanaged'
     scm.update(options, (), file_list)
 
-    self.assertEquals(file_list, expected_file_list)
+    self.assertEquals(list(file_list[0]), expected_file_list)
     self.assertEquals(scm.revinfo(options, (), None),
                       '069c602044c5388d2d15c3f875b057c852003458')
     # indicates detached HEAD
@@ -757,7 +985,7 @@ class UnmanagedGitWrapperTestCase(BaseGitWrapperTestCase):
     options.revision = 'unmanaged'
     scm.update(options, (), file_list)
 
-    self.assertEquals(file_list, expected_file_list)
+    self.assertEquals(list(file_list[0]), expected_file_list)
     self.assertEquals(scm.revinfo(options, (), None),
                       'a7142dc9f0009350b96a11f372b6ea658592aa95')
     # indicates detached HEAD
@@ -789,7 +1017,7 @@ class UnmanagedGitWrapperTestCase(BaseGitWrapperTestCase):
     options.revision = 'unmanaged'
     scm.update(options, (), file_list)
 
-    self.assertEquals(file_list, expected_file_list)
+    self.assertEquals(list(file_list[0]), expected_file_list)
     self.assertEquals(scm.revinfo(options, (), None),
                       '9a51244740b25fa2ded5252ca00a3178d3f665a9')
     self.assertEquals(self.getCurrentBranch(), 'feature')
@@ -819,7 +1047,7 @@ class UnmanagedGitWrapperTestCase(BaseGitWrapperTestCase):
     options.revision = 'unmanaged'
     scm.update(options, (), file_list)
 
-    self.assertEquals(file_list, expected_file_list)
+    self.assertEquals(list(file_list[0]), expected_file_list)
     self.assertEquals(scm.revinfo(options, (), None),
                       '9a51244740b25fa2ded5252ca00a3178d3f665a9')
     # indicates detached HEAD
@@ -851,7 +1079,7 @@ class UnmanagedGitWrapperTestCase(BaseGitWrapperTestCase):
     options.revision = 'unmanaged'
     scm.update(options, (), file_list)
 
-    self.assertEquals(file_list, expected_file_list)
+    self.assertEquals(list(file_list[0]), expected_file_list)
     self.assertEquals(scm.revinfo(options, (), None),
                       '9a51244740b25fa2ded5252ca00a3178d3f665a9')
     # @refs/heads/feature is AKA @refs/remotes/origin/feature in the clone, so
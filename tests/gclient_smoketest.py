@@ -10,6 +10,7 @@ Shell out 'gclient' and run basic conformance tests.
 This test assumes GClientSmokeBase.URL_BASE is valid.
 """
 
+import json
 import logging
 import os
 import re
@@ -20,6 +21,7 @@ import unittest
 ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, ROOT_DIR)
 
+import gclient_history
 import gclient_utils
 import scm as gclient_scm
 import subprocess2
@@ -366,6 +368,149 @@ class GClientSmokeGIT(GClientSmokeBase):
                                 ('repo_4@2', 'src/repo4'))
     self.assertTree(tree)
 
+  def testSyncHistory(self):
+    if not self.enabled:
+      return
+    self.gclient(['config', self.git_base + 'repo_1', '--name', 'src'])
+    self.parseGclient(
+        ['sync', '--deps', 'mac', '--jobs', '1'],
+        ['running', 'running'])
+    history = gclient_history.SyncHistory.Load(
+        join(self.root_dir, '.gclient_history'))
+    self.assertEquals(['src'], history.solutions)
+    self.assertEquals(
+        ['src/repo2', 'src/repo2/repo_renamed'], history.children('src'))
+    self.assertTrue('src/repo2' in history)
+    self.assertTrue(
+        history.critical_path('src') >= history.critical_path('src/repo2'))
+
+  def testSyncTrace(self):
+    if not self.enabled:
+      return
+    self.gclient(['config', self.git_base + 'repo_1', '--name', 'src'])
+    trace_path = join(self.root_dir, '.trace.json')
+    stdout, _, returncode = self.gclient(
+        ['sync', '--deps', 'mac', '--jobs', '2', '--trace', trace_path])
+    self.assertEquals(0, returncode)
+    self.assertIn('Slowest 20 spans (trace written to %s):' % trace_path,
+                  stdout)
+    with open(trace_path) as f:
+      events = json.load(f)['traceEvents']
+    spans = [(e['cat'], e['name']) for e in events if e['ph'] == 'X']
+    for dep in ('src', 'src/repo2', 'src/repo2/repo_renamed'):
+      self.assertIn(('task', dep), spans)
+    self.assertIn(('deps', 'parse DEPS'), spans)
+    self.assertIn(('scm', 'update'), spans)
+    self.assertIn(('git', 'git checkout'), spans)
+    self.assertTrue(any(c == 'hook' for c, _ in spans))
+    tracks = [e['args']['name'] for e in events
+              if e['ph'] == 'M' and e['name'] == 'thread_name']
+    self.assertTrue(set(tracks) <= set(['main', 'worker 1', 'worker 2']),
+                    tracks)
+
+  def testSyncOnly(self):
+    if not self.enabled:
+      return
+    self.gclient(['config', self.git_base + 'repo_1', '--name', 'src'])
+    self.gclient(['sync', '--deps', 'mac', '--jobs', '1', '--revision',
+                  'src@' + self.githash('repo_1', 1)])
+    _, _, returncode = self.gclient(
+        ['sync', '--deps', 'mac', '--jobs', '1', '--only', 'src/repo2',
+         '--delete_unversioned_trees'])
+    self.assertEquals(0, returncode)
+    # src is synced to get the DEPS of src/repo2. src/repo2/repo3 and src/repo4
+    # are not in DEPS anymore but they are outside of the selection, so they
+    # are left alone. The hooks of src do not run.
+    tree = self.mangle_git_tree(('repo_1@2', 'src'),
+                                ('repo_2@1', 'src/repo2'),
+                                ('repo_3@1', 'src/repo2/repo3'),
+                                ('repo_3@2', 'src/repo2/repo_renamed'),
+                                ('repo_4@2', 'src/repo4'))
+    self.assertTree(tree)
+    entries = {}
+    with open(join(self.root_dir, '.gclient_entries')) as f:
+      exec(f.read(), entries)
+    self.assertEquals(
+        ['src', 'src/repo2', 'src/repo2/repo3', 'src/repo2/repo_renamed',
+         'src/repo4'],
+        sorted(entries['entries']))
+
+  def testSyncOffline(self):
+    if not self.enabled:
+      return
+    self.gclient(['config', self.git_base + 'repo_1', '--name', 'src'])
+    self.gclient(['sync', '--deps', 'mac', '--jobs', '1'])
+    tree = self.mangle_git_tree(('repo_1@2', 'src'),
+                                ('repo_2@1', 'src/repo2'),
+                                ('repo_3@2', 'src/repo2/repo_renamed'))
+    tree['src/git_hooked1'] = 'git_hooked1'
+    tree['src/git_hooked2'] = 'git_hooked2'
+    _, _, returncode = self.gclient(
+        ['sync', '--deps', 'mac', '--jobs', '1', '--offline'])
+    self.assertEquals(0, returncode)
+    self.assertTree(tree)
+    # src@1 adds src/repo4, which was never fetched.
+    _, stderr, returncode = self.gclient(
+        ['sync', '--deps', 'mac', '--jobs', '1', '--offline', '--revision',
+         'src@' + self.githash('repo_1', 1)])
+    self.assertNotEquals(0, returncode)
+    self.assertIn('src/repo4: %srepo_4' % self.git_base, stderr)
+    self.assertFalse(os.path.exists(join(self.root_dir, 'src', 'repo4')))
+
+  def testSyncResume(self):
+    if not self.enabled:
+      return
+    self.gclient(['config', self.git_base + 'repo_1', '--name', 'src'])
+    self.gclient(['sync', '--deps', 'mac'])
+    journal_path = join(self.root_dir, '.gclient_journal')
+    self.assertFalse(os.path.exists(journal_path))
+    # Pretend a sync was interrupted after updating src/repo2 and after
+    # updating src/repo2/repo_renamed to a revision it is not at anymore.
+    with open(journal_path, 'w') as f:
+      f.write(json.dumps({
+          'name': 'src/repo2',
+          'url': '%srepo_2@%s' % (self.git_base,
+                                  self.githash('repo_2', 1)[:7]),
+          'revision': self.githash('repo_2', 1)}) + '\n')
+      f.write(json.dumps({
+          'name': 'src/repo2/repo_renamed',
+          'url': '%srepo_3' % self.git_base,
+          'revision': self.githash('repo_3', 1)}) + '\n')
+      f.write('{"name": "trunc')
+    stdout, _, returncode = self.gclient(['sync', '--deps', 'mac', '--resume'])
+    self.assertEquals(0, returncode)
+    self.assertIn('src/repo2 already synced to %s; skipping' %
+                  self.githash('repo_2', 1), stdout)
+    self.assertNotIn('src/repo2/repo_renamed already synced', stdout)
+    self.assertIn('Resumed an interrupted sync: skipped 1 dependencies.',
+                  stdout)
+    self.assertFalse(os.path.exists(journal_path))
+    tree = self.mangle_git_tree(('repo_1@2', 'src'),
+                                ('repo_2@1', 'src/repo2'),
+                                ('repo_3@2', 'src/repo2/repo_renamed'))
+    tree['src/git_hooked1'] = 'git_hooked1'
+    tree['src/git_hooked2'] = 'git_hooked2'
+    self.assertTree(tree)
+
+    # The journal doesn't apply to a dependency with a --revision override.
+    with open(journal_path, 'w') as f:
+      f.write(json.dumps({
+          'name': 'src/repo2',
+          'url': '%srepo_2@%s' % (self.git_base,
+                                  self.githash('repo_2', 1)[:7]),
+          'revision': self.githash('repo_2', 1)}) + '\n')
+    stdout, _, returncode = self.gclient(
+        ['sync', '--deps', 'mac', '--resume', '--revision',
+         'src/repo2@' + self.githash('repo_2', 2)])
+    self.assertEquals(0, returncode)
+    self.assertNotIn('src/repo2 already synced', stdout)
+    tree = self.mangle_git_tree(('repo_1@2', 'src'),
+                                ('repo_2@2', 'src/repo2'),
+                                ('repo_3@2', 'src/repo2/repo_renamed'))
+    tree['src/git_hooked1'] = 'git_hooked1'
+    tree['src/git_hooked2'] = 'git_hooked2'
+    self.assertTree(tree)
+
   def testSyncJobs(self):
     if not self.enabled:
       return
@@ -535,6 +680,64 @@ class GClientSmokeGIT(GClientSmokeBase):
           })
     self.check((out, '', 0), results)
 
+  def testStatusAndDiffJson(self):
+    if not self.enabled:
+      return
+    self.gclient(['config', self.git_base + 'repo_1', '--name', 'src'])
+    self.gclient(['sync', '--deps', 'mac'])
+    write(join(self.root_dir, 'src', 'repo2', 'hi'), 'Hey!')
+    write(join(self.root_dir, 'src', 'repo2', 'origin'), 'changed\n')
+    # With --verbose, the other output goes to stderr.
+    stdout, _, returncode = self.gclient(
+        ['status', '--deps', 'mac', '--jobs', '4', '--json', '--verbose'])
+    self.assertEquals(0, returncode)
+    deps = json.loads(stdout)['dependencies']
+    self.assertEquals(
+        ['src', 'src/repo2', 'src/repo2/repo_renamed'], sorted(deps))
+    repo2 = deps['src/repo2']
+    # Nested checkouts are untracked files of their parent.
+    self.assertEquals(
+        [{'status': ' M', 'path': 'origin'}, {'status': '??', 'path': 'hi'},
+         {'status': '??', 'path': 'repo_renamed/'}],
+        repo2['files'])
+    self.assertEquals(self.githash('repo_2', 1), repo2['revision'])
+    # src/repo2 is pinned to its first commit, the remote is one commit ahead.
+    self.assertEquals(('origin', 0, 1),
+                      (repo2['upstream'], repo2['ahead'], repo2['behind']))
+    self.assertEquals(
+        self.git_base + 'repo_2@' + self.githash('repo_2', 1)[:7],
+        repo2['url'])
+    self.assertTrue(repo2['exists'])
+    self.assertTrue(repo2['seconds'] >= 0)
+    # The hooks wrote untracked files in src.
+    self.assertIn({'status': '??', 'path': 'git_hooked1'},
+                  deps['src']['files'])
+
+    stdout, _, returncode = self.gclient(
+        ['diff', '--deps', 'mac', '--jobs', '4', '--json', '--verbose'])
+    self.assertEquals(0, returncode)
+    deps = json.loads(stdout)['dependencies']
+    self.assertIn('+changed', deps['src/repo2']['diff'])
+    self.assertEquals('', deps['src/repo2/repo_renamed']['diff'])
+
+  def testGrep(self):
+    if not self.enabled:
+      return
+    self.gclient(['config', self.git_base + 'repo_1', '--name', 'src'])
+    self.gclient(['sync', '--deps', 'mac'])
+    # Each checkout has an origin file, the output is in the order of the
+    # checkouts whatever the order the git greps finish in.
+    stdout, _, returncode = self.gclient(
+        ['grep', '-j', '4', '--no-color', '-l', '@'])
+    self.assertEquals(0, returncode)
+    self.assertEquals(
+        ['src/origin', 'src/repo2/origin', 'src/repo2/repo_renamed/origin'],
+        [l for l in stdout.splitlines() if l.endswith('origin')])
+    stdout, _, returncode = self.gclient(
+        ['grep', '--max-lines=2', '--no-color', '-l', '@'])
+    self.assertEquals(0, returncode)
+    self.assertEquals(2, len(stdout.splitlines()))
+
 
 class GClientSmokeGITMutates(GClientSmokeBase):
   """testRevertAndStatus mutates the git repo so move it to its own suite."""
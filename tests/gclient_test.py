@@ -9,15 +9,18 @@ See gclient_smoketest.py for integration tests.
 """
 
 import Queue
+import StringIO
 import copy
 import logging
 import os
 import sys
+import threading
 import unittest
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import gclient
+import gclient_deps_cache
 import gclient_utils
 from testing_support import trial_dir
 
@@ -73,7 +76,8 @@ class GclientTest(trial_dir.TestCase):
     os.chdir(self.previous_dir)
     super(GclientTest, self).tearDown()
 
-  def _createscm(self, parsed_url, root_dir, name, out_fh=None, out_cb=None):
+  def _createscm(self, parsed_url, root_dir, name, out_fh=None, out_cb=None,
+                 stages=None, fetches=None, remote_refs=None):
     self.assertTrue(parsed_url.startswith('svn://example.com/'), parsed_url)
     self.assertTrue(root_dir.startswith(self.root_dir), root_dir)
     return SCMMock(self, name, parsed_url)
@@ -332,6 +336,186 @@ class GclientTest(trial_dir.TestCase):
     self.assertEqual(client.GetHooks(options),
                      [x['action'] for x in hooks + extra_hooks + sub_hooks])
 
+  def testDepsCache(self):
+    with open(os.path.join(self.root_dir, '.gclient'), 'w') as f:
+      print >> f, 'solutions = [{"name":"top","url":"svn://example.com/top"}]'
+    os.mkdir(os.path.join(self.root_dir, 'top'))
+    with open(os.path.join(self.root_dir, 'top', 'DEPS'), 'w') as f:
+      print >> f, 'vars = {"host": "svn://example.com"}'
+      print >> f, 'deps = {"bar": Var("host") + "/bar"}'
+      print >> f, 'hooks = [{"pattern": ".", "action": ["cmd1"]}]'
+    os.chdir(self.root_dir)
+    cache = gclient_deps_cache.DepsCache()
+
+    def parse():
+      options, _ = gclient.OptionParser().parse_args([])
+      client = gclient.GClient.LoadCurrentConfig(options)
+      client.deps_cache = cache
+      work_queue = gclient_utils.ExecutionQueue(options.jobs, None, False)
+      for s in client.dependencies:
+        work_queue.enqueue(s)
+      work_queue.flush({}, None, [], options=options)
+      return [(d.name, d.url) for d in client.subtree(False)], client
+
+    uncached, _ = parse()
+    self.assertEquals((0, 1), (cache.hits, cache.misses))
+    cached, client = parse()
+    self.assertEquals((1, 1), (cache.hits, cache.misses))
+    self.assertEquals(uncached, cached)
+    self.assertEquals([['cmd1']], client.GetHooks(client._options))
+
+  def testDepsSelection(self):
+    only = gclient.DepsSelection(['src/third_party/foo', 'src/v8*/', ' '])
+    self.assertEquals(['src/third_party/foo', 'src/v8*'], only.globs)
+    self.assertTrue(only.Matches('src/third_party/foo'))
+    self.assertTrue(only.Matches('src/third_party/foo/bar'))
+    self.assertTrue(only.Matches('src/v8/x'))
+    self.assertFalse(only.Matches('src/third_party/foobar'))
+    self.assertFalse(only.Matches('src'))
+    self.assertTrue(only.MayContain('src'))
+    self.assertTrue(only.MayContain('src/third_party'))
+    self.assertFalse(only.MayContain('src/v'))
+    self.assertFalse(only.MayContain('src/third_party/foobar'))
+    self.assertFalse(only.MayContain('other'))
+    self.assertTrue(only.Wants('src', False))
+    self.assertTrue(only.Wants('other', True))
+    self.assertFalse(only.Wants('other', False))
+    self.assertTrue(only.CoversPattern(r'^src/third_party/foo/.*\.py$'))
+    self.assertTrue(only.CoversPattern(r'^src/v8\.git/'))
+    self.assertFalse(only.CoversPattern('src/third_party/foo/'))
+    self.assertFalse(only.CoversPattern('^src/third_party/foo'))
+    self.assertFalse(only.CoversPattern('^src/third_party/foo/?x'))
+    self.assertFalse(only.CoversPattern('^src/third_party/foo/|^other/'))
+    self.assertFalse(only.CoversPattern('.'))
+
+  def testOnly(self):
+    write(
+        '.gclient',
+        'solutions = [\n'
+        '  { "name": "foo", "url": "svn://example.com/foo" },\n'
+        '  { "name": "bar", "url": "svn://example.com/bar" },\n'
+        ']')
+    write(
+        os.path.join('foo', 'DEPS'),
+        'deps = {\n'
+        '  "foo/a": "/a",\n'
+        '  "foo/b": "/b",\n'
+        '  "foo/b/c": "/c",\n'
+        '}\n'
+        'hooks = [\n'
+        '  {"pattern": ".", "action": ["all"]},\n'
+        '  {"pattern": "^foo/b/", "action": ["b"]},\n'
+        ']')
+    write(os.path.join('bar', 'DEPS'), 'hooks = [{"action": ["bar"]}]')
+    options, _ = gclient.OptionParser().parse_args([])
+    options.only = 'foo/b'
+    client = gclient.GClient.LoadCurrentConfig(options)
+    client.RunOnDeps('None', [])
+    self.assertEquals(
+        [('foo', 'svn://example.com/foo'),
+         ('foo/b', 'svn://example.com/foo/b'),
+         ('foo/b/c', 'svn://example.com/foo/c')],
+        self._get_processed())
+    self.assertEquals([['b']], client.GetHooks(options))
+
+  def testHookMatcher(self):
+    matcher = gclient.HookMatcher([
+        {'pattern': r'\.txt$'},
+        {'pattern': '^src/'},
+        {'pattern': r'(a)\1'},
+        {'pattern': '(?i)readme'},
+    ])
+    for f in ('src/a.txt', 'aa', 'README', 'other', 'src/aa'):
+      matcher.Add(f)
+    self.assertEquals(
+        [['src/a.txt'], ['src/a.txt', 'src/aa'], ['aa', 'src/aa'], ['README']],
+        matcher.matches)
+
+  def testHookPatterns(self):
+    write(
+        '.gclient',
+        'solutions = [\n'
+        '  { "name": "top", "url": "svn://example.com/top" },\n'
+        ']')
+    write(
+        os.path.join('top', 'DEPS'),
+        'deps = {"top/sub": "/sub"}\n'
+        'hooks = [\n'
+        '  {"pattern": "\\\\.gyp$", "action": ["gyp", "$matching_files"]},\n'
+        '  {"pattern": "^top/sub/", "action": ["sub"]},\n'
+        '  {"pattern": "nothing", "action": ["never"]},\n'
+        ']')
+    options, _ = gclient.OptionParser().parse_args([])
+    client = gclient.GClient.LoadCurrentConfig(options)
+    work_queue = gclient_utils.ExecutionQueue(options.jobs, None, False)
+    for s in client.dependencies:
+      work_queue.enqueue(s)
+    work_queue.flush({}, None, [], options=options)
+    top = client.dependencies[0]
+    # pylint: disable=protected-access
+    top._file_list = ['top/a.gyp', 'top/b.cc']
+    top.dependencies[0]._file_list = ['top/sub/c.gyp']
+    old_getscmname = gclient.gclient_scm.GetScmName
+    # Pattern matching is only used for checkouts which are not git ones.
+    gclient.gclient_scm.GetScmName = lambda _: 'svn'
+    try:
+      self.assertEquals(
+          [['gyp', 'top/a.gyp', 'top/sub/c.gyp'], ['sub']],
+          client.GetHooks(options))
+      options.force = True
+      self.assertEquals(
+          [['gyp'], ['sub'], ['never']], client.GetHooks(options))
+    finally:
+      gclient.gclient_scm.GetScmName = old_getscmname
+
+  def testMakeHookItems(self):
+    hooks = [
+        ({'name': 'fetch', 'action': ['a']}, ['a']),
+        ({'name': 'gen', 'action': ['b'], 'after': ['fetch', 'unknown']},
+         ['b']),
+        ({'action': ['c'], 'lock': 'out'}, ['c']),
+        ({'name': 'clobber', 'action': ['d'], 'parallel': False}, ['d']),
+        ({'action': ['e'], 'lock': ['out', 'cache']}, ['e']),
+    ]
+    items = gclient.MakeHookItems(hooks)
+    self.assertEqual(
+        ['1: fetch', '2: gen', '3: c', '4: clobber', '5: e'],
+        [i.name for i in items])
+    self.assertEqual(
+        [['a'], ['b'], ['c'], ['d'], ['e']], [i.action for i in items])
+    self.assertEqual(
+        [(), ('1: fetch',), (), ('1: fetch', '2: gen', '3: c'),
+         ('4: clobber',)],
+        [i.requirements for i in items])
+    self.assertEqual(
+        [[], [], ['out'], [], ['out', 'cache']],
+        [i.resources for i in items])
+
+  def testRunHooksJobs(self):
+    def touch(name, after=()):
+      # Fails if one of |after| does not exist yet.
+      script = (
+          'import os, sys\n'
+          'assert all(os.path.exists(f) for f in %r)\n'
+          'open(%r, "w").close()\n' % (list(after), name))
+      return [sys.executable, '-c', script]
+    hooks = [
+        ({'name': 'a', 'action': touch('a')}, touch('a')),
+        ({'name': 'b', 'action': touch('b', ['a']), 'after': ['a']},
+         touch('b', ['a'])),
+        ({'action': touch('c', ['a', 'b']), 'parallel': False},
+         touch('c', ['a', 'b'])),
+        ({'action': touch('d', ['c'])}, touch('d', ['c'])),
+    ]
+    gclient.RunHooks(hooks, self.root_dir, 3)
+    self.assertEqual(
+        ['a', 'b', 'c', 'd'], sorted(os.listdir(self.root_dir)))
+
+    failing = [({'action': ['false']}, [sys.executable, '-c', 'exit(1)'])]
+    with self.assertRaises(SystemExit) as e:
+      gclient.RunHooks(failing, self.root_dir, 2)
+    self.assertEqual(2, e.exception.code)
+
   def testTargetOS(self):
     """Verifies that specifying a target_os pulls in all relevant dependencies.
 
@@ -1097,6 +1281,97 @@ class GclientTest(trial_dir.TestCase):
       self._get_processed()
 
 
+class FakeGrepProcess(object):
+  """Stand-in for the git grep process of ParallelGrep."""
+  def __init__(self, lines, errors='', wait_for=None, done=None):
+    self.lines = list(lines)
+    self.errors = errors
+    self.wait_for = wait_for
+    self.done = done
+    self.stdout = self
+    self.returncode = None
+
+  def readline(self):
+    if self.wait_for:
+      self.wait_for.wait(10)
+    if not self.lines:
+      if self.done:
+        self.done.set()
+      return ''
+    return self.lines.pop(0) + '\n'
+
+  def poll(self):
+    return self.returncode
+
+  def kill(self):
+    self.returncode = -9
+    self.lines = []
+
+  def close(self):
+    pass
+
+  def wait(self):
+    self.returncode = self.returncode or 0
+    return self.returncode
+
+
+class ParallelGrepTest(unittest.TestCase):
+  def setUp(self):
+    super(ParallelGrepTest, self).setUp()
+    self._old_popen = gclient.subprocess2.Popen
+    self.procs = {}
+    gclient.subprocess2.Popen = self._popen
+
+  def tearDown(self):
+    gclient.subprocess2.Popen = self._old_popen
+    super(ParallelGrepTest, self).tearDown()
+
+  def _popen(self, _cmd, cwd, stderr, **_kwargs):
+    proc = self.procs[os.path.basename(cwd)]
+    if isinstance(proc, Exception):
+      raise proc
+    stderr.write(proc.errors)
+    return proc
+
+  def _run(self, names, jobs, max_lines=None):
+    out = StringIO.StringIO()
+    err = StringIO.StringIO()
+    grep = gclient.ParallelGrep('/root', names, ['foo'], jobs, max_lines)
+    return grep.Run(out, err), out.getvalue(), err.getvalue()
+
+  def testOrder(self):
+    # a only finishes after c; its output still comes first.
+    c_done = threading.Event()
+    self.procs = {
+        'a': FakeGrepProcess(['x\0a1'], wait_for=c_done),
+        'b': FakeGrepProcess(['x\0b1', 'x\0b2'], errors='b failed\n'),
+        'c': FakeGrepProcess(['x\0c1'], done=c_done),
+    }
+    self.assertEquals(
+        (4, 'a/x : a1\nb/x : b1\nb/x : b2\nc/x : c1\n', 'b failed\n'),
+        self._run(['a', 'b', 'c'], 3))
+
+  def testMaxLines(self):
+    self.procs = {
+        'a': FakeGrepProcess(['x\0a1']),
+        'b': FakeGrepProcess(['x\0b1', 'x\0b2', 'x\0b3']),
+        'c': FakeGrepProcess(['x\0c1']),
+    }
+    self.assertEquals(
+        (2, 'a/x : a1\nb/x : b1\n', ''), self._run(['a', 'b', 'c'], 1, 2))
+    # The grep of b stopped reading once it had enough lines.
+    self.assertEquals(-9, self.procs['b'].returncode)
+
+  def testWorkerFailure(self):
+    self.procs = {
+        'a': FakeGrepProcess(['x\0a1']),
+        'b': OSError('no git'),
+        'c': FakeGrepProcess(['x\0c1']),
+    }
+    with self.assertRaises(OSError):
+      self._run(['a', 'b', 'c'], 2)
+
+
 if __name__ == '__main__':
   sys.stdout = gclient_utils.MakeFileAutoFlush(sys.stdout)
   sys.stdout = gclient_utils.MakeFileAnnotated(sys.stdout, include_zero=True)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# Copyright 2017 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Unit tests for gclient_trace.py."""
+
+import datetime
+import json
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from testing_support import trial_dir
+
+import gclient_trace
+import gclient_utils
+
+
+class Item(gclient_utils.WorkItem):
+  def __init__(self, name, requirements=()):
+    super(Item, self).__init__(name)
+    self._requirements = tuple(requirements)
+
+  @property
+  def requirements(self):
+    return self._requirements
+
+  def run(self, work_queue):
+    with gclient_trace.Span('step', 'test', dep=self.name):
+      pass
+
+
+class TraceTest(trial_dir.TestCase):
+  def setUp(self):
+    super(TraceTest, self).setUp()
+    self.path = os.path.join(self.root_dir, 'trace.json')
+
+  def tearDown(self):
+    gclient_trace._tracer = None
+    super(TraceTest, self).tearDown()
+
+  def load(self):
+    with open(self.path) as f:
+      return json.load(f)['traceEvents']
+
+  def testDisabled(self):
+    self.assertFalse(gclient_trace.IsEnabled())
+    with gclient_trace.Span('nothing', 'test'):
+      pass
+    gclient_trace.AddWorkItem(Item('a'))
+
+  def testExecutionQueue(self):
+    gclient_trace.Start()
+    work_queue = gclient_utils.ExecutionQueue(2, None, False)
+    for item in (Item('a'), Item('b'), Item('c', ['a'])):
+      work_queue.enqueue(item)
+    work_queue.flush()
+    summary = gclient_trace.Stop(self.path)
+    self.assertFalse(gclient_trace.IsEnabled())
+    events = self.load()
+
+    spans = sorted((e['cat'], e['name'], e['args']['dep'])
+                   for e in events if e['ph'] == 'X')
+    self.assertEquals([
+        ('task', 'a', 'a'), ('task', 'b', 'b'), ('task', 'c', 'c'),
+        ('test', 'step', 'a'), ('test', 'step', 'b'), ('test', 'step', 'c'),
+    ], spans)
+    waits = sorted(e['name'] for e in events if e['ph'] == 'b')
+    self.assertEquals(['a', 'b', 'c'], waits)
+    # Only two worker tracks for two jobs, whatever the number of items.
+    tracks = sorted(e['args']['name'] for e in events
+                    if e['ph'] == 'M' and e['name'] == 'thread_name')
+    self.assertEquals(['worker 1', 'worker 2'], tracks)
+    # Spans of an item are on the same track as the item.
+    tids = dict(((e['cat'], e['args']['dep']), e['tid'])
+                for e in events if e['ph'] == 'X')
+    for name in 'abc':
+      self.assertEquals(tids[('task', name)], tids[('test', name)])
+
+    self.assertEquals(
+        'Slowest 20 spans (trace written to %s):' % self.path,
+        summary.splitlines()[0])
+    self.assertEquals(10, len(summary.splitlines()))
+
+  def testSlowest(self):
+    tracer = gclient_trace.Tracer()
+    tracer.AddSpan('short', 'test', 10, 11)
+    tracer.AddSpan('long', 'test', 10, 15, {'dep': 'src'})
+    tracer.AddAsyncSpan('wait', 'queue', 0, 3)
+    self.assertEquals(
+        [(5, 'test', 'long', {'dep': 'src'}), (3, 'queue', 'wait', {})],
+        tracer.Slowest(2))
+
+  def testSeconds(self):
+    self.assertAlmostEqual(
+        time.time(), gclient_trace._Seconds(datetime.datetime.now()), delta=1)
+
+
+if __name__ == '__main__':
+  unittest.main()
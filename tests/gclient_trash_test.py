@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# Copyright 2017 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Unit tests for gclient_trash.py."""
+
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from testing_support import trial_dir
+
+import gclient_trash
+
+
+class TrashTest(trial_dir.TestCase):
+  def setUp(self):
+    super(TrashTest, self).setUp()
+    self.trash_dir = os.path.join(self.root_dir, '.gclient_trash')
+
+  def _MakeTree(self, name):
+    path = os.path.join(self.root_dir, name)
+    os.makedirs(os.path.join(path, 'sub'))
+    with open(os.path.join(path, 'sub', 'file'), 'w') as f:
+      f.write('data')
+    return path
+
+  def testMove(self):
+    for name in ('src/a', 'src/b/a'):
+      path = self._MakeTree(name)
+      gclient_trash.Move(self.root_dir, path)
+      self.assertFalse(os.path.exists(path))
+    self.assertEquals(2, len(os.listdir(self.trash_dir)))
+    self.assertFalse(gclient_trash.IsEmpty(self.root_dir))
+    gclient_trash.Empty(self.trash_dir)
+    self.assertFalse(os.path.exists(self.trash_dir))
+    self.assertTrue(gclient_trash.IsEmpty(self.root_dir))
+
+  def testMoveFallsBackToDelete(self):
+    path = self._MakeTree('src/a')
+    def rename(*_args):
+      raise OSError(18, 'Invalid cross-device link')
+    old_rename = gclient_trash.os.rename
+    gclient_trash.os.rename = rename
+    try:
+      gclient_trash.Move(self.root_dir, path)
+    finally:
+      gclient_trash.os.rename = old_rename
+    self.assertFalse(os.path.exists(path))
+    self.assertTrue(gclient_trash.IsEmpty(self.root_dir))
+
+  def testMoveRacesWithEmpty(self):
+    path = self._MakeTree('src/a')
+    calls = []
+    def rename(src, dst):
+      if not calls:
+        # Empty() deletes the new slot right before the rename.
+        gclient_trash.Empty(self.trash_dir)
+      calls.append(dst)
+      old_rename(src, dst)
+    old_rename = gclient_trash.os.rename
+    gclient_trash.os.rename = rename
+    try:
+      gclient_trash.Move(self.root_dir, path)
+    finally:
+      gclient_trash.os.rename = old_rename
+    self.assertEquals(2, len(calls))
+    self.assertFalse(os.path.exists(path))
+    self.assertTrue(os.path.isdir(calls[1]))
+
+  def testEmptyInBackground(self):
+    gclient_trash.Move(self.root_dir, self._MakeTree('src/a'))
+    gclient_trash.EmptyInBackground(self.root_dir)
+    for _ in xrange(100):
+      if not os.path.exists(self.trash_dir):
+        break
+      time.sleep(0.1)
+    self.assertFalse(os.path.exists(self.trash_dir))
+
+
+if __name__ == '__main__':
+  unittest.main()
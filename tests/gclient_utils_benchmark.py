@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# Copyright 2017 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Micro-benchmarks for gclient_utils.
+
+Not a unit test; run it manually, e.g.:
+  tests/gclient_utils_benchmark.py execution_queue --items 2000 --jobs 8
+  tests/gclient_utils_benchmark.py check_call_and_filter --megabytes 500
+"""
+
+import optparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gclient_utils
+
+
+class SyntheticDependency(gclient_utils.WorkItem):
+  """A Dependency-like WorkItem which does nothing when run."""
+  def __init__(self, name, requirements, resources):
+    super(SyntheticDependency, self).__init__(name)
+    self._requirements = tuple(requirements)
+    self.resources.extend(resources)
+
+  @property
+  def requirements(self):
+    return self._requirements
+
+  def run(self, work_queue):
+    pass
+
+
+def make_items(count, max_requirements, seed):
+  """Returns |count| items with a random acyclic requirement graph.
+
+  Like DEPS entries, names are paths and a few items share a url resource.
+  """
+  rand = random.Random(seed)
+  names = []
+  items = []
+  for i in xrange(count):
+    if names and rand.random() < 0.3:
+      name = '%s/sub%d' % (rand.choice(names), i)
+    else:
+      name = 'src/third_party/dep%d' % i
+    requirements = set()
+    if names:
+      for _ in xrange(rand.randint(0, max_requirements)):
+        requirements.add(rand.choice(names))
+    resources = ['https://host/repo%d.git' % rand.randint(0, count)]
+    names.append(name)
+    items.append(SyntheticDependency(name, requirements, resources))
+  # Enqueue in a shuffled order so many items wait on others.
+  rand.shuffle(items)
+  return items
+
+
+def bench_execution_queue(options):
+  items = make_items(options.items, options.max_requirements, options.seed)
+  queue = gclient_utils.ExecutionQueue(options.jobs, None, False)
+  start = time.time()
+  for item in items:
+    queue.enqueue(item)
+  enqueued = time.time()
+  queue.flush()
+  end = time.time()
+  assert len(queue.ran) == len(items), (len(queue.ran), len(items))
+  print 'items: %d, jobs: %d' % (len(items), options.jobs)
+  print 'enqueue: %.3fs (%.1f us/task)' % (
+      enqueued - start, (enqueued - start) * 1e6 / len(items))
+  print 'flush:   %.3fs (%.1f us/task)' % (
+      end - enqueued, (end - enqueued) * 1e6 / len(items))
+  print 'total scheduling overhead: %.1f us/task' % (
+      (end - start) * 1e6 / len(items))
+
+
+def bench_check_call_and_filter(options):
+  # The child writes --megabytes of text, in lines of --line-length bytes.
+  line = 'x' * (options.line_length - 1) + '\n'
+  count = options.megabytes * 1024 * 1024 / len(line)
+  script = (
+      'import sys\n'
+      'block = %r * 1024\n'
+      'for _ in xrange(%d): sys.stdout.write(block)\n' % (line, count / 1024))
+  lines = [0]
+  def filter_fn(_):
+    lines[0] += 1
+  start = time.time()
+  output = gclient_utils.CheckCallAndFilter(
+      [sys.executable, '-c', script], filter_fn=filter_fn)
+  elapsed = time.time() - start
+  assert lines[0] == count / 1024 * 1024, lines[0]
+  print 'read %.1f MB in %d lines' % (len(output) / 1024. / 1024, lines[0])
+  print 'time: %.2fs (%.1f MB/s)' % (
+      elapsed, len(output) / 1024. / 1024 / elapsed)
+
+
+BENCHMARKS = {
+  'check_call_and_filter': bench_check_call_and_filter,
+  'execution_queue': bench_execution_queue,
+}
+
+
+def main(argv):
+  parser = optparse.OptionParser(
+      usage='%%prog [options] <%s>' % '|'.join(sorted(BENCHMARKS)))
+  parser.add_option('--items', type='int', default=1000,
+                    help='Number of synthetic dependencies.')
+  parser.add_option('--max-requirements', type='int', default=4,
+                    help='Maximum number of requirements per dependency.')
+  parser.add_option('--megabytes', type='int', default=200,
+                    help='Amount of output for check_call_and_filter.')
+  parser.add_option('--line-length', type='int', default=80)
+  parser.add_option('-j', '--jobs', type='int', default=1)
+  parser.add_option('--seed', type='int', default=0)
+  options, args = parser.parse_args(argv)
+  if len(args) != 1 or args[0] not in BENCHMARKS:
+    parser.error('Specify one benchmark.')
+  BENCHMARKS[args[0]](options)
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
@@ -3,9 +3,11 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import errno
 import os
-import StringIO
 import sys
+import threading
+import unittest
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
@@ -26,14 +28,19 @@ class GclientUtilBase(SuperMoxTestBase):
 
 class CheckCallAndFilterTestCase(GclientUtilBase):
   class ProcessIdMock(object):
-    def __init__(self, test_string):
-      self.stdout = StringIO.StringIO(test_string)
+    class StdoutMock(object):
+      # pylint: disable=no-self-use
+      def fileno(self):
+        return 42
+
+    def __init__(self):
+      self.stdout = self.StdoutMock()
       self.pid = 9284
     # pylint: disable=no-self-use
     def wait(self):
       return 0
 
-  def _inner(self, args, test_string):
+  def _inner(self, args, test_string, expected_lines=None, chunk_size=None):
     cwd = 'bleh'
     gclient_utils.sys.stdout.write(
         '\n________ running \'boo foo bar\' in \'bleh\'\n')
@@ -45,9 +52,15 @@ class CheckCallAndFilterTestCase(GclientUtilBase):
         cwd=cwd,
         stdout=subprocess2.PIPE,
         stderr=subprocess2.STDOUT,
-        bufsize=0).AndReturn(self.ProcessIdMock(test_string))
+        bufsize=0).AndReturn(self.ProcessIdMock())
 
     os.getcwd()
+    # The child's output is read in chunks from its file descriptor.
+    chunk_size = chunk_size or len(test_string)
+    for i in xrange(0, len(test_string), chunk_size):
+      os.read(42, gclient_utils.READ_CHUNK_SIZE).AndReturn(
+          test_string[i:i + chunk_size])
+    os.read(42, gclient_utils.READ_CHUNK_SIZE).AndReturn('')
     self.mox.ReplayAll()
     compiled_pattern = gclient_utils.re.compile(r'a(.*)b')
     line_list = []
@@ -60,7 +73,8 @@ class CheckCallAndFilterTestCase(GclientUtilBase):
         capture_list.append(match.group(1))
     gclient_utils.CheckCallAndFilterAndHeader(
         args, cwd=cwd, always=True, filter_fn=FilterLines)
-    self.assertEquals(line_list, ['ahah', 'accb', 'allo', 'addb'])
+    self.assertEquals(
+        line_list, expected_lines or ['ahah', 'accb', 'allo', 'addb'])
     self.assertEquals(capture_list, ['cc', 'dd'])
 
   def testCheckCallAndFilter(self):
@@ -81,6 +95,24 @@ class CheckCallAndFilterTestCase(GclientUtilBase):
         'ahah\naccb\nallo\naddb\n'
         '________ running \'boo foo bar\' in \'bleh\'\nahah\naccb\nallo\naddb')
 
+  def testCRLF(self):
+    args = ['boo', 'foo', 'bar']
+    test_string = 'ahah\r\naccb\rallo\n\naddb'
+    self._inner(args, test_string, ['ahah', '', 'accb', 'allo', '', 'addb'])
+    self.checkstdout('\n________ running \'boo foo bar\' in \'bleh\'\n'
+        + test_string +
+        '\n________ running \'boo foo bar\' in \'bleh\'\n' + test_string)
+
+  def testSmallChunks(self):
+    # Lines spanning several reads are passed whole to filter_fn.
+    args = ['boo', 'foo', 'bar']
+    test_string = 'ahah\naccb\nallo\naddb\n'
+    self._inner(args, test_string, chunk_size=3)
+    self.checkstdout('\n________ running \'boo foo bar\' in \'bleh\'\n'
+        'ahah\naccb\nallo\naddb\n\n'
+        '________ running \'boo foo bar\' in \'bleh\'\nahah\naccb\nallo\naddb'
+        '\n')
+
 
 class SplitUrlRevisionTestCase(GclientUtilBase):
   def testSSHUrl(self):
@@ -143,6 +175,194 @@ class SplitUrlRevisionTestCase(GclientUtilBase):
     self.assertEquals(out_url, url)
 
 
+class FakeWorkItem(gclient_utils.WorkItem):
+  def __init__(self, name, requirements=(), resources=(), on_run=None,
+               priority=0):
+    super(FakeWorkItem, self).__init__(name)
+    self._requirements = list(requirements)
+    self.resources.extend(resources)
+    self.on_run = on_run
+    self._priority = priority
+
+  @property
+  def requirements(self):
+    return tuple(self._requirements)
+
+  @property
+  def priority(self):
+    return self._priority
+
+  # Arguments number differs from overridden method
+  # pylint: disable=arguments-differ
+  def run(self, ran, work_queue):
+    ran.append(self.name)
+    if self.on_run:
+      self.on_run(work_queue)
+
+
+class ExecutionQueueTestCase(unittest.TestCase):
+  def _flush(self, items, jobs=1, ignore_requirements=False):
+    ran = []
+    queue = gclient_utils.ExecutionQueue(jobs, None, ignore_requirements)
+    for item in items:
+      queue.enqueue(item)
+    queue.flush(ran)
+    return ran, queue
+
+  def testRequirementsOrder(self):
+    ran, queue = self._flush([
+        FakeWorkItem('c', ['a', 'b']),
+        FakeWorkItem('b', ['a']),
+        FakeWorkItem('a'),
+        FakeWorkItem('d'),
+    ])
+    self.assertEquals(['a', 'b', 'c', 'd'], ran)
+    self.assertEquals(ran, queue.ran)
+    self.assertEquals({}, queue.queued)
+
+  def testPriority(self):
+    ran, _ = self._flush([
+        FakeWorkItem('a'),
+        FakeWorkItem('b', priority=10),
+        FakeWorkItem('c', ['a'], priority=20),
+        FakeWorkItem('d', priority=10),
+    ])
+    self.assertEquals(['b', 'd', 'a', 'c'], ran)
+
+  def testIgnoreRequirements(self):
+    ran, _ = self._flush(
+        [FakeWorkItem('b', ['a']), FakeWorkItem('a')],
+        ignore_requirements=True)
+    self.assertEquals(['b', 'a'], ran)
+
+  def testEnqueuedWhileRunning(self):
+    child = FakeWorkItem('a/child', ['a', 'b'])
+    ran, _ = self._flush([
+        FakeWorkItem('a', on_run=lambda q: q.enqueue(child)),
+        FakeWorkItem('b'),
+    ])
+    self.assertEquals(['a', 'b', 'a/child'], ran)
+
+  def testLateAncestorBlocksDescendant(self):
+    # 'x/y' is queued before its parent directory 'x' is known; once 'x' is
+    # enqueued, 'x/y' requirements include it.
+    descendant = FakeWorkItem('x/y')
+    ancestor = FakeWorkItem('x')
+    def add_ancestor(queue):
+      descendant._requirements.append('x')
+      queue.enqueue(ancestor)
+    ran, _ = self._flush([
+        FakeWorkItem('first', on_run=add_ancestor),
+        descendant,
+    ])
+    self.assertEquals(['first', 'x', 'x/y'], ran)
+
+  def testResourcesJobs(self):
+    items = [FakeWorkItem(str(i), resources=['url']) for i in xrange(10)]
+    ran, _ = self._flush(items, jobs=4)
+    self.assertEquals(sorted(str(i) for i in xrange(10)), sorted(ran))
+
+  def testStages(self):
+    # Stands in for a slow git server: each dependency fetches then checks out,
+    # and the maximum concurrency of each stage is recorded.
+    lock = threading.Lock()
+    active = {'fetch': 0, 'checkout': 0}
+    peak = {'fetch': 0, 'checkout': 0}
+    overlaps = []
+    # The first checkout waits for the second one, so that two checkouts run
+    # at once, and the second fetch runs during the first checkout, whatever
+    # the timing.
+    two_checkouts = threading.Event()
+    def stage(name):
+      with lock:
+        active[name] += 1
+        peak[name] = max(peak[name], active[name])
+        overlaps.append(active['fetch'] and active['checkout'])
+        if active['checkout'] == 2:
+          two_checkouts.set()
+      if name == 'checkout':
+        two_checkouts.wait(10)
+      with lock:
+        active[name] -= 1
+    def on_run(work_queue):
+      with work_queue.stages.stage('fetch'):
+        stage('fetch')
+      with work_queue.stages.stage('checkout'):
+        stage('checkout')
+
+    items = [FakeWorkItem(str(i), on_run=on_run) for i in xrange(6)]
+    work_queue = gclient_utils.ExecutionQueue(
+        4, None, False, stage_limits={'fetch': 1, 'checkout': 2})
+    for item in items:
+      work_queue.enqueue(item)
+    ran = []
+    work_queue.flush(ran)
+    self.assertEquals(6, len(ran))
+    self.assertEquals({'fetch': 1, 'checkout': 2}, peak)
+    # Checkouts ran while the next fetches were in progress.
+    self.assertTrue(any(overlaps))
+
+  def testStagesUnlimited(self):
+    stages = gclient_utils.ConcurrencyLimits({'fetch': 0})
+    self.assertEquals({}, stages.limits)
+    with stages.stage('fetch'):
+      with stages.stage(None):
+        pass
+
+
+class TaskOutputTestCase(unittest.TestCase):
+  def testSpill(self):
+    output = gclient_utils.TaskOutput(max_memory=8)
+    for data in ('ab', 'cdef', 'ghijklm', 'n', '', 'opqrstu'):
+      output.write(data)
+    self.assertTrue(output.spilled)
+    self.assertEquals('abcdefghijklmnopqrstu', output.getvalue())
+    # Only 4 bytes of head and 4 bytes of tail are in memory.
+    self.assertEquals(['ab', 'cd'], output._head)
+    self.assertEquals(['rstu'], list(output._tail))
+    output.clear()
+    self.assertFalse(output.spilled)
+    output.write('x')
+    self.assertEquals('x', output.getvalue())
+
+  def testUnlimited(self):
+    output = gclient_utils.TaskOutput(max_memory=0)
+    output.write('a' * 10000)
+    self.assertFalse(output.spilled)
+    self.assertEquals('a' * 10000, output.getvalue())
+
+  def testQueueMaxTaskOutput(self):
+    spilled = []
+    def on_run(_):
+      item.outbuf.write('a' * 100)
+      spilled.append(item.outbuf.spilled)
+    item = FakeWorkItem('a', on_run=on_run)
+    queue = gclient_utils.ExecutionQueue(1, None, False, max_task_output=8)
+    queue.enqueue(item)
+    queue.flush([])
+    self.assertEquals([True], spilled)
+
+  def testPrint(self):
+    output = gclient_utils.TaskOutput(max_memory=4)
+    print >> output, '  \n start'
+    print >> output, 'middle  ',
+    print >> output, 'end\n\n'
+    stream = gclient_utils.TaskOutput(max_memory=0)
+    output.write_to(stream, strip=True)
+    self.assertEquals('start\nmiddle   end', stream.getvalue())
+
+  def testPrintTaskOutput(self):
+    item = FakeWorkItem('a')
+    item.outbuf = gclient_utils.TaskOutput(max_memory=16)
+    item.outbuf.write('\nline\n' * 100)
+    stream = gclient_utils.TaskOutput(max_memory=0)
+    gclient_utils.ExecutionQueue.print_task_output(stream, item, 'ERROR')
+    self.assertEquals(
+        '\na (ERROR)\n%s\n%s\n%s\n' % (
+            '-' * 40, '\n\n'.join(['line'] * 100), '-' * 40),
+        stream.getvalue())
+
+
 class GClientUtilsTest(trial_dir.TestCase):
   def testHardToDelete(self):
     # Use the fact that tearDown will delete the directory to make it hard to do
@@ -160,6 +380,49 @@ class GClientUtilsTest(trial_dir.TestCase):
     os.chmod(l2, 0)
     os.chmod(l1, 0)
 
+  def _MakeTree(self):
+    root = os.path.join(self.root_dir, 'tree')
+    for i in xrange(3):
+      for j in xrange(3):
+        d = os.path.join(root, 'd%d' % i, 'd%d' % j)
+        os.makedirs(d)
+        for k in xrange(5):
+          gclient_utils.FileWrite(os.path.join(d, 'f%d' % k), 'foo')
+        os.chmod(d, 0)
+    # Links are deleted, not followed.
+    outside = os.path.join(self.root_dir, 'outside')
+    os.mkdir(outside)
+    gclient_utils.FileWrite(os.path.join(outside, 'f'), 'foo')
+    os.symlink(outside, os.path.join(root, 'd0', 'link'))
+    os.chmod(os.path.join(root, 'd0'), 0)
+    return root
+
+  def testRmtree(self):
+    if sys.platform == 'win32':
+      return
+    for jobs in (1, 4):
+      root = self._MakeTree()
+      gclient_utils.rmtree(root, jobs=jobs)
+      self.assertFalse(os.path.exists(root))
+      outside = os.path.join(self.root_dir, 'outside')
+      self.assertTrue(os.path.exists(os.path.join(outside, 'f')))
+      gclient_utils.rmtree(outside)
+
+  def testRmtreeError(self):
+    if sys.platform == 'win32':
+      return
+    root = self._MakeTree()
+    def remove(path):
+      raise OSError(errno.EACCES, 'Permission denied', path)
+    old_remove = gclient_utils.os.remove
+    gclient_utils.os.remove = remove
+    try:
+      with self.assertRaises(OSError):
+        gclient_utils.rmtree(root, jobs=4)
+    finally:
+      gclient_utils.os.remove = old_remove
+    self.assertTrue(os.path.exists(root))
+
   def testUpgradeToHttps(self):
     values = [
         ['', ''],
@@ -202,7 +465,6 @@ class GClientUtilsTest(trial_dir.TestCase):
 
 
 if __name__ == '__main__':
-  import unittest
   unittest.main()
 
 # vim: ts=2:sw=2:tw=80:et:
@@ -5,9 +5,14 @@
 
 """Unit tests for git_cache.py"""
 
+import base64
+import hashlib
+import json
 import os
 import shutil
+import subprocess
 import sys
+import tarfile
 import tempfile
 import unittest
 
@@ -17,6 +22,51 @@ sys.path.insert(0, DEPOT_TOOLS_ROOT)
 from testing_support import coverage_utils
 import git_cache
 
+
+# Commits in the test repositories don't depend on the global git config.
+GIT_IDENTITY = {
+    'GIT_AUTHOR_NAME': 'Test',
+    'GIT_AUTHOR_EMAIL': 'test@example.com',
+    'GIT_COMMITTER_NAME': 'Test',
+    'GIT_COMMITTER_EMAIL': 'test@example.com',
+}
+
+
+class LocalGsutil(object):
+  """Stand-in for download_from_google_storage.Gsutil serving gs:// urls from
+  a local directory."""
+  def __init__(self, root):
+    self.root = root
+
+  def local_path(self, url):
+    return os.path.join(self.root, url[len('gs://'):])
+
+  def check_call(self, cmd, url):
+    path = self.local_path(url)
+    if cmd == 'ls':
+      if not os.path.isdir(path):
+        return 1, '', ''
+      return 0, ''.join(
+          '%s/%s\n' % (url, name) for name in os.listdir(path)), ''
+    assert cmd == 'stat'
+    with open(path, 'rb') as f:
+      md5 = hashlib.md5(f.read()).digest()
+    return 0, '    Hash (md5):             %s\n' % base64.b64encode(md5), ''
+
+  def call(self, cmd, *args):
+    paths = [self.local_path(a) if a.startswith('gs://') else a for a in args]
+    if cmd == 'rm':
+      os.remove(paths[0])
+    else:
+      assert cmd == 'cp'
+      shutil.copy(*paths)
+    return 0
+
+  def stream(self, url):
+    return subprocess.Popen(
+        ['cat', self.local_path(url)], stdout=subprocess.PIPE)
+
+
 class GitCacheTest(unittest.TestCase):
   @classmethod
   def setUpClass(cls):
@@ -27,6 +77,33 @@ class GitCacheTest(unittest.TestCase):
   def tearDownClass(cls):
     shutil.rmtree(cls.cache_dir, ignore_errors=True)
 
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp(prefix='git_cache_test_tmp_')
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp, ignore_errors=True)
+
+  @staticmethod
+  def _git(cwd, *args):
+    """Runs git in |cwd| and returns its stripped output."""
+    env = os.environ.copy()
+    env.update(GIT_IDENTITY)
+    return subprocess.check_output(('git',) + args, cwd=cwd, env=env).strip()
+
+  def _MakeRepo(self, name='repo'):
+    """Creates a repository with one empty commit in the temporary directory
+    and returns its path."""
+    repo = os.path.join(self.tmp, name)
+    self._git(self.tmp, 'init', '-q', repo)
+    self._git(repo, 'commit', '-q', '--allow-empty', '-m', name)
+    return repo
+
+  @staticmethod
+  def _Mirror(url, **kwargs):
+    """Returns a Mirror of |url| which doesn't print anything."""
+    return git_cache.Mirror(
+        url, print_func=lambda *_args, **_kwargs: None, **kwargs)
+
   def testParseFetchSpec(self):
     testData = [
         ([], []),
@@ -51,6 +128,270 @@ class GitCacheTest(unittest.TestCase):
       mirror = git_cache.Mirror('test://phony.example.biz', refs=fetch_specs)
       self.assertItemsEqual(mirror.fetch_specs, expected)
 
+  def testPopulateFetchSpecs(self):
+    origin = self._MakeRepo('origin')
+    self._git(origin, 'branch', 'other')
+    self._git(origin, 'update-ref', 'refs/branch-heads/1', 'HEAD')
+    self._git(origin, 'commit', '-q', '--allow-empty', '-m', 'second')
+    self._git(origin, 'update-ref', 'refs/foo/bar', 'HEAD')
+    mirror = self._Mirror(
+        'file://' + origin,
+        refs=['refs/branch-heads/*', 'refs/foo/*:refs/foo/*'])
+    fetches = []
+    run_git = mirror.RunGit
+    def RunGit(cmd, **kwargs):
+      if cmd[0] == 'fetch':
+        fetches.append(cmd)
+      run_git(cmd, **kwargs)
+    mirror.RunGit = RunGit
+    mirror.populate()
+    # One negotiation with the server for all the fetch specs.
+    self.assertEquals(1, len(fetches))
+    refs = self._git(
+        mirror.mirror_path, 'for-each-ref', '--format=%(refname)').split()
+    self.assertIn('refs/heads/other', refs)
+    self.assertIn('refs/branch-heads/1', refs)
+    self.assertIn('refs/foo/bar', refs)
+
+    # A missing ref fails the fetch of all the specs; the others are still
+    # fetched one by one.
+    self._git(origin, 'commit', '-q', '--allow-empty', '-m', 'third')
+    self._git(origin, 'branch', 'third')
+    mirror = self._Mirror('file://' + origin, refs=['refs/missing'])
+    mirror.populate()
+    refs = self._git(
+        mirror.mirror_path, 'for-each-ref', '--format=%(refname)').split()
+    self.assertIn('refs/heads/third', refs)
+
+  def testStreamBootstrap(self):
+    repo = os.path.join(self.tmp, 'repo')
+    self._git(self.tmp, 'init', '-q', '--bare', repo)
+    mirror = self._Mirror('https://example.com/foo')
+    mirror.GetGsutil = lambda: LocalGsutil(os.path.join(self.tmp, 'gs'))
+    folder = os.path.join(
+        self.tmp, 'gs', mirror.bootstrap_bucket, mirror.basedir)
+    os.makedirs(folder)
+    # The zipfile of the same version is ignored.
+    with open(os.path.join(folder, '123.zip'), 'w') as f:
+      f.write('not a zipfile')
+    with tarfile.open(os.path.join(folder, '123.tar'), 'w') as tar:
+      tar.add(repo, '.')
+
+    directory = os.path.join(self.tmp, 'out')
+    os.mkdir(directory)
+    self.assertTrue(mirror.bootstrap_repo(directory))
+    self.assertTrue(os.path.isfile(os.path.join(directory, 'HEAD')))
+    self.assertTrue(os.path.isdir(os.path.join(directory, 'objects')))
+
+    # A download cut short is detected and nothing is left behind.
+    gsutil = LocalGsutil(os.path.join(self.tmp, 'gs'))
+    gsutil.stream = lambda url: subprocess.Popen(
+        ['head', '-c', '2000', gsutil.local_path(url)],
+        stdout=subprocess.PIPE)
+    mirror.GetGsutil = lambda: gsutil
+    shutil.rmtree(directory)
+    os.mkdir(directory)
+    self.assertFalse(mirror.bootstrap_repo(directory))
+    self.assertEquals([], os.listdir(directory))
+
+  def testStreamBootstrapChecksMd5(self):
+    repo = os.path.join(self.tmp, 'repo')
+    self._git(self.tmp, 'init', '-q', '--bare', repo)
+    mirror = self._Mirror('https://example.com/foo')
+    gsutil = LocalGsutil(os.path.join(self.tmp, 'gs'))
+    check_call = gsutil.check_call
+    def corrupt_stat(cmd, url):
+      code, out, err = check_call(cmd, url)
+      if cmd == 'stat':
+        out = out.replace('=', 'A')
+      return code, out, err
+    gsutil.check_call = corrupt_stat
+    mirror.GetGsutil = lambda: gsutil
+    folder = os.path.join(
+        self.tmp, 'gs', mirror.bootstrap_bucket, mirror.basedir)
+    os.makedirs(folder)
+    with tarfile.open(os.path.join(folder, '123.tar'), 'w') as tar:
+      tar.add(repo, '.')
+    directory = os.path.join(self.tmp, 'out')
+    os.mkdir(directory)
+    self.assertFalse(mirror.bootstrap_repo(directory))
+    self.assertEquals([], os.listdir(directory))
+
+    # Without an md5, the tarball isn't even downloaded.
+    gsutil.check_call = lambda cmd, url: (
+        check_call(cmd, url) if cmd == 'ls' else (0, '', ''))
+    streamed = []
+    gsutil.stream = streamed.append
+    self.assertFalse(mirror.bootstrap_repo(directory))
+    self.assertEquals([], streamed)
+
+  def testBootstrapBundles(self):
+    repo = self._MakeRepo()
+    mirror = self._Mirror('file://' + repo)
+    gsutil = LocalGsutil(os.path.join(self.tmp, 'gs'))
+    mirror.GetGsutil = lambda: gsutil
+    gs_folder = 'gs://%s/%s' % (mirror.bootstrap_bucket, mirror.basedir)
+    os.makedirs(gsutil.local_path(gs_folder))
+    # A full bootstrap of the mirror at generation 1.
+    self._git(self.tmp, 'clone', '-q', '--mirror', repo, mirror.mirror_path)
+    with tarfile.open(gsutil.local_path(gs_folder + '/1.tar'), 'w') as tar:
+      tar.add(mirror.mirror_path, '.')
+    with open(gsutil.local_path(gs_folder + '/1.heads'), 'w') as f:
+      f.write(self._git(repo, 'show-ref') + '\n')
+
+    # The mirror uploads bundles of what changed since.
+    self._git(repo, 'commit', '-q', '--allow-empty', '-m', 'second')
+    self._git(mirror.mirror_path, 'fetch', '-q', 'origin',
+              '+refs/heads/*:refs/heads/*')
+    # pylint: disable=protected-access
+    self.assertTrue(mirror._upload_bundle(gsutil, gs_folder, '2', 2))
+    self._git(repo, 'commit', '-q', '--allow-empty', '-m', 'third')
+    self._git(mirror.mirror_path, 'fetch', '-q', 'origin',
+              '+refs/heads/*:refs/heads/*')
+    self.assertTrue(mirror._upload_bundle(gsutil, gs_folder, '3', 2))
+    self.assertEquals(
+        ['1-2.bundle', '1.heads', '1.tar', '2-3.bundle'],
+        sorted(os.listdir(gsutil.local_path(gs_folder))))
+    # The chain is full, a full bootstrap is needed.
+    self.assertFalse(mirror._upload_bundle(gsutil, gs_folder, '4', 2))
+
+    directory = os.path.join(self.tmp, 'out')
+    os.mkdir(directory)
+    self.assertTrue(mirror.bootstrap_repo(directory))
+    self.assertEquals(
+        self._git(repo, 'rev-parse', 'HEAD'),
+        self._git(directory, 'rev-parse', 'refs/heads/master'))
+
+  def testPopulateBatch(self):
+    urls = ['file://' + self._MakeRepo(name) for name in ('a', 'b')]
+    batch = os.path.join(self.tmp, 'urls')
+    with open(batch, 'w') as f:
+      # The same repo twice is only populated once.
+      f.write('%s\n%s\n' % (urls[1], urls[1]))
+    summary = os.path.join(self.tmp, 'summary.json')
+    self.assertEquals(0, git_cache.main(
+        ['populate', '-q', '--no-bootstrap', '--batch', batch,
+         '--json', summary, urls[0]]))
+    with open(summary) as f:
+      results = json.load(f)['mirrors']
+    self.assertEquals(
+        [(urls[0], None), (urls[1], None)],
+        [(r['url'], r['error']) for r in results])
+    for result in results:
+      self.assertTrue(os.path.isdir(result['mirror_path']))
+
+    # A mirror which can't even be created fails, the others still run.
+    old_path = git_cache.Mirror.__dict__['GetCachePath']
+    def GetCachePath():
+      raise RuntimeError('No cache.cachepath')
+    git_cache.Mirror.GetCachePath = staticmethod(GetCachePath)
+    try:
+      self.assertEquals(1, git_cache.main(
+          ['populate', '-q', '--no-bootstrap', '--json', summary, '--batch',
+           batch, urls[0]]))
+    finally:
+      git_cache.Mirror.GetCachePath = old_path
+    with open(summary) as f:
+      results = json.load(f)['mirrors']
+    self.assertEquals(
+        [(urls[0], 'No cache.cachepath'), (urls[1], 'No cache.cachepath')],
+        [(r['url'], r['error']) for r in results])
+
+  def testPopulateFromGclient(self):
+    repo = self._MakeRepo()
+    with open(os.path.join(self.tmp, '.gclient'), 'w') as f:
+      f.write('solutions = [{"name": "src", "url": "file://%s"}]\n'
+              'cache_dir = "cache"\n' % repo)
+    old_cwd = os.getcwd()
+    os.chdir(self.tmp)
+    try:
+      self.assertEquals(0, git_cache.main(
+          ['populate', '-q', '--no-bootstrap', '--from-gclient']))
+    finally:
+      os.chdir(old_cwd)
+      git_cache.Mirror.SetCachePath(self.cache_dir)
+    # The cache of the .gclient file is populated, not the global one.
+    self.assertTrue(os.path.isfile(os.path.join(
+        self.tmp, 'cache', git_cache.Mirror.UrlToCacheDir('file://' + repo),
+        'config')))
+
+  def testMaintain(self):
+    repo = os.path.join(self.tmp, 'repo')
+    self._git(self.tmp, 'init', '-q', repo)
+    mirror = self._Mirror('file://' + repo)
+    old_limit = git_cache.GC_AUTOPACKLIMIT
+    try:
+      # Each fetch writes its own pack.
+      for i in xrange(4):
+        with open(os.path.join(repo, 'file'), 'w') as f:
+          f.write('%d\n' % i * 1000)
+        self._git(repo, 'add', 'file')
+        self._git(repo, 'commit', '-q', '-m', str(i))
+        mirror.populate()
+        self._git(mirror.mirror_path, 'config', 'transfer.unpackLimit', '1')
+      self.assertEquals(3, git_cache.Mirror.CountPackFiles(mirror.mirror_path))
+      pack_dir = os.path.join(mirror.mirror_path, 'objects', 'pack')
+      with open(os.path.join(pack_dir, 'tmp_pack_foo'), 'w'):
+        pass
+      marker = os.path.join(mirror.mirror_path, 'marker')
+      with open(marker, 'w'):
+        pass
+
+      # Too many packs: the mirror is maintained, not re-bootstrapped.
+      git_cache.GC_AUTOPACKLIMIT = 2
+      mirror.populate(bootstrap=False)
+      self.assertTrue(os.path.exists(marker))
+      self.assertTrue(
+          git_cache.Mirror.CountPackFiles(mirror.mirror_path) <= 2)
+      self.assertFalse(os.path.exists(os.path.join(pack_dir, 'tmp_pack_foo')))
+      if git_cache.Mirror.GitVersion() >= (2, 22):
+        self.assertTrue(
+            os.path.exists(os.path.join(pack_dir, 'multi-pack-index')))
+        self.assertTrue(os.path.isdir(os.path.join(
+            mirror.mirror_path, 'objects', 'info', 'commit-graphs')))
+      self._git(mirror.mirror_path, 'fsck', '--no-dangling')
+    finally:
+      git_cache.GC_AUTOPACKLIMIT = old_limit
+
+  def testMaintainFails(self):
+    mirror = self._Mirror('file://' + self._MakeRepo())
+    mirror.populate()
+    run_git = mirror.RunGit
+    def RunGit(cmd, **kwargs):
+      if cmd[0] == 'repack':
+        raise subprocess.CalledProcessError(1, cmd)
+      run_git(cmd, **kwargs)
+    mirror.RunGit = RunGit
+    old_limit = git_cache.GC_AUTOPACKLIMIT
+    try:
+      # Maintenance fails: populate falls back to re-bootstrapping, which
+      # fails without a bootstrap, and keeps the mirror.
+      git_cache.GC_AUTOPACKLIMIT = 0
+      mirror.populate(bootstrap=False)
+      self.assertTrue(mirror.exists())
+    finally:
+      git_cache.GC_AUTOPACKLIMIT = old_limit
+
+  def testMaintainAll(self):
+    cache_dir = os.path.join(self.tmp, 'cache')
+    repo = self._MakeRepo()
+    # The name of this mirror can't be converted back to its file:// url.
+    git_cache.Mirror.SetCachePath(cache_dir)
+    try:
+      mirror = self._Mirror('file://' + repo)
+      mirror.populate()
+      # Nor can this one, which has no url at all.
+      self._git(
+          self.tmp, 'init', '-q', '--bare', os.path.join(cache_dir, 'broken'))
+      self.assertEquals(0, git_cache.main(
+          ['maintain', '-q', '--all', '-c', cache_dir]))
+      if git_cache.Mirror.GitVersion() >= (2, 21):
+        self.assertTrue(os.path.exists(os.path.join(
+            mirror.mirror_path, 'objects', 'pack', 'multi-pack-index')))
+    finally:
+      git_cache.Mirror.SetCachePath(self.cache_dir)
+
+
 if __name__ == '__main__':
   sys.exit(coverage_utils.covered_main((
     os.path.join(DEPOT_TOOLS_ROOT, 'git_cache.py')